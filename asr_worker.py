@@ -0,0 +1,131 @@
+"""
+long-lived asrtranslate worker, started by the task manager's worker pool
+with the python of the asrtranslate venv:
+
+    .venv/bin/python asr_worker.py --module asrtranslate --reply-fd 3
+
+asrtranslate is imported once, then every request runs it in this process
+as `python -m asrtranslate <argv>` would. Requests are JSON lines on stdin
+({"argv": [...]}), replies JSON lines on the reply fd ({"return_code": 0,
+...}). The output of asrtranslate stays on stdout/stderr, END_MARKER is
+written to both after every request. Only the standard library is used
+here, it runs in asrtranslate's interpreter.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import resource
+import runpy
+import sys
+import traceback
+
+# written on its own line to stdout and stderr after every request
+END_MARKER = "\x00task-manager-request-end"
+
+
+def exit_code(code: object) -> int:
+    """
+    the return code of a process that raised SystemExit(code).
+    """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+def reset_peak_rss() -> bool:
+    """
+    start measuring this process's peak memory (VmHWM) over again, so it
+    is the peak of the next run and not of the worker's whole life.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb() -> int | None:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def run(module: str, argv: list[str]) -> int:
+    sys.argv = [module, *argv]
+    try:
+        runpy.run_module(module, run_name="__main__", alter_sys=True)
+    except SystemExit as e:
+        return exit_code(e.code)
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="asrtranslate")
+    parser.add_argument("--reply-fd", type=int, required=True)
+    parser.add_argument("--preload", default="", help="comma separated modules to import")
+    args = parser.parse_args()
+
+    replies = os.fdopen(args.reply_fd, "w", encoding="utf-8")
+    requests = sys.stdin
+    # asrtranslate must not read the requests
+    sys.stdin = open(os.devnull, "r")
+
+    # the startup cost paid once per worker instead of once per run
+    for name in [args.module, *filter(None, args.preload.split(","))]:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            traceback.print_exc()
+    replies.write(json.dumps({"ready": True, "pid": os.getpid()}) + "\n")
+    replies.flush()
+
+    cwd = os.getcwd()
+    for line in requests:
+        request = json.loads(line)
+        cpu_before = cpu_seconds()
+        peak_reset = reset_peak_rss()
+        return_code = run(args.module, request["argv"])
+        os.chdir(cwd)
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+            stream.write(f"\n{END_MARKER}\n")
+            stream.flush()
+        replies.write(
+            json.dumps(
+                {
+                    "return_code": return_code,
+                    "cpu_seconds": cpu_seconds() - cpu_before,
+                    # without a reset, the peak would be the worker's so far
+                    "max_rss_kb": peak_rss_kb() if peak_reset else None,
+                }
+            )
+            + "\n"
+        )
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()
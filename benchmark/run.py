@@ -0,0 +1,511 @@
+"""
+benchmark of the task manager: starts the server (python -m uvicorn
+main:app) on a stub asrtranslate and a local SMTP sink, drives it with
+uploads, status polling and job listing, and reports latency percentiles,
+jobs/hour and memory use over time.
+
+    python benchmark/run.py --jobs 200 --concurrency 8 --save main
+    python benchmark/run.py --jobs 200 --concurrency 8 --compare main
+
+--save writes the results to benchmark/baselines/<name>.json, --compare
+reports the change against such a baseline and exits with 1 when a
+latency, jobs/hour or peak memory got worse by more than --tolerance.
+Everything the server writes goes to a temporary directory (--keep keeps
+it, with the server's log).
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+
+from smtp_sink import SmtpSink
+
+logger = logging.getLogger(__name__)
+
+THIS_DIR = Path(__file__).parent
+REPO_DIR = THIS_DIR.parent
+BASELINE_DIR = THIS_DIR / "baselines"
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+# seconds to wait for the server to answer after starting it
+STARTUP_TIMEOUT = 60
+REQUEST_TIMEOUT = 60
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(values: list[float], scale: float = 1.0) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        **{name: round(percentile(values, f) * scale, 2) for name, f in PERCENTILES.items()},
+        "max": round(max(values) * scale, 2),
+    }
+
+
+class Latencies:
+    """
+    seconds taken by each kind of request, recorded from many threads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._values.setdefault(name, []).append(seconds)
+
+    def error(self, name: str) -> None:
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {name: summarize(values, 1000) for name, values in self._values.items()}
+
+
+def process_tree_rss_kb(pid: int) -> tuple[int, int]:
+    """
+    resident memory of pid and of all of its descendants, in KB.
+    """
+    children: dict[int, list[int]] = {}
+    for stat in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+
+    def rss_kb(process: int) -> int:
+        try:
+            for line in Path(f"/proc/{process}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    descendants, stack = [], list(children.get(pid, []))
+    while stack:
+        process = stack.pop()
+        descendants.append(process)
+        stack.extend(children.get(process, []))
+    return rss_kb(pid), sum(rss_kb(process) for process in descendants)
+
+
+class MemorySampler:
+    """
+    resident memory of the server and of its asrtranslate processes,
+    sampled every interval seconds in a daemon thread.
+    """
+
+    def __init__(self, pid: int, interval: float) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.samples: list[tuple[float, float, float]] = []  # seconds, server MB, children MB
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory", daemon=True)
+
+    def _run(self) -> None:
+        started = time.time()
+        while not self._stopped.is_set():
+            server_kb, children_kb = process_tree_rss_kb(self.pid)
+            self.samples.append(
+                (
+                    round(time.time() - started, 1),
+                    round(server_kb / 1024, 1),
+                    round(children_kb / 1024, 1),
+                )
+            )
+            self._stopped.wait(self.interval)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {}
+        server = [sample[1] for sample in self.samples]
+        total = [sample[1] + sample[2] for sample in self.samples]
+        return {
+            "server_start_mb": server[0],
+            "server_end_mb": server[-1],
+            "server_peak_mb": max(server),
+            "total_peak_mb": max(total),
+            "samples": self.samples,
+        }
+
+
+def document(number: int, size_kb: int) -> bytes:
+    """
+    a text document of about size_kb, unique so the result cache never hits.
+    """
+    paragraph = " ".join(
+        "".join(random.choices(string.ascii_lowercase, k=random.randint(2, 9))) for _ in range(120)
+    )
+    body = [f"benchmark document {number} {time.time_ns()}"]
+    while sum(len(part) + 2 for part in body) < size_kb * 1024:
+        body.append(paragraph)
+    return "\n\n".join(body).encode()
+
+
+class LoadGenerator:
+    """
+    concurrency submitters, each uploading a job, polling its status until
+    it finished and uploading the next, until jobs jobs were submitted;
+    listers fetch the job list meanwhile.
+    """
+
+    def __init__(self, url: str, args: argparse.Namespace) -> None:
+        self.url = url.rstrip("/")
+        self.args = args
+        self.latencies = Latencies()
+        self.turnaround: list[float] = []
+        self.statuses: dict[str, int] = {}
+        self._numbers = itertools.count()
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def _timed(self, name: str, session: requests.Session, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = session.request(
+                method, f"{self.url}{path}", timeout=REQUEST_TIMEOUT, **kwargs
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            self.latencies.error(name)
+            logger.warning(f"{method} {path} failed: {e}")
+            return None
+        self.latencies.record(name, time.perf_counter() - started)
+        return response
+
+    def submit_loop(self) -> None:
+        session = requests.Session()
+        sizes = self.args.sizes
+        while (number := next(self._numbers)) < self.args.jobs:
+            size_kb = sizes[number % len(sizes)]
+            submitted = time.time()
+            response = self._timed(
+                "upload",
+                session,
+                "POST",
+                f"/tasks/{self.args.languages}",
+                files={"file": (f"bench-{number}.txt", document(number, size_kb))},
+                data={"email": self.args.email} if self.args.email else {},
+            )
+            if response is None:
+                continue
+            job_id = response.json()["job_id"]
+            status = None
+            while status not in FINISHED_STATUSES:
+                time.sleep(self.args.poll_interval)
+                response = self._timed("status", session, "GET", f"/tasks/status/{job_id}")
+                if response is not None:
+                    status = response.json()["status"]
+            with self._lock:
+                self.turnaround.append(time.time() - submitted)
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def list_loop(self) -> None:
+        session = requests.Session()
+        while not self._done.wait(self.args.list_interval):
+            self._timed("list", session, "GET", "/tasks/", params={"limit": 100})
+
+    def run(self) -> float:
+        """
+        drive the load until every job finished, return the wall-clock seconds.
+        """
+        started = time.time()
+        listers = [
+            threading.Thread(target=self.list_loop, name=f"lister-{i}", daemon=True)
+            for i in range(self.args.listers)
+        ]
+        submitters = [
+            threading.Thread(target=self.submit_loop, name=f"submitter-{i}", daemon=True)
+            for i in range(self.args.concurrency)
+        ]
+        for thread in listers + submitters:
+            thread.start()
+        for thread in submitters:
+            thread.join()
+        self._done.set()
+        for thread in listers:
+            thread.join()
+        return time.time() - started
+
+
+def make_stub_checkout(directory: Path) -> Path:
+    """
+    a fake ASRtranslate checkout: the stub as the asrtranslate module and
+    this interpreter as its .venv python.
+    """
+    package = directory / "asrtranslate"
+    package.mkdir(parents=True)
+    shutil.copyfile(THIS_DIR / "stub_asrtranslate.py", package / "__main__.py")
+    (package / "__init__.py").touch()
+    (directory / ".venv/bin").mkdir(parents=True)
+    (directory / ".venv/bin/python").symlink_to(sys.executable)
+    return directory
+
+
+def server_env(args: argparse.Namespace, root: Path, checkout: Path, smtp_port: int) -> dict:
+    mail_config = root / "mail_config.json"
+    mail_config.write_text(
+        json.dumps(
+            {
+                "sender": "benchmark@localhost",
+                "password": "benchmark",
+                "smtp_server": "127.0.0.1",
+                "smtp_port": smtp_port,
+                "use_ntlm": False,
+            }
+        )
+    )
+    env = dict(
+        os.environ,
+        TASK_ASRTRANSLATE_DIR=str(checkout),
+        TASK_JOB_DB=str(root / "jobs.db"),
+        TASK_WORK_QUEUE_DB=str(root / "work_queue.db"),
+        TASK_MAIL_CONFIG=str(mail_config),
+        TASK_EMAIL_DEAD_LETTER=str(root / "email_dead_letter.jsonl"),
+        TASK_TRANSLATOR_VERSION="benchmark-stub",
+        TASK_SCHEDULER_WORKERS=str(args.workers),
+        TASK_WORKER_POOL_SIZE=str(args.pool_size),
+        BENCH_STUB_SECONDS=str(args.stub_seconds),
+        BENCH_STUB_SECONDS_PER_MB=str(args.stub_seconds_per_mb),
+        BENCH_STUB_MEMORY_MB=str(args.stub_memory_mb),
+        BENCH_STUB_FAIL_RATE=str(args.stub_fail_rate),
+        # the pool's workers import the stub instead of asrtranslate
+        PYTHONPATH=str(checkout),
+    )
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        env[key] = value
+    return env
+
+
+def start_server(env: dict, port: int, log: Path) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--port", str(port), "--log-level", "warning",
+        ],
+        cwd=REPO_DIR,
+        env=env,
+        stdout=open(log, "wb"),
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+    )
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with {process.returncode}, see {log}")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1).raise_for_status()
+            return process
+        except requests.RequestException:
+            time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError(f"The server didn't answer within {STARTUP_TIMEOUT}s, see {log}")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGINT)
+        process.wait(timeout=30)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    root = Path(tempfile.mkdtemp(prefix="task-manager-bench-"))
+    sink = SmtpSink()
+    sink.start()
+    checkout = make_stub_checkout(root / "ASRtranslate")
+    env = server_env(args, root, checkout, sink.port)
+    server = start_server(env, args.port, root / "server.log")
+    sampler = MemorySampler(server.pid, args.memory_interval)
+    sampler.start()
+    load = LoadGenerator(f"http://127.0.0.1:{args.port}", args)
+    try:
+        wall_seconds = load.run()
+        # the last emails are sent in the background
+        deadline = time.time() + 10
+        emails = load.statuses.get("done", 0) if args.email else 0
+        while sink.messages < emails and time.time() < deadline:
+            time.sleep(0.2)
+    finally:
+        sampler.stop()
+        stop_server(server)
+        sink.stop()
+        if args.keep:
+            logger.info(f"Kept the server's files in {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    finished = sum(load.statuses.values())
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "settings": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("save", "compare", "tolerance", "keep", "output", "port", "log_level")
+        },
+        "wall_seconds": round(wall_seconds, 1),
+        "jobs": {
+            **load.statuses,
+            "jobs_per_hour": round(finished / wall_seconds * 3600, 1),
+        },
+        "latency_ms": load.latencies.summary(),
+        "errors": load.latencies.errors,
+        "turnaround_seconds": summarize(load.turnaround),
+        "emails_received": sink.messages,
+        "memory": sampler.summary(),
+    }
+
+
+def metrics(results: dict) -> dict[str, tuple[float, bool]]:
+    """
+    the comparable numbers of a result: name -> (value, higher is better).
+    """
+    compared = {"jobs_per_hour": (results["jobs"]["jobs_per_hour"], True)}
+    for name, summary in results["latency_ms"].items():
+        for key in PERCENTILES:
+            if key in summary:
+                compared[f"{name} {key} ms"] = (summary[key], False)
+    for key in ("server_peak_mb", "total_peak_mb"):
+        if key in results["memory"]:
+            compared[key] = (results["memory"][key], False)
+    return compared
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    """
+    print the change of every metric against baseline, return the ones
+    that got worse by more than tolerance (a fraction).
+    """
+    regressions = []
+    before, after = metrics(baseline), metrics(results)
+    print(f"{'metric':<24} {baseline['commit']:>14} {results['commit']:>14} {'change':>8}")
+    for name, (value, higher_is_better) in after.items():
+        if name not in before:
+            continue
+        old = before[name][0]
+        change = (value - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  worse" if worse > tolerance else ""
+        print(f"{name:<24} {old:>14} {value:>14} {change:>+8.1%}{flag}")
+        if worse > tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="load test the task manager on a stub asrtranslate"
+    )
+    parser.add_argument("--jobs", type=int, default=100, help="jobs to submit")
+    parser.add_argument("--concurrency", type=int, default=4, help="jobs in flight at once")
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[10, 100, 1000],
+        help="document sizes in KB, comma separated, used in turn",
+    )
+    parser.add_argument("--languages", default="english+japanese", help="lang_str of the uploads")
+    parser.add_argument("--email", default="benchmark@example.com", help="'' sends no emails")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--listers", type=int, default=1, help="threads listing jobs")
+    parser.add_argument("--list-interval", type=float, default=1.0)
+    parser.add_argument("--memory-interval", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=2, help="TASK_SCHEDULER_WORKERS")
+    parser.add_argument("--pool-size", type=int, default=0, help="TASK_WORKER_POOL_SIZE")
+    parser.add_argument("--stub-seconds", type=float, default=1.0, help="runtime of a stub run")
+    parser.add_argument("--stub-seconds-per-mb", type=float, default=2.0)
+    parser.add_argument("--stub-memory-mb", type=float, default=0)
+    parser.add_argument("--stub-fail-rate", type=float, default=0)
+    parser.add_argument(
+        "--env", action="append", default=[], help="KEY=VALUE for the server, repeatable"
+    )
+    parser.add_argument("--port", type=int, default=3130)
+    parser.add_argument("--save", help="save the results as benchmark/baselines/<name>.json")
+    parser.add_argument("--compare", help="compare with benchmark/baselines/<name>.json")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="allowed regression, 0.2 is 20%%"
+    )
+    parser.add_argument("--output", type=Path, help="also write the results here")
+    parser.add_argument("--keep", action="store_true", help="keep the server's files and log")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(levelname)s %(message)s")
+
+    results = run_benchmark(args)
+    summary = {key: value for key, value in results.items() if key != "memory"}
+    summary["memory"] = {key: value for key, value in results["memory"].items() if key != "samples"}
+    print(json.dumps(summary, indent=2))
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        (BASELINE_DIR / f"{args.save}.json").write_text(json.dumps(results, indent=2))
+    if args.compare:
+        baseline = json.loads((BASELINE_DIR / f"{args.compare}.json").read_text())
+        if baseline["settings"] != results["settings"]:
+            print("warning: the baseline ran with other settings", file=sys.stderr)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+local SMTP server that accepts and counts every message, for benchmarks:
+the task manager's notifier gets to deliver its emails without a real
+mail server. It speaks enough SMTP for smtplib: EHLO, STARTTLS (with a
+self-signed certificate made by the openssl CLI), AUTH PLAIN and LOGIN
+with any credentials, MAIL, RCPT, DATA, NOOP, RSET and QUIT.
+"""
+
+import logging
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def self_signed_context(directory: Path) -> ssl.SSLContext:
+    """
+    a server TLS context with a new certificate for localhost.
+    """
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        raise RuntimeError("The SMTP sink needs the openssl CLI for its STARTTLS certificate")
+    cert, key = directory / "sink.crt", directory / "sink.key"
+    subprocess.run(
+        [
+            openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", str(key), "-out", str(cert),
+            "-days", "1", "-subj", "/CN=localhost",
+        ],
+        capture_output=True,
+        check=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    server: "SmtpSink"
+
+    def reply(self, line: str) -> None:
+        self.wfile.write(f"{line}\r\n".encode())
+        self.wfile.flush()
+
+    def read_line(self) -> str | None:
+        line = self.rfile.readline()
+        return line.decode(errors="replace").rstrip("\r\n") if line else None
+
+    def handle(self) -> None:
+        tls = False
+        self.reply("220 localhost benchmark sink")
+        while (line := self.read_line()) is not None:
+            verb = line.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                extensions = ["AUTH PLAIN LOGIN"] if tls else ["STARTTLS", "AUTH PLAIN LOGIN"]
+                for extension in ["localhost", "8BITMIME", *extensions[:-1]]:
+                    self.reply(f"250-{extension}")
+                self.reply(f"250 {extensions[-1]}")
+            elif verb == "STARTTLS" and not tls:
+                self.reply("220 ready for TLS")
+                self.connection = self.server.tls.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb")
+                tls = True
+            elif verb == "AUTH":
+                if line.upper().startswith("AUTH LOGIN"):
+                    # username, then password, each prompted for
+                    for _ in range(2 - len(line.split()[2:])):
+                        self.reply("334 VXNlcm5hbWU6")
+                        self.read_line()
+                elif len(line.split()) < 3:
+                    self.reply("334 ")
+                    self.read_line()
+                self.reply("235 authenticated")
+            elif verb == "DATA":
+                self.reply("354 end data with <CR><LF>.<CR><LF>")
+                size = 0
+                while (data := self.read_line()) is not None and data != ".":
+                    size += len(data) + 2
+                self.server.received(size)
+                self.reply("250 queued")
+            elif verb == "QUIT":
+                self.reply("221 bye")
+                return
+            elif verb in ("MAIL", "RCPT", "NOOP", "RSET"):
+                self.reply("250 OK")
+            else:
+                self.reply("502 not implemented")
+
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """
+    the sink listening on host:port (port 0 picks a free one), in a daemon
+    thread after start().
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__((host, port), SmtpHandler)
+        self._certs = tempfile.TemporaryDirectory(prefix="smtp-sink-")
+        self.tls = self_signed_context(Path(self._certs.name))
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+        self.received_at: list[float] = []
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def received(self, size: int) -> None:
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+            self.received_at.append(time.time())
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name="smtp-sink", daemon=True).start()
+        logger.info(f"SMTP sink listening on port {self.port}")
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        self._certs.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sink = SmtpSink(port=2525)
+    sink.start()
+    try:
+        while True:
+            time.sleep(10)
+            logger.info(f"{sink.messages} messages, {sink.bytes} bytes")
+    except KeyboardInterrupt:
+        sink.stop()
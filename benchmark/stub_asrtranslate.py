@@ -0,0 +1,60 @@
+"""
+stand-in for asrtranslate in benchmarks, installed by the benchmark as
+asrtranslate/__main__.py of a fake ASRtranslate checkout:
+
+    python -m asrtranslate FILE -o DIR -l LANG
+
+It reports tqdm-like progress on stderr for BENCH_STUB_SECONDS (plus
+BENCH_STUB_SECONDS_PER_MB for every MB of FILE), holds BENCH_STUB_MEMORY_MB
+of memory meanwhile and writes a copy of FILE as DIR/{stem}-{LANG}.idml.
+A run fails with return code 3 at the rate BENCH_STUB_FAIL_RATE (0 to 1).
+Only the standard library is used, it runs in the worker pool's
+interpreter too.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+# progress lines written during a run
+PROGRESS_STEPS = 10
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="asrtranslate")
+    parser.add_argument("file", type=Path)
+    parser.add_argument("-o", "--output-dir", type=Path, required=True)
+    parser.add_argument("-l", "--language", required=True)
+    args = parser.parse_args()
+
+    size_mb = args.file.stat().st_size / 2**20
+    seconds = float(os.environ.get("BENCH_STUB_SECONDS", 1.0)) + size_mb * float(
+        os.environ.get("BENCH_STUB_SECONDS_PER_MB", 0)
+    )
+    ballast = bytearray(int(float(os.environ.get("BENCH_STUB_MEMORY_MB", 0)) * 2**20))
+    # touch every page, so the memory is resident and not only reserved
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+
+    for step in range(PROGRESS_STEPS + 1):
+        bar = "#" * step + " " * (PROGRESS_STEPS - step)
+        sys.stderr.write(f"{100 * step // PROGRESS_STEPS:3d}%|{bar}| {step}/{PROGRESS_STEPS}\n")
+        sys.stderr.flush()
+        if step < PROGRESS_STEPS:
+            time.sleep(seconds / PROGRESS_STEPS)
+
+    if random.random() < float(os.environ.get("BENCH_STUB_FAIL_RATE", 0)):
+        print(f"Error: stub failure translating to {args.language}", file=sys.stderr)
+        return 3
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(args.file, args.output_dir / f"{args.file.stem}-{args.language}.idml")
+    print(f"done {args.language}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
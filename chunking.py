@@ -0,0 +1,296 @@
+import io
+import re
+import shutil
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+# <idPkg:Story src="Stories/Story_u1d8.xml"/> in designmap.xml
+STORY_REFERENCE = re.compile(r'<idPkg:Story\s+src="([^"]+)"\s*/>')
+# Stories/Story_u1d8.xml -> u1d8
+STORY_NAME = re.compile(r"Stories/Story_(\w+)\.xml")
+# a paragraph of a text and the blank lines after it
+PARAGRAPH = re.compile(r".*?(?:\n[ \t]*\n\s*|\Z)", flags=re.S)
+# documents read_segments() and split_document() handle
+SEGMENTED_SUFFIXES = (".idml", ".txt")
+DESIGNMAP = "designmap.xml"
+MIMETYPE = "mimetype"
+# stands for the id of a story in its generic form, see generic()
+STORY_ID_PLACEHOLDER = b'"\x00story\x00"'
+# the name of the segment made of an IDML's other parts, see other_parts()
+OTHER_PARTS = "parts"
+
+
+class ChunkError(Exception):
+    pass
+
+
+@dataclass
+class Segment:
+    name: str  # the story file of an IDML, the paragraph number of a text
+    data: bytes
+
+
+def partition(sizes: list[int], count: int) -> list[list[int]]:
+    """
+    split the indexes of sizes into at most count contiguous groups of
+    roughly equal total size. The result only depends on sizes and count.
+    """
+    total = sum(sizes)
+    groups: list[list[int]] = [[]]
+    filled = 0
+    for i, size in enumerate(sizes):
+        # start the next group once this one reached its share of the total;
+        # empty segments stay with the group before them
+        if (
+            groups[-1]
+            and size
+            and len(groups) < count
+            and filled >= total * len(groups) / count
+        ):
+            groups.append([])
+        groups[-1].append(i)
+        filled += size
+    return groups
+
+
+def write_package(destination: Path | BinaryIO, entries: list[tuple[str, bytes]]) -> None:
+    """
+    write an IDML package; mimetype has to be the first entry, uncompressed.
+    """
+    with zipfile.ZipFile(destination, "w") as package:
+        for name, data in entries:
+            compression = zipfile.ZIP_STORED if name == MIMETYPE else zipfile.ZIP_DEFLATED
+            package.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), data, compression)
+
+
+def read_package(path: Path) -> tuple[list[tuple[str, bytes]], list[str]]:
+    """
+    the entries of an IDML package and its stories in designmap order.
+    """
+    try:
+        with zipfile.ZipFile(path) as package:
+            entries = [(info.filename, package.read(info)) for info in package.infolist()]
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ChunkError(f"{path.name} is not an IDML package: {e}") from e
+    contents = dict(entries)
+    if DESIGNMAP not in contents:
+        raise ChunkError(f"{path.name} has no {DESIGNMAP}")
+    designmap = contents[DESIGNMAP].decode("utf-8")
+    stories = [src for src in STORY_REFERENCE.findall(designmap) if src in contents]
+    return entries, stories
+
+
+def is_idml(path: Path) -> bool:
+    return path.suffix.lower() == ".idml"
+
+
+def read_segments(path: Path) -> list[Segment]:
+    """
+    the independently translatable parts of an IDML (its stories, in
+    designmap order) or of a .txt document (its paragraphs).
+    """
+    if is_idml(path):
+        entries, stories = read_package(path)
+        contents = dict(entries)
+        return [Segment(story, contents[story]) for story in stories]
+    if path.suffix.lower() == ".txt":
+        try:
+            text = path.read_text(encoding="utf-8", errors="replace")
+        except OSError as e:
+            raise ChunkError(f"Can't read {path.name}: {e}") from e
+        paragraphs = [paragraph for paragraph in PARAGRAPH.findall(text) if paragraph]
+        return [
+            Segment(str(number), paragraph.encode("utf-8"))
+            for number, paragraph in enumerate(paragraphs)
+        ]
+    raise ChunkError(f"{path.name} can't be split into segments")
+
+
+def other_parts(path: Path) -> Segment | None:
+    """
+    the parts of an IDML that aren't stories or the designmap, packed into
+    one segment (e.g. to remember them with the stories); None for other
+    documents.
+    """
+    if not is_idml(path):
+        return None
+    entries, stories = read_package(path)
+    skip = {*stories, DESIGNMAP}
+    packed = io.BytesIO()
+    write_package(packed, [(name, data) for name, data in entries if name not in skip])
+    return Segment(OTHER_PARTS, packed.getvalue())
+
+
+def write_document(
+    original: Path,
+    segments: list[Segment],
+    destination: Path,
+    parts_from: Path | Segment | None = None,
+) -> None:
+    """
+    a document like original made of segments only. For an IDML, the other
+    stories are left out of the package and its designmap; the parts that
+    aren't stories or the designmap come from parts_from (a translated
+    package, or its other_parts()) where it has them.
+    """
+    if not is_idml(original):
+        destination.write_bytes(b"".join(segment.data for segment in segments))
+        return
+
+    entries, stories = read_package(original)
+    all_stories = set(stories)
+    own = {segment.name: segment.data for segment in segments}
+    if isinstance(parts_from, Segment):
+        with zipfile.ZipFile(io.BytesIO(parts_from.data)) as package:
+            parts = {info.filename: package.read(info) for info in package.infolist()}
+    elif parts_from is not None:
+        parts = dict(read_package(parts_from)[0])
+    else:
+        parts = {}
+
+    def keep_own(match: re.Match) -> str:
+        return match.group(0) if match.group(1) in own else ""
+
+    document = []
+    for name, data in entries:
+        if name in all_stories:
+            if name in own:
+                document.append((name, own[name]))
+        elif name == DESIGNMAP:
+            designmap = STORY_REFERENCE.sub(keep_own, data.decode("utf-8"))
+            document.append((name, designmap.encode("utf-8")))
+        else:
+            document.append((name, parts.get(name, data)))
+    write_package(destination, document)
+
+
+def translated_segments(sources: list[Segment], output: Path) -> list[Segment]:
+    """
+    the translations of sources in output, the translated document made
+    of them, in the same order.
+    """
+    if is_idml(output) and zipfile.is_zipfile(output):
+        entries, _ = read_package(output)
+        contents = dict(entries)
+        missing = [source.name for source in sources if source.name not in contents]
+        if missing:
+            raise ChunkError(f"Stories missing from {output.name}: {', '.join(missing)}")
+        return [Segment(source.name, contents[source.name]) for source in sources]
+
+    if not output.exists() or zipfile.is_zipfile(output):
+        raise ChunkError(f"{output.name} isn't a translated text")
+    text = output.read_text(encoding="utf-8", errors="replace")
+    paragraphs = [paragraph for paragraph in PARAGRAPH.findall(text) if paragraph]
+    if len(paragraphs) != len(sources):
+        raise ChunkError(
+            f"{output.name} has {len(paragraphs)} paragraphs instead of {len(sources)}"
+        )
+    return [
+        Segment(source.name, paragraph.encode("utf-8"))
+        for source, paragraph in zip(sources, paragraphs)
+    ]
+
+
+def generic(segment: Segment, data: bytes | None = None) -> bytes:
+    """
+    segment (or data, its translation) without what ties it to its
+    document: the id of an IDML story, the blank lines after a paragraph.
+    """
+    data = segment.data if data is None else data
+    if segment.name == OTHER_PARTS:
+        return data
+    story = STORY_NAME.fullmatch(segment.name)
+    if story is not None:
+        return data.replace(f'"{story.group(1)}"'.encode(), STORY_ID_PLACEHOLDER)
+    return data.rstrip()
+
+
+def specific(segment: Segment, data: bytes) -> bytes:
+    """
+    the generic translation data put in the place of segment.
+    """
+    if segment.name == OTHER_PARTS:
+        return data
+    story = STORY_NAME.fullmatch(segment.name)
+    if story is not None:
+        return data.replace(STORY_ID_PLACEHOLDER, f'"{story.group(1)}"'.encode())
+    return data + segment.data[len(segment.data.rstrip()) :]
+
+
+def document_size(path: Path) -> int:
+    """
+    bytes of translatable content: the stories of an IDML, a whole text file.
+    """
+    if is_idml(path):
+        try:
+            with zipfile.ZipFile(path) as package:
+                return sum(
+                    info.file_size
+                    for info in package.infolist()
+                    if info.filename.startswith("Stories/")
+                )
+        except (zipfile.BadZipFile, OSError):
+            return 0
+    if path.suffix.lower() == ".txt":
+        return path.stat().st_size
+    return 0
+
+
+def split_document(path: Path, work_dir: Path, count: int) -> list[Path]:
+    """
+    split an IDML or .txt document into at most count chunks that can be
+    translated independently, in document order. Empty if the document
+    can't be split (other types, a single story or paragraph).
+    """
+    if count < 2 or path.suffix.lower() not in SEGMENTED_SUFFIXES:
+        return []
+    segments = read_segments(path)
+    groups = partition([len(segment.data) for segment in segments], count)
+    if len(groups) < 2:
+        return []
+    work_dir.mkdir(parents=True, exist_ok=True)
+    chunks = []
+    for number, group in enumerate(groups):
+        chunk = work_dir / f"{path.stem}.part{number:03d}{path.suffix}"
+        write_document(path, [segments[i] for i in group], chunk)
+        chunks.append(chunk)
+    return chunks
+
+
+def merge_document(original: Path, outputs: list[Path], destination: Path) -> None:
+    """
+    put the translated chunks (in the order split_document returned them)
+    together into destination. For an IDML, every story comes from the
+    output of its chunk, the designmap from the original and the other
+    parts from the first chunk's output.
+    """
+    temp = destination.with_name(f".{destination.name}.merge")
+    try:
+        if is_idml(original):
+            translated: dict[str, bytes] = {}
+            for output in outputs:
+                entries, stories = read_package(output)
+                contents = dict(entries)
+                translated.update((story, contents[story]) for story in stories)
+            segments = read_segments(original)
+            missing = [segment.name for segment in segments if segment.name not in translated]
+            if missing:
+                raise ChunkError(f"Stories missing from the translated chunks: {', '.join(missing)}")
+            write_document(
+                original,
+                [Segment(segment.name, translated[segment.name]) for segment in segments],
+                temp,
+                parts_from=outputs[0],
+            )
+        else:
+            if any(zipfile.is_zipfile(output) for output in outputs):
+                raise ChunkError("Translated text chunks are packages, they can't be concatenated")
+            with open(temp, "wb") as merged:
+                for output in outputs:
+                    with open(output, "rb") as f:
+                        shutil.copyfileobj(f, merged)
+        temp.replace(destination)
+    finally:
+        temp.unlink(missing_ok=True)
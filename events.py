@@ -0,0 +1,79 @@
+import asyncio
+import threading
+
+
+class Subscription:
+    """
+    job events for one listener, delivered on the listener's event loop.
+    When the listener falls more than max_queue events behind, the
+    subscription is marked overflowed and stops receiving; the listener
+    can catch up from the job store.
+    """
+
+    def __init__(self, job_id: str | None, max_queue: int) -> None:
+        self.job_id = job_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def _put(self, event: dict) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float | None = None) -> dict | None:
+        """
+        the next event, None on timeout.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBus:
+    """
+    fan out job state transitions from worker threads to asyncio listeners
+    (Server-Sent Events streams and long-polling status requests).
+    """
+
+    def __init__(self, max_queue: int = 1000) -> None:
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscriptions: set[Subscription] = set()
+
+    def subscribe(self, job_id: str | None = None) -> Subscription:
+        """
+        listen to the events of one job, or of every job. Must be called
+        from the event loop that will consume the events.
+        """
+        subscription = Subscription(job_id, self.max_queue)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: dict) -> None:
+        """
+        deliver an event, safe to call from any thread.
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.job_id is not None and subscription.job_id != event["job_id"]:
+                continue
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, event)
+            except RuntimeError:
+                # the listener's loop is closed
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
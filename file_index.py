@@ -0,0 +1,219 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# list_files() can sort by these IndexedFile fields
+SORT_FIELDS = ("mtime", "size", "name")
+
+
+@dataclass
+class IndexedFile:
+    path: str  # relative to the index root
+    name: str
+    job_id: str | None  # the per-job directory the file is in, if any
+    size: int
+    mtime: float
+
+
+class FileIndex:
+    """
+    in-process index of the files under root and its per-job subdirectories.
+
+    The index is updated by add() and remove() when the server writes or
+    deletes files, and refresh() picks up changes made by others (e.g.
+    asrtranslate) by rescanning only the directories whose mtime changed.
+    Listing never touches the filesystem.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._lock = threading.Lock()
+        self._files: dict[str, IndexedFile] = {}  # relative path -> file
+        self._dir_mtimes: dict[str, float] = {}  # relative dir -> mtime
+        self._sorted: dict[str, list[IndexedFile]] = {}  # sort field -> files
+        self._total_bytes = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _scan_dir(self, directory: str) -> dict[str, IndexedFile]:
+        """
+        files directly in root/directory ("" for root itself).
+        """
+        files = {}
+        job_id = directory or None
+        try:
+            with os.scandir(self.root / directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    path = f"{directory}/{entry.name}" if directory else entry.name
+                    files[path] = IndexedFile(
+                        path, entry.name, job_id, stat.st_size, stat.st_mtime
+                    )
+        except FileNotFoundError:
+            pass
+        return files
+
+    def _subdirs(self) -> dict[str, float]:
+        """
+        per-job directories under root and their mtime.
+        """
+        subdirs = {}
+        try:
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.is_dir() and not entry.name.startswith("."):
+                        subdirs[entry.name] = entry.stat().st_mtime
+        except FileNotFoundError:
+            pass
+        return subdirs
+
+    def rebuild(self) -> None:
+        """
+        scan root and every per-job directory once and replace the index.
+        """
+        subdirs = self._subdirs()
+        files = self._scan_dir("")
+        for directory in subdirs:
+            files.update(self._scan_dir(directory))
+        try:
+            root_mtime = self.root.stat().st_mtime
+        except FileNotFoundError:
+            root_mtime = 0.0
+        with self._lock:
+            self._files = files
+            self._dir_mtimes = {"": root_mtime, **subdirs}
+            self._changed()
+            self._total_bytes = sum(file.size for file in self._files.values())
+
+    def refresh(self) -> None:
+        """
+        rescan the directories whose mtime changed since the last scan.
+        """
+        subdirs = self._subdirs()
+        try:
+            subdirs[""] = self.root.stat().st_mtime
+        except FileNotFoundError:
+            subdirs[""] = 0.0
+        with self._lock:
+            known = dict(self._dir_mtimes)
+        changed = [d for d, mtime in subdirs.items() if known.get(d) != mtime]
+        removed = [d for d in known if d not in subdirs]
+        if not changed and not removed:
+            return
+
+        scanned = {directory: self._scan_dir(directory) for directory in changed}
+        with self._lock:
+            stale = set(changed + removed)
+            self._files = {
+                path: file
+                for path, file in self._files.items()
+                if (file.job_id or "") not in stale
+            }
+            for directory in removed:
+                self._dir_mtimes.pop(directory, None)
+            for directory, files in scanned.items():
+                self._files.update(files)
+                self._dir_mtimes[directory] = subdirs[directory]
+            self._changed()
+            self._total_bytes = sum(file.size for file in self._files.values())
+
+    def add(self, path: Path) -> None:
+        """
+        index a file the server just wrote.
+        """
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return
+        relative = path.relative_to(self.root).as_posix()
+        job_id = relative.split("/")[0] if "/" in relative else None
+        with self._lock:
+            old = self._files.get(relative)
+            if old is not None:
+                self._total_bytes -= old.size
+            self._files[relative] = IndexedFile(
+                relative, path.name, job_id, stat.st_size, stat.st_mtime
+            )
+            self._total_bytes += stat.st_size
+            self._changed()
+
+    def remove(self, path: Path) -> None:
+        relative = path.relative_to(self.root).as_posix()
+        with self._lock:
+            old = self._files.pop(relative, None)
+            if old is not None:
+                self._total_bytes -= old.size
+                self._changed()
+
+    def _changed(self) -> None:
+        """
+        drop the sorted views, must hold the lock.
+        """
+        self._sorted.clear()
+
+    def list_files(
+        self,
+        sort: str = "mtime",
+        descending: bool = True,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> tuple[int, list[IndexedFile]]:
+        """
+        one page of files and the total number of files.
+        """
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Cannot sort files by {sort}")
+        with self._lock:
+            files = self._sorted.get(sort)
+            if files is None:
+                files = sorted(
+                    self._files.values(), key=lambda file: (getattr(file, sort), file.path)
+                )
+                self._sorted[sort] = files
+            total = len(files)
+        if offset >= total:
+            page = []
+        elif descending:
+            start = max(0, total - offset - limit)
+            page = files[start : total - offset][::-1]
+        else:
+            page = files[offset : offset + limit]
+        return total, page
+
+    def files(self) -> list[IndexedFile]:
+        with self._lock:
+            return list(self._files.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._files), "bytes": self._total_bytes}
+
+    def start(self, interval: float) -> None:
+        """
+        rebuild the index, then refresh it every interval seconds in the background.
+        """
+        self.rebuild()
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name=f"index-{self.root.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except OSError as e:
+                logger.error(f"Failed to refresh the index of {self.root}: {e}")
@@ -0,0 +1,331 @@
+import logging
+import os
+import re
+import selectors
+import subprocess
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Callable
+
+logger = logging.getLogger(__name__)
+
+# "45%", "45.5 %"
+PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+# "12/40", "12 / 40" (segments done / total, as printed by tqdm)
+SEGMENTS_PATTERN = re.compile(r"(\d+)\s*/\s*(\d+)")
+
+LOG_NAME = "asrtranslate.log"
+
+
+@dataclass
+class Progress:
+    percent: float | None = None
+    segments_done: int | None = None
+    segments_total: int | None = None
+    updated_at: float | None = None
+
+
+def parse_progress(line: str) -> Progress | None:
+    """
+    the progress a line of asrtranslate output reports, None if it has none.
+    """
+    segments = SEGMENTS_PATTERN.search(line)
+    percent = PERCENT_PATTERN.search(line)
+    if segments is None and percent is None:
+        return None
+    progress = Progress(updated_at=time.time())
+    if segments is not None:
+        done, total = int(segments.group(1)), int(segments.group(2))
+        if total and done <= total:
+            progress.segments_done, progress.segments_total = done, total
+            progress.percent = 100.0 * done / total
+    if percent is not None and float(percent.group(1)) <= 100:
+        progress.percent = float(percent.group(1))
+    if progress.percent is None:
+        return None
+    return progress
+
+
+class JobLog:
+    """
+    the output of every asrtranslate process of one job: the last lines in
+    memory, everything in a log file rotated at max_bytes, and the progress
+    of each language.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, backups: int, ring_lines: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lines: deque[str] = deque(maxlen=ring_lines)
+        self.progress: dict[str, Progress] = {}  # lang -> progress
+        self.active = 0  # processes still writing
+        self._lock = threading.Lock()
+        self._file = None
+        self._size = 0
+
+    def write(self, lang: str, stream: str, line: str) -> None:
+        entry = f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{lang}] [{stream}] {line}\n"
+        size = len(entry.encode())
+        with self._lock:
+            self.lines.append(entry)
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+                self._size = self._file.tell()
+            if self._size + size > self.max_bytes and self._size:
+                self._rotate()
+            self._file.write(entry)
+            self._file.flush()
+            self._size += size
+
+    def set_progress(self, lang: str, progress: Progress) -> None:
+        with self._lock:
+            self.progress[lang] = progress
+
+    def get_progress(self) -> dict[str, Progress]:
+        with self._lock:
+            return dict(self.progress)
+
+    def get_lines(self) -> list[str]:
+        with self._lock:
+            return list(self.lines)
+
+    def _rotate(self) -> None:
+        """
+        asrtranslate.log -> .1 -> .2 ..., must hold the lock.
+        """
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+        else:
+            self.path.unlink()
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = 0
+
+    def close_file(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def files(self) -> list[Path]:
+        """
+        the log file and its rotated backups, oldest first.
+        """
+        backups = [
+            self.path.with_name(f"{self.path.name}.{i}")
+            for i in range(self.backups, 0, -1)
+        ]
+        return [path for path in backups + [self.path] if path.exists()]
+
+
+class OutputReader:
+    """
+    read the output pipes of a process in a background thread, without
+    blocking the thread that waits for the process. on_line is called with
+    (stream name, line) for every line, on_eof once every pipe is closed.
+    """
+
+    def __init__(
+        self,
+        pipes: list[tuple[str, IO[bytes]]],
+        on_line: Callable[[str, str], None],
+        on_eof: Callable[[], None],
+        name: str,
+    ) -> None:
+        self.pipes = pipes
+        self.on_line = on_line
+        self.on_eof = on_eof
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        selector = selectors.DefaultSelector()
+        partial: dict[str, bytes] = {}
+        for stream, pipe in self.pipes:
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ, stream)
+            partial[stream] = b""
+        try:
+            while selector.get_map():
+                for key, _ in selector.select():
+                    stream = key.data
+                    try:
+                        chunk = os.read(key.fd, 65536)
+                    except BlockingIOError:
+                        continue
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        if partial[stream]:
+                            self.on_line(stream, partial[stream].decode(errors="replace"))
+                        continue
+                    # progress bars redraw their line with \r
+                    lines = (partial[stream] + chunk).replace(b"\r", b"\n").split(b"\n")
+                    partial[stream] = lines.pop()
+                    for line in lines:
+                        self.on_line(stream, line.decode(errors="replace"))
+        except Exception as e:
+            logger.error(f"Failed to read the output of {self._thread.name}: {e}")
+        finally:
+            selector.close()
+            for _, pipe in self.pipes:
+                pipe.close()
+            self.on_eof()
+
+    def join(self, timeout: float | None = None) -> None:
+        """
+        wait until the process closed its output. Processes it started may
+        keep the pipes open, so wait at most timeout seconds.
+        """
+        self._thread.join(timeout)
+
+
+class LanguageOutput:
+    """
+    the output of one asrtranslate run (one language of a job), written to
+    the job's log. Closing it tells the log that the run is over.
+    """
+
+    def __init__(self, log: JobLog, lang: str, on_close: Callable[[], None]) -> None:
+        self.log = log
+        self.lang = lang
+        self.on_close = on_close
+        self.stderr_tail: deque[str] = deque(maxlen=5)
+        self.reader: OutputReader | None = None
+        self._closed = False
+
+    def line(self, stream: str, line: str) -> None:
+        line = line.rstrip()
+        if not line:
+            return
+        self.log.write(self.lang, stream, line)
+        progress = parse_progress(line)
+        if progress is not None:
+            self.log.set_progress(self.lang, progress)
+        elif stream == "stderr":
+            # the last error messages, for the job's error
+            self.stderr_tail.append(line)
+
+    def capture(self, process: subprocess.Popen) -> None:
+        """
+        read the piped stdout and stderr of process in the background.
+        """
+        self.reader = OutputReader(
+            [("stdout", process.stdout), ("stderr", process.stderr)],
+            self.line,
+            lambda: None,
+            f"output-{process.pid}",
+        )
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.on_close()
+
+    def join(self, timeout: float | None = None) -> None:
+        if self.reader is not None:
+            self.reader.join(timeout)
+
+    def error_summary(self) -> str:
+        return " | ".join(self.stderr_tail)
+
+
+class JobLogs:
+    """
+    capture the output of asrtranslate processes per job into
+    directory/<job_id>/asrtranslate.log. The logs of the max_jobs most
+    recently active jobs stay in memory for their last lines and progress.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        max_bytes: int = 10 * 2**20,
+        backups: int = 3,
+        ring_lines: int = 1000,
+        max_jobs: int = 200,
+        on_closed: Callable[[Path], None] | None = None,
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.ring_lines = ring_lines
+        self.max_jobs = max_jobs
+        self.on_closed = on_closed  # called with each log file once no process writes it
+        self._lock = threading.Lock()
+        self._logs: OrderedDict[str, JobLog] = OrderedDict()
+
+    def log_path(self, job_id: str) -> Path:
+        return self.directory / job_id / LOG_NAME
+
+    def _log(self, job_id: str) -> JobLog:
+        with self._lock:
+            log = self._logs.get(job_id)
+            if log is None:
+                log = JobLog(
+                    self.log_path(job_id), self.max_bytes, self.backups, self.ring_lines
+                )
+                self._logs[job_id] = log
+            self._logs.move_to_end(job_id)
+            # forget idle logs of older jobs
+            for old_id in list(self._logs):
+                if len(self._logs) <= self.max_jobs:
+                    break
+                if self._logs[old_id].active == 0:
+                    del self._logs[old_id]
+            return log
+
+    def open(self, job_id: str, lang: str) -> LanguageOutput:
+        """
+        an output to write one asrtranslate run of a job to, close it when
+        the run is over.
+        """
+        log = self._log(job_id)
+        with self._lock:
+            log.active += 1
+
+        def closed() -> None:
+            with self._lock:
+                log.active -= 1
+                idle = log.active == 0
+            if idle:
+                log.close_file()
+                if self.on_closed is not None:
+                    for path in log.files():
+                        self.on_closed(path)
+
+        return LanguageOutput(log, lang, closed)
+
+    def is_active(self, job_id: str) -> bool:
+        with self._lock:
+            log = self._logs.get(job_id)
+            return log is not None and log.active > 0
+
+    def progress(self, job_id: str) -> dict[str, Progress]:
+        with self._lock:
+            log = self._logs.get(job_id)
+        return log.get_progress() if log is not None else {}
+
+    def tail(self, job_id: str, lines: int) -> list[str] | None:
+        """
+        the last lines of a job's output from memory, None if not in memory.
+        """
+        with self._lock:
+            log = self._logs.get(job_id)
+        if log is None:
+            return None
+        return log.get_lines()[-lines:]
+
+    def files(self, job_id: str) -> list[Path]:
+        """
+        the log files of a job, oldest first.
+        """
+        return JobLog(self.log_path(job_id), self.max_bytes, self.backups, 0).files()
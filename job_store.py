@@ -0,0 +1,647 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import StrEnum
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(StrEnum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = (JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+@dataclass
+class JobInfo:
+    job_id: str
+    filename: str
+    file_path: str
+    file_size: int
+    language: str  # language string as submitted, e.g. "japanese+korean"
+    languages: list[str]  # short language codes
+    email: str | None = None
+    status: str = JobStatus.PENDING
+    language_status: dict[str, str] = field(default_factory=dict)  # lang -> status
+    error: str | None = None
+    submitted_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    timeout: float | None = None  # wall-clock limit in seconds
+    file_hash: str | None = None  # SHA-256 of the upload
+    segments: int | None = None  # segments translated, all languages together
+    memory_segments: int | None = None  # of those, served from the translation memory
+    batch_id: str | None = None  # the batch the job was submitted with
+
+
+@dataclass
+class BatchInfo:
+    batch_id: str
+    language: str  # languages as submitted, "+"-joined full names
+    email: str | None = None
+    submitted_at: float = field(default_factory=time.time)
+    notified_at: float | None = None  # when the combined email was queued
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    language TEXT NOT NULL,
+    languages TEXT NOT NULL,
+    email TEXT,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    timeout REAL,
+    file_hash TEXT,
+    segments INTEGER,
+    memory_segments INTEGER,
+    batch_id TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, submitted_at);
+CREATE INDEX IF NOT EXISTS jobs_submitted_at ON jobs (submitted_at);
+CREATE INDEX IF NOT EXISTS jobs_email ON jobs (email, submitted_at);
+CREATE INDEX IF NOT EXISTS jobs_file_size ON jobs (file_size, job_id);
+CREATE INDEX IF NOT EXISTS jobs_filename ON jobs (filename, job_id);
+
+CREATE TABLE IF NOT EXISTS batches (
+    batch_id TEXT PRIMARY KEY,
+    language TEXT NOT NULL,
+    email TEXT,
+    submitted_at REAL NOT NULL,
+    notified_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS job_languages (
+    job_id TEXT NOT NULL,
+    language TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (job_id, language)
+);
+CREATE INDEX IF NOT EXISTS job_languages_language ON job_languages (language);
+
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    language TEXT,
+    status TEXT NOT NULL,
+    at REAL NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS job_events_job_id ON job_events (job_id);
+
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    language TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    max_rss_kb INTEGER,
+    return_code INTEGER NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_language ON runs (language, id);
+"""
+# idle read-only connections kept open, more are opened while many threads read
+READERS_KEPT = 8
+# runs kept per language, older ones are dropped as new ones are added
+RUNS_KEPT = 1000
+# columns added to the runs table after its first version
+RUN_MIGRATIONS = {"file_type": "TEXT"}
+
+# JobInfo fields stored in the jobs table
+JOB_COLUMNS = (
+    "job_id",
+    "status",
+    "filename",
+    "file_path",
+    "file_size",
+    "language",
+    "languages",
+    "email",
+    "error",
+    "submitted_at",
+    "started_at",
+    "finished_at",
+    "timeout",
+    "file_hash",
+    "segments",
+    "memory_segments",
+    "batch_id",
+)
+# columns added to the jobs table after its first version
+JOB_MIGRATIONS = {
+    "timeout": "REAL",
+    "file_hash": "TEXT",
+    "segments": "INTEGER",
+    "memory_segments": "INTEGER",
+    "batch_id": "TEXT",
+}
+SELECT_JOBS = f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs"
+# columns list_jobs() can sort (and page) by
+SORT_COLUMNS = ("submitted_at", "file_size", "filename")
+
+
+@dataclass
+class JobFilter:
+    status: str | None = None
+    email: str | None = None
+    language: str | None = None  # short language code
+    submitted_after: float | None = None
+    submitted_before: float | None = None
+
+    def where(self) -> tuple[list[str], list]:
+        """
+        SQL conditions on the jobs table and their parameters.
+        """
+        conditions: list[str] = []
+        params: list = []
+        if self.status is not None:
+            conditions.append("status = ?")
+            params.append(self.status)
+        if self.email is not None:
+            conditions.append("email = ?")
+            params.append(self.email)
+        if self.language is not None:
+            conditions.append(
+                "job_id IN (SELECT job_id FROM job_languages WHERE language = ?)"
+            )
+            params.append(self.language)
+        if self.submitted_after is not None:
+            conditions.append("submitted_at >= ?")
+            params.append(self.submitted_after)
+        if self.submitted_before is not None:
+            conditions.append("submitted_at < ?")
+            params.append(self.submitted_before)
+        return conditions, params
+
+
+class JobStore:
+    """
+    durable job records in SQLite (WAL mode).
+    Every state transition is written to the jobs table and appended to
+    job_events, so the state survives a restart of the server. Writes go
+    through one connection under a lock, reads through a pool of read-only
+    connections (up to READERS_KEPT are kept open between reads).
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._listeners: list[Callable[[dict], None]] = []
+        self._idle_readers: list[sqlite3.Connection] = []
+        self._closed = False
+
+    def subscribe(self, listener: Callable[[dict], None]) -> None:
+        """
+        call listener with every new job event (see events_since()) once it is written.
+        """
+        self._listeners.append(listener)
+
+    def _publish(self, event: dict) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"Job event listener failed: {e}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            self._conn.close()
+            idle, self._idle_readers = self._idle_readers, []
+        for conn in idle:
+            conn.close()
+
+    @contextmanager
+    def _read(self) -> Iterator[sqlite3.Connection]:
+        """
+        a read transaction on a read-only connection of the pool, a new one
+        if none is idle. In WAL mode it sees the last committed state without
+        waiting for the writer or its lock, so reads are never held up by
+        writes. The pool doesn't hold the lock while reading.
+        """
+        with self._lock:
+            conn = self._idle_readers.pop() if self._idle_readers else None
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only=ON")
+        try:
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.execute("COMMIT")
+        except BaseException:
+            conn.close()
+            raise
+        with self._lock:
+            if not self._closed and len(self._idle_readers) < READERS_KEPT:
+                self._idle_readers.append(conn)
+                return
+        conn.close()
+
+    def _migrate(self) -> None:
+        """
+        add the columns a database created by an older version is missing.
+        """
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, declaration in JOB_MIGRATIONS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {declaration}")
+        existing = {row["name"] for row in self._conn.execute("PRAGMA table_info(runs)")}
+        for column, declaration in RUN_MIGRATIONS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE runs ADD COLUMN {column} {declaration}")
+        # indexes on migrated columns
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch_id ON jobs (batch_id)")
+
+    def add(self, job: JobInfo) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            event = self._insert(job)
+        self._publish(event)
+
+    def add_batch(self, batch: BatchInfo, jobs: list[JobInfo]) -> None:
+        """
+        record a batch and all of its jobs in one transaction.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO batches (batch_id, language, email, submitted_at, notified_at) VALUES (?, ?, ?, ?, ?)",
+                (batch.batch_id, batch.language, batch.email, batch.submitted_at, batch.notified_at),
+            )
+            events = [self._insert(job) for job in jobs]
+        for event in events:
+            self._publish(event)
+
+    def _insert(self, job: JobInfo) -> dict:
+        """
+        insert a new job and its languages, must be called in a transaction.
+        """
+        values = [
+            json.dumps(job.languages) if column == "languages" else getattr(job, column)
+            for column in JOB_COLUMNS
+        ]
+        self._conn.execute(
+            f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+            values,
+        )
+        self._conn.executemany(
+            "INSERT INTO job_languages (job_id, language, status) VALUES (?, ?, ?)",
+            [
+                (job.job_id, lang, job.language_status.get(lang, job.status))
+                for lang in job.languages
+            ],
+        )
+        return self._add_event(job.job_id, None, job.status, job.submitted_at)
+
+    def set_status(
+        self, job_id: str, status: str, error: str | None = None
+    ) -> None:
+        """
+        record a job level state transition.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            if status == JobStatus.RUNNING:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = ?, finished_at = NULL, error = NULL WHERE job_id = ?",
+                    (status, now, job_id),
+                )
+            elif status == JobStatus.PENDING:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, started_at = NULL, finished_at = NULL WHERE job_id = ?",
+                    (status, job_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE job_id = ?",
+                    (status, now, error, job_id),
+                )
+            event = self._add_event(job_id, None, status, now, error)
+        self._publish(event)
+
+    def set_language_status(self, job_id: str, language: str, status: str) -> None:
+        """
+        record a state transition of one language of a job.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "UPDATE job_languages SET status = ? WHERE job_id = ? AND language = ?",
+                (status, job_id, language),
+            )
+            event = self._add_event(job_id, language, status, now)
+        self._publish(event)
+
+    def count_segments(self, job_id: str, segments: int, from_memory: int) -> None:
+        """
+        add the segments of one language of a job, and how many of them
+        the translation memory served.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET segments = COALESCE(segments, 0) + ?, memory_segments = COALESCE(memory_segments, 0) + ? WHERE job_id = ?",
+                (segments, from_memory, job_id),
+            )
+
+    def add_run(
+        self,
+        language: str,
+        size: int,
+        seconds: float,
+        max_rss_kb: int | None,
+        return_code: int,
+        file_type: str | None = None,
+    ) -> None:
+        """
+        record one asrtranslate run (size bytes of input of file_type, e.g.
+        ".idml", its wall-clock time and peak memory), the history resource
+        and runtime estimates learn from.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO runs (language, size, seconds, max_rss_kb, return_code, finished_at, file_type) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (language, size, seconds, max_rss_kb, return_code, time.time(), file_type),
+            )
+            self._conn.execute(
+                "DELETE FROM runs WHERE language = ? AND id <= (SELECT id FROM runs WHERE language = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (language, language, RUNS_KEPT),
+            )
+
+    def runs(self, language: str, limit: int) -> list[dict]:
+        """
+        the last limit runs of a language, newest first.
+        """
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT size, seconds, max_rss_kb, return_code, finished_at, file_type FROM runs WHERE language = ? ORDER BY id DESC LIMIT ?",
+                (language, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, job_id: str) -> JobInfo | None:
+        with self._read() as conn:
+            row = conn.execute(
+                f"{SELECT_JOBS} WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            return self._load([row], conn)[0]
+
+    def get_batch(self, batch_id: str) -> BatchInfo | None:
+        with self._read() as conn:
+            row = conn.execute(
+                "SELECT batch_id, language, email, submitted_at, notified_at FROM batches WHERE batch_id = ?",
+                (batch_id,),
+            ).fetchone()
+        return BatchInfo(**dict(row)) if row is not None else None
+
+    def batch_jobs(self, batch_id: str) -> list[JobInfo]:
+        """
+        the jobs of a batch, in the order they were submitted.
+        """
+        with self._read() as conn:
+            rows = conn.execute(
+                f"{SELECT_JOBS} WHERE batch_id = ? ORDER BY submitted_at, rowid",
+                (batch_id,),
+            ).fetchall()
+            return self._load(rows, conn)
+
+    def mark_batch_notified(self, batch_id: str) -> bool:
+        """
+        record that the combined email of a batch was queued. False if it
+        already was, so only one caller sends it.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batches SET notified_at = ? WHERE batch_id = ? AND notified_at IS NULL",
+                (time.time(), batch_id),
+            )
+        return cursor.rowcount == 1
+
+    def list_jobs(
+        self,
+        job_filter: JobFilter | None = None,
+        sort: str = "submitted_at",
+        descending: bool = True,
+        limit: int = 100,
+        after: tuple | None = None,
+    ) -> list[JobInfo]:
+        """
+        list jobs matching job_filter, sorted by sort (ties broken by job_id).
+        after is the (sort value, job_id) of the last job of the previous
+        page, so every page is an index range scan however deep it is.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Cannot sort jobs by {sort}")
+        conditions, params = (job_filter or JobFilter()).where()
+        if after is not None:
+            conditions.append(f"({sort}, job_id) {'<' if descending else '>'} (?, ?)")
+            params += list(after)
+        query = SELECT_JOBS
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = "DESC" if descending else "ASC"
+        query += f" ORDER BY {sort} {direction}, job_id {direction} LIMIT ?"
+        params.append(limit)
+        with self._read() as conn:
+            rows = conn.execute(query, params).fetchall()
+            return self._load(rows, conn)
+
+    def changed_since(
+        self, event_id: int, job_filter: JobFilter | None = None, limit: int = 100
+    ) -> tuple[list[JobInfo], int]:
+        """
+        jobs with an event after event_id, in the order of their latest event.
+        Return them with the event id to pass as event_id for the next call.
+        """
+        conditions, params = (job_filter or JobFilter()).where()
+        query = (
+            "SELECT job_id, MAX(id) AS last_id FROM job_events WHERE id > ? "
+            "GROUP BY job_id ORDER BY last_id LIMIT ?"
+        )
+        with self._read() as conn:
+            changes = conn.execute(query, (event_id, limit)).fetchall()
+            if not changes:
+                return [], event_id
+            job_ids = [row["job_id"] for row in changes]
+            conditions.append(f"job_id IN ({', '.join('?' * len(job_ids))})")
+            rows = conn.execute(
+                f"{SELECT_JOBS} WHERE {' AND '.join(conditions)}", params + job_ids
+            ).fetchall()
+            jobs = {job.job_id: job for job in self._load(rows, conn)}
+        ordered = [jobs[job_id] for job_id in job_ids if job_id in jobs]
+        return ordered, changes[-1]["last_id"]
+
+    def unfinished(self) -> list[JobInfo]:
+        """
+        jobs that were pending or running, oldest first.
+        """
+        with self._read() as conn:
+            rows = conn.execute(
+                f"{SELECT_JOBS} WHERE status IN (?, ?) ORDER BY submitted_at",
+                (JobStatus.PENDING, JobStatus.RUNNING),
+            ).fetchall()
+            return self._load(rows, conn)
+
+    def get_many(self, job_ids: list[str]) -> dict[str, JobInfo]:
+        """
+        the jobs of job_ids that exist, by job_id.
+        """
+        jobs: dict[str, JobInfo] = {}
+        with self._read() as conn:
+            for i in range(0, len(job_ids), 500):
+                chunk = job_ids[i : i + 500]
+                rows = conn.execute(
+                    f"{SELECT_JOBS} WHERE job_id IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for job in self._load(rows, conn):
+                    jobs[job.job_id] = job
+        return jobs
+
+    def delete_finished_before(self, before: float, limit: int = 500) -> int:
+        """
+        delete up to limit finished jobs submitted before the given time,
+        with their languages and events. Return the number of deleted jobs.
+        """
+        placeholders = ", ".join("?" * len(FINISHED_STATUSES))
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            job_ids = [
+                row["job_id"]
+                for row in self._conn.execute(
+                    f"SELECT job_id FROM jobs WHERE status IN ({placeholders}) AND submitted_at < ? LIMIT ?",
+                    (*FINISHED_STATUSES, before, limit),
+                )
+            ]
+            if not job_ids:
+                return 0
+            id_placeholders = ", ".join("?" * len(job_ids))
+            for table in ("job_events", "job_languages", "jobs"):
+                self._conn.execute(
+                    f"DELETE FROM {table} WHERE job_id IN ({id_placeholders})", job_ids
+                )
+            # batches whose jobs are all gone
+            self._conn.execute(
+                "DELETE FROM batches WHERE submitted_at < ? AND batch_id NOT IN (SELECT batch_id FROM jobs WHERE batch_id IS NOT NULL)",
+                (before,),
+            )
+        return len(job_ids)
+
+    def events(self, job_id: str) -> list[dict]:
+        with self._read() as conn:
+            rows = conn.execute(
+                "SELECT id, job_id, language, status, at, detail FROM job_events WHERE job_id = ? ORDER BY id",
+                (job_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def events_since(
+        self, after_id: int, job_id: str | None = None, limit: int = 1000
+    ) -> list[dict]:
+        """
+        events with an id above after_id, oldest first.
+        """
+        query = "SELECT id, job_id, language, status, at, detail FROM job_events WHERE id > ?"
+        params: list = [after_id]
+        if job_id is not None:
+            query += " AND job_id = ?"
+            params.append(job_id)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        with self._read() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def last_event_id(self, job_id: str | None = None) -> int:
+        """
+        id of the newest event (of one job), 0 if there is none.
+        """
+        with self._read() as conn:
+            if job_id is None:
+                row = conn.execute("SELECT MAX(id) FROM job_events").fetchone()
+            else:
+                row = conn.execute(
+                    "SELECT MAX(id) FROM job_events WHERE job_id = ?", (job_id,)
+                ).fetchone()
+        return row[0] or 0
+
+    def _add_event(
+        self,
+        job_id: str,
+        language: str | None,
+        status: str,
+        at: float,
+        detail: str | None = None,
+    ) -> dict:
+        cursor = self._conn.execute(
+            "INSERT INTO job_events (job_id, language, status, at, detail) VALUES (?, ?, ?, ?, ?)",
+            (job_id, language, status, at, detail),
+        )
+        return {
+            "id": cursor.lastrowid,
+            "job_id": job_id,
+            "language": language,
+            "status": status,
+            "at": at,
+            "detail": detail,
+        }
+
+    def _load(self, rows: list[sqlite3.Row], conn: sqlite3.Connection) -> list[JobInfo]:
+        """
+        build JobInfo objects from jobs rows read in a transaction of conn.
+        """
+        if not rows:
+            return []
+        job_ids = [row["job_id"] for row in rows]
+        language_status: dict[str, dict[str, str]] = {job_id: {} for job_id in job_ids}
+        placeholders = ", ".join("?" * len(job_ids))
+        for lang_row in conn.execute(
+            f"SELECT job_id, language, status FROM job_languages WHERE job_id IN ({placeholders})",
+            job_ids,
+        ):
+            language_status[lang_row["job_id"]][lang_row["language"]] = lang_row[
+                "status"
+            ]
+
+        jobs = []
+        for row in rows:
+            job = JobInfo(**{column: row[column] for column in JOB_COLUMNS})
+            job.languages = json.loads(row["languages"])
+            job.language_status = {
+                lang: language_status[job.job_id].get(lang, job.status)
+                for lang in job.languages
+            }
+            jobs.append(job)
+        return jobs
@@ -1,44 +1,315 @@
+import asyncio
+import base64
+import contextvars
+import hashlib
+import json
+import logging
+import mimetypes
 import os
 import shutil
+import signal
 import subprocess
+import tempfile
+import threading
 import time
 import uuid
-from concurrent.futures import Future, ThreadPoolExecutor
-from dataclasses import dataclass
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, suppress
+from dataclasses import asdict
 from enum import StrEnum
+from functools import cache, partial
 from pathlib import Path
+from typing import IO, Literal
 import urllib.parse
 
-from fastapi import FastAPI, File, HTTPException, UploadFile, Form
+from fastapi import FastAPI, File, HTTPException, UploadFile, Form, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from smtp_email import EmailSender
+from chunking import (
+    SEGMENTED_SUFFIXES,
+    ChunkError,
+    Segment,
+    document_size,
+    generic,
+    merge_document,
+    other_parts,
+    read_segments,
+    specific,
+    split_document,
+    translated_segments,
+    write_document,
+)
+from events import EventBus
 
-ASRTRANSLATE_DIR = Path("/home/sw/GitHub/ASRtranslate")
+from file_index import FileIndex
+from job_logs import JobLogs, LanguageOutput, Progress
+from job_store import (
+    FINISHED_STATUSES,
+    BatchInfo,
+    JobFilter,
+    JobInfo,
+    JobStatus,
+    JobStore,
+)
+from metrics import (
+    JOBS_FINISHED,
+    TRANSLATE_CPU_SECONDS,
+    TRANSLATE_PEAK_RSS_BYTES,
+    TRANSLATE_SECONDS,
+    UPLOAD_BYTES,
+    UPLOAD_WRITE_SECONDS,
+    Counter,
+    Gauge,
+    registry,
+)
+from notifier import EmailNotifier
+from result_cache import ResultCache, link_or_copy
+from retention import RetentionEngine, RetentionPolicy
+from resources import Cgroups, ProcessLimiter, ResourceLimits, ResourceModel
+from runtime_model import RuntimeModel
+from scheduler import Scheduler, SchedulerPolicy, available_memory_mb, total_memory_mb
+from single_flight import SingleFlight
+from tracing import Span, Tracer, current_job_id, setup_logging
+from translation_memory import TranslationMemory
+from zip_stream import stream_zip
+from work_queue import WorkItem, WorkQueue, WorkState
+from worker_pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# ASRtranslate checkout with its .venv, uploads and results live in it too
+ASRTRANSLATE_DIR = Path(os.environ.get("TASK_ASRTRANSLATE_DIR", "/home/sw/GitHub/ASRtranslate"))
 UPLOAD_DIR = ASRTRANSLATE_DIR / "uploads"
 RESULT_DIR = ASRTRANSLATE_DIR / "results"
+RESULT_CACHE_DIR = ASRTRANSLATE_DIR / "result_cache"
+TRANSLATION_MEMORY_PATH = Path(
+    os.environ.get("TASK_MEMORY_DB", ASRTRANSLATE_DIR / "translation_memory.db")
+)
+# asrtranslate output of each job, in <dir>/<job_id>/asrtranslate.log
+JOB_LOG_DIR = Path(os.environ.get("TASK_JOB_LOG_DIR", ASRTRANSLATE_DIR / "job_logs"))
 
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 RESULT_DIR.mkdir(parents=True, exist_ok=True)
 
 THIS_DIR = Path(__file__).parent
 
-app = FastAPI(title="Task Manager")
+# job records survive restarts in this SQLite database
+JOB_DB_PATH = Path(os.environ.get("TASK_JOB_DB", THIS_DIR / "jobs.db"))
+
+# JSON logs go to stdout, and to TASK_LOG_FILE (rotated) if set
+LOG_LEVEL = os.environ.get("TASK_LOG_LEVEL", "INFO")
+LOG_FILE = os.environ.get("TASK_LOG_FILE")
+# number of recent jobs whose timing spans are kept for /tasks/{job_id}/trace
+TRACE_MAX_JOBS = int(os.environ.get("TASK_TRACE_MAX_JOBS", 1000))
+# asrtranslate output: a job's log file is rotated at this size, keeping JOB_LOG_BACKUPS old ones
+JOB_LOG_MAX_BYTES = int(os.environ.get("TASK_JOB_LOG_MB", 10)) * 2**20
+JOB_LOG_BACKUPS = int(os.environ.get("TASK_JOB_LOG_BACKUPS", 3))
+LOG_CHUNK_SIZE = 2**16
+# seconds between checks for new output when following a job's log
+LOG_FOLLOW_INTERVAL = 0.5
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    log_listener = setup_logging(LOG_LEVEL, Path(LOG_FILE) if LOG_FILE else None)
+    notifier.start()
+    # before the worker pool, its workers are limited too
+    if CGROUPS:
+        cgroups.setup()
+    upload_index.start(FILE_INDEX_REFRESH_SECONDS)
+    result_index.start(FILE_INDEX_REFRESH_SECONDS)
+    log_index.start(FILE_INDEX_REFRESH_SECONDS)
+    if worker_pool is not None:
+        worker_pool.start()
+    if work_queue is not None:
+        # the jobs of items left from the last run are requeued below
+        work_queue.clear()
+    scheduler.start()
+    requeue_unfinished_jobs()
+    retention.start(RETENTION_INTERVAL_SECONDS)
+    yield
+    retention.stop()
+    scheduler.shutdown()
+    if worker_pool is not None:
+        worker_pool.stop()
+    upload_index.stop()
+    result_index.stop()
+    log_index.stop()
+    notifier.stop()
+    io_executor.shutdown()
+    log_listener.stop()
+
+
+IDML_MEDIA_TYPE = "application/vnd.adobe.indesign-idml-package"
+# results are served with their type rather than as text
+mimetypes.add_type(IDML_MEDIA_TYPE, ".idml")
+
+app = FastAPI(title="Task Manager", lifespan=lifespan)
+# single files, with Range (resume), ETag and If-None-Match support
 app.mount("/results", StaticFiles(directory=RESULT_DIR), name="results")
 
 # FastAPI configuration
 FASTAPI_SERVER = "10.194.47.212"
 FASTAPI_PORT = 3030
 
+# Multi-language configuration
+# max number of asrtranslate processes one job runs at the same time
+LANGUAGE_WORKERS = int(os.environ.get("TASK_LANGUAGE_WORKERS", os.cpu_count() or 1))
+# rough resident memory of one asrtranslate process, caps LANGUAGE_WORKERS
+ASRTRANSLATE_MEMORY_MB = int(os.environ.get("TASK_ASRTRANSLATE_MEMORY_MB", 2048))
+
+# Scheduler configuration
+# number of jobs translated at the same time
+SCHEDULER_WORKERS = int(os.environ.get("TASK_SCHEDULER_WORKERS", 1))
+# "fifo", "smallest_first" or "shortest_first" (by estimated runtime)
+SCHEDULER_POLICY = SchedulerPolicy(os.environ.get("TASK_SCHEDULER_POLICY", "fifo"))
+# don't start another job below this much free memory (MB)
+SCHEDULER_MIN_FREE_MEMORY_MB = int(
+    os.environ.get("TASK_SCHEDULER_MIN_FREE_MEMORY_MB", ASRTRANSLATE_MEMORY_MB)
+)
+# don't start another job above this 1 minute load average per CPU
+SCHEDULER_MAX_LOAD = float(os.environ.get("TASK_SCHEDULER_MAX_LOAD", 1.5))
+# memory (MB) the scheduler packs jobs into, by the peak memory of asrtranslate
+# learned from past runs; by default all of it but TASK_SCHEDULER_MIN_FREE_MEMORY_MB,
+# 0 for no budget
+_total_memory_mb = total_memory_mb()
+SCHEDULER_MEMORY_BUDGET_MB = float(
+    os.environ.get(
+        "TASK_SCHEDULER_MEMORY_BUDGET_MB",
+        max(0, (_total_memory_mb or 0) - SCHEDULER_MIN_FREE_MEMORY_MB),
+    )
+)
+# a job that waited this long isn't overtaken by smaller jobs that fit the budget
+SCHEDULER_MAX_BACKFILL_WAIT = float(os.environ.get("TASK_SCHEDULER_MAX_BACKFILL_WAIT", 600))
+
+# Resource limits configuration
+# hard memory limit of one asrtranslate process, its cgroup's memory.max;
+# needs TASK_CGROUPS and a cgroup v2 delegated to the server, 0 for none
+ASRTRANSLATE_MAX_MEMORY_MB = int(
+    os.environ.get("TASK_ASRTRANSLATE_MAX_MEMORY_MB", 4 * ASRTRANSLATE_MEMORY_MB)
+)
+# address space limit of one asrtranslate process where there is no cgroup v2,
+# 0 for none. Opt-in: the address space is much larger than the memory used
+ASRTRANSLATE_MAX_ADDRESS_SPACE_MB = int(
+    os.environ.get("TASK_ASRTRANSLATE_MAX_ADDRESS_SPACE_MB", 0)
+)
+# CPUs one asrtranslate process may use (cgroup cpu.max), 0 for no limit
+ASRTRANSLATE_CPUS = float(os.environ.get("TASK_ASRTRANSLATE_CPUS", 0))
+# CPUs each asrtranslate process is pinned to, apart from the others; 0 doesn't pin
+ASRTRANSLATE_PINNED_CPUS = int(os.environ.get("TASK_ASRTRANSLATE_PINNED_CPUS", 0))
+# asrtranslate runs below the server's CPU and I/O priority, and is the first
+# process the OOM killer stops, so the API stays up; "" leaves the I/O class
+ASRTRANSLATE_NICE = int(os.environ.get("TASK_ASRTRANSLATE_NICE", 10))
+ASRTRANSLATE_IO_CLASS = os.environ.get("TASK_ASRTRANSLATE_IO_CLASS", "best-effort")
+ASRTRANSLATE_IO_LEVEL = int(os.environ.get("TASK_ASRTRANSLATE_IO_LEVEL", 7))
+# put asrtranslate processes in cgroups of their own. Off by default: the server
+# moves itself into <cgroup>/server and takes over the cgroup's controllers
+CGROUPS = bool(int(os.environ.get("TASK_CGROUPS", 0)))
+# cgroup v2 directory the asrtranslate cgroups are made in, by default the server's own
+CGROUP_DIR = os.environ.get("TASK_CGROUP_DIR")
+
+# Cancellation configuration
+# default wall-clock limit of a job in seconds, 0 for no limit
+JOB_TIMEOUT = float(os.environ.get("TASK_JOB_TIMEOUT", 6 * 60 * 60))
+# seconds between SIGTERM and SIGKILL when stopping asrtranslate
+KILL_GRACE_SECONDS = 10
+# seconds to wait for the rest of asrtranslate's output after it exited
+OUTPUT_DRAIN_SECONDS = 5
+
+# Remote worker configuration
+# 1 hands every asrtranslate run to remote workers (remote_worker.py, on this
+# or other machines) through the work queue instead of running it here
+REMOTE_WORKERS = bool(int(os.environ.get("TASK_REMOTE_WORKERS", 0)))
+WORK_QUEUE_PATH = Path(os.environ.get("TASK_WORK_QUEUE_DB", THIS_DIR / "work_queue.db"))
+# a worker that didn't renew its lease for this many seconds is considered
+# dead and its item is delivered to another worker, at most WORK_MAX_ATTEMPTS times
+WORK_LEASE_SECONDS = float(os.environ.get("TASK_WORK_LEASE_SECONDS", 60))
+WORK_MAX_ATTEMPTS = int(os.environ.get("TASK_WORK_MAX_ATTEMPTS", 3))
+# seconds between checks of the work queue while a remote run is in progress
+WORK_POLL_INTERVAL = 0.5
+
+# Worker pool configuration
+# warm asrtranslate workers (asr_worker.py) translations run on, 0 starts a new
+# asrtranslate process for every language instead. By default one per language
+# that can run at the same time, as far as they fit in free memory, none with
+# remote workers
+_max_parallel = SCHEDULER_WORKERS * LANGUAGE_WORKERS
+_memory_mb = available_memory_mb()
+if _memory_mb is not None:
+    _max_parallel = max(1, min(_max_parallel, _memory_mb // ASRTRANSLATE_MEMORY_MB))
+if REMOTE_WORKERS:
+    _max_parallel = 0
+WORKER_POOL_SIZE = int(os.environ.get("TASK_WORKER_POOL_SIZE", _max_parallel))
+# a worker is replaced after this many translations, or when it uses more than
+# TASK_WORKER_MAX_RSS_MB of memory (0 for no limit)
+WORKER_MAX_JOBS = int(os.environ.get("TASK_WORKER_MAX_JOBS", 50))
+WORKER_MAX_RSS_MB = int(os.environ.get("TASK_WORKER_MAX_RSS_MB", 2 * ASRTRANSLATE_MEMORY_MB))
+# comma separated modules the workers import up front, e.g. asrtranslate's model code
+WORKER_PRELOAD = os.environ.get("TASK_WORKER_PRELOAD", "")
+
+# Chunking configuration
+# IDML documents with at least this much story text, or .txt uploads this big,
+# are split into chunks translated concurrently and merged back, 0 never splits
+CHUNK_MIN_BYTES = int(os.environ.get("TASK_CHUNK_MIN_KB", 256)) * 1024
+# at most this many chunks per document, by default one per worker
+CHUNK_MAX = int(os.environ.get("TASK_CHUNK_MAX", WORKER_POOL_SIZE or LANGUAGE_WORKERS))
+# tries of a chunk before its language fails
+CHUNK_ATTEMPTS = int(os.environ.get("TASK_CHUNK_ATTEMPTS", 3))
+
+# Translation memory configuration
+# translations of single segments (IDML stories, text paragraphs) reused by
+# later jobs; size limit, 0 disables the translation memory
+TRANSLATION_MEMORY_MAX_BYTES = int(os.environ.get("TASK_MEMORY_MB", 1024)) * 2**20
+# segments unused for this long are dropped, 0 keeps them until evicted by size
+TRANSLATION_MEMORY_MAX_AGE_DAYS = float(os.environ.get("TASK_MEMORY_MAX_AGE_DAYS", 180))
 
-@dataclass
-class JobInfo:
-    future: Future
-    filename: str
-    file_size: int
-    language: str
-    email: str | None = None
-    # language_list: list[dict[str(language_name), str(status)]]
+# Upload configuration
+MAX_UPLOAD_BYTES = int(os.environ.get("TASK_MAX_UPLOAD_MB", 512)) * 2**20
+UPLOAD_CHUNK_SIZE = 2**20
+# threads async endpoints hand their blocking file I/O to (upload writes,
+# job listings), apart from the threadpool of sync endpoints
+IO_WORKERS = int(os.environ.get("TASK_IO_WORKERS", 8))
+# bytes of a result read at a time when streaming a zip of results
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+# Batch configuration
+# files one batch can hold, the members of uploaded zips included
+BATCH_MAX_FILES = int(os.environ.get("TASK_BATCH_MAX_FILES", 100))
+
+# Result cache configuration
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("TASK_RESULT_CACHE_MB", 10240)) * 2**20
+# overrides the asrtranslate version detected from its venv and git checkout
+TRANSLATOR_VERSION = os.environ.get("TASK_TRANSLATOR_VERSION")
+
+# File index configuration
+# seconds between checks for files changed outside the server
+FILE_INDEX_REFRESH_SECONDS = float(os.environ.get("TASK_FILE_INDEX_REFRESH", 60))
+
+# Retention configuration, 0 disables a limit
+# days a finished job keeps its uploads and results
+RETENTION_MAX_AGE_DAYS = float(os.environ.get("TASK_RETENTION_MAX_AGE_DAYS", 30))
+# GB uploads and results may use together, oldest finished jobs are removed first
+RETENTION_MAX_GB = float(os.environ.get("TASK_RETENTION_MAX_GB", 0))
+# number of newest jobs per email that keep their files regardless of age
+RETENTION_KEEP_LAST = int(os.environ.get("TASK_RETENTION_KEEP_LAST", 0))
+# days a finished job stays in the job history
+RETENTION_JOB_MAX_AGE_DAYS = float(os.environ.get("TASK_RETENTION_JOB_MAX_AGE_DAYS", 365))
+RETENTION_INTERVAL_SECONDS = float(os.environ.get("TASK_RETENTION_INTERVAL", 600))
+# max files deleted per cycle, keeps every cycle's I/O bounded
+RETENTION_MAX_FILES = int(os.environ.get("TASK_RETENTION_MAX_FILES", 500))
+
+# Email configuration
+MAIL_CONFIG_PATH = Path(os.environ.get("TASK_MAIL_CONFIG", THIS_DIR / "mail_config.json"))
+# emails that could not be delivered after EMAIL_MAX_ATTEMPTS end up here
+EMAIL_DEAD_LETTER_PATH = Path(
+    os.environ.get("TASK_EMAIL_DEAD_LETTER", THIS_DIR / "email_dead_letter.jsonl")
+)
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("TASK_EMAIL_MAX_ATTEMPTS", 5))
+# seconds before the first retry, doubled for every further attempt
+EMAIL_RETRY_BACKOFF = float(os.environ.get("TASK_EMAIL_RETRY_BACKOFF", 30))
 
 
 class Language(StrEnum):
@@ -76,245 +347,2455 @@ class Language(StrEnum):
         return fullname
 
 
-# thread pool
-executor = ThreadPoolExecutor(max_workers=1)
-jobs: dict[str, JobInfo] = {}  # job_id -> JobInfo
+scheduler = Scheduler(
+    workers=SCHEDULER_WORKERS,
+    policy=SCHEDULER_POLICY,
+    min_free_memory_mb=SCHEDULER_MIN_FREE_MEMORY_MB,
+    max_load=SCHEDULER_MAX_LOAD,
+    memory_budget_mb=SCHEDULER_MEMORY_BUDGET_MB,
+    max_backfill_wait=SCHEDULER_MAX_BACKFILL_WAIT,
+)
+store = JobStore(JOB_DB_PATH)
+resource_model = ResourceModel(store, ASRTRANSLATE_MEMORY_MB)
+runtime_model = RuntimeModel(store)
+cgroups = Cgroups(Path(CGROUP_DIR) if CGROUP_DIR else None)
+limiter = ProcessLimiter(
+    ResourceLimits(
+        memory_mb=ASRTRANSLATE_MAX_MEMORY_MB,
+        address_space_mb=ASRTRANSLATE_MAX_ADDRESS_SPACE_MB,
+        cpus=ASRTRANSLATE_CPUS,
+        pinned_cpus=ASRTRANSLATE_PINNED_CPUS,
+        nice=ASRTRANSLATE_NICE,
+        io_class=ASRTRANSLATE_IO_CLASS or None,
+        io_level=ASRTRANSLATE_IO_LEVEL,
+        oom_score_adj=1000,
+    ),
+    cgroups,
+)
+events = EventBus()
+store.subscribe(events.publish)
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+translation_memory = (
+    TranslationMemory(
+        TRANSLATION_MEMORY_PATH,
+        TRANSLATION_MEMORY_MAX_BYTES,
+        TRANSLATION_MEMORY_MAX_AGE_DAYS * 24 * 60 * 60,
+    )
+    if TRANSLATION_MEMORY_MAX_BYTES
+    else None
+)
+tracer = Tracer(TRACE_MAX_JOBS)
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+notifier = EmailNotifier(
+    MAIL_CONFIG_PATH,
+    EMAIL_DEAD_LETTER_PATH,
+    max_attempts=EMAIL_MAX_ATTEMPTS,
+    backoff=EMAIL_RETRY_BACKOFF,
+    tracer=tracer,
+)
+upload_index = FileIndex(UPLOAD_DIR)
+result_index = FileIndex(RESULT_DIR)
+log_index = FileIndex(JOB_LOG_DIR)
+job_logs = JobLogs(
+    JOB_LOG_DIR, JOB_LOG_MAX_BYTES, JOB_LOG_BACKUPS, on_closed=log_index.add
+)
+worker_pool = (
+    WorkerPool(
+        [
+            str(ASRTRANSLATE_DIR / ".venv/bin/python"),
+            str(THIS_DIR / "asr_worker.py"),
+            "--module",
+            "asrtranslate",
+            "--preload",
+            WORKER_PRELOAD,
+        ],
+        ASRTRANSLATE_DIR,
+        WORKER_POOL_SIZE,
+        max_jobs=WORKER_MAX_JOBS,
+        max_rss_mb=WORKER_MAX_RSS_MB,
+        kill_grace=KILL_GRACE_SECONDS,
+        drain_timeout=OUTPUT_DRAIN_SECONDS,
+        limiter=limiter,
+    )
+    if WORKER_POOL_SIZE
+    else None
+)
+retention = RetentionEngine(
+    RetentionPolicy(
+        max_age=RETENTION_MAX_AGE_DAYS * 86400,
+        max_bytes=int(RETENTION_MAX_GB * 2**30),
+        keep_last=RETENTION_KEEP_LAST,
+        job_max_age=RETENTION_JOB_MAX_AGE_DAYS * 86400,
+        max_files_per_cycle=RETENTION_MAX_FILES,
+    ),
+    store,
+    [upload_index, result_index, log_index],
+)
+work_queue = (
+    WorkQueue(WORK_QUEUE_PATH, WORK_LEASE_SECONDS, WORK_MAX_ATTEMPTS)
+    if REMOTE_WORKERS
+    else None
+)
+remote_outputs: dict[str, LanguageOutput] = {}  # work item id -> output of its run
+remote_spans: dict[str, Span] = {}  # work item id -> span of its run
+# held while a completed item's document is put in place, see complete_work()
+remote_completion_lock = threading.Lock()
+flights = SingleFlight()  # identical jobs queued or running share one execution
+cancel_events: dict[str, threading.Event] = {}  # job_id -> set to stop the job
+
+
+def count_finished_jobs(event: dict) -> None:
+    if event["language"] is None and event["status"] in FINISHED_STATUSES:
+        JOBS_FINISHED.inc(status=event["status"])
 
 
-def run_translation_task(
-    original_file_path: Path, language: list[str] = ["en"], email: str | None = None
+store.subscribe(count_finished_jobs)
+
+# metrics read from the components when /metrics is requested
+for metric in (
+    Gauge("task_queue_depth", "Jobs waiting in the scheduler queue.", fn=scheduler.queue_length),
+    Gauge("task_running_jobs", "Jobs running on scheduler workers.", fn=scheduler.running_count),
+    Gauge(
+        "task_queue_oldest_wait_seconds",
+        "How long the oldest queued job has been waiting.",
+        fn=scheduler.oldest_wait,
+    ),
+    Gauge(
+        "task_scheduler_reserved_memory_bytes",
+        "Estimated memory of the running jobs.",
+        fn=lambda: scheduler.reserved_memory_mb() * 2**20,
+    ),
+    Counter(
+        "task_scheduler_backfills_total",
+        "Jobs started ahead of a job that didn't fit in the memory budget.",
+        fn=lambda: scheduler.backfilled,
+    ),
+    Counter(
+        "task_asrtranslate_oom_kills_total",
+        "asrtranslate processes killed for going over their memory limit.",
+        fn=lambda: limiter.oom_kills,
+    ),
+    Counter(
+        "task_result_cache_hits_total",
+        "Result cache lookups that found a translation.",
+        fn=lambda: result_cache.hits,
+    ),
+    Counter(
+        "task_result_cache_misses_total",
+        "Result cache lookups that found nothing.",
+        fn=lambda: result_cache.misses,
+    ),
+    Counter(
+        "task_result_cache_evictions_total",
+        "Translations evicted from the result cache.",
+        fn=lambda: result_cache.evictions,
+    ),
+    Counter(
+        "task_translation_memory_hits_total",
+        "Segments found in the translation memory.",
+        fn=lambda: translation_memory.hits if translation_memory is not None else 0,
+    ),
+    Counter(
+        "task_translation_memory_misses_total",
+        "Segments not found in the translation memory.",
+        fn=lambda: translation_memory.misses if translation_memory is not None else 0,
+    ),
+    Gauge(
+        "task_email_queue_length",
+        "Emails waiting to be sent or retried.",
+        fn=notifier.queue_length,
+    ),
+    Counter("task_emails_sent_total", "Emails delivered.", fn=lambda: notifier.sent),
+    Counter(
+        "task_emails_dead_lettered_total",
+        "Emails given up on after every retry.",
+        fn=lambda: notifier.dead_lettered,
+    ),
+    Counter(
+        "task_retention_cycles_total",
+        "Retention cycles run.",
+        fn=lambda: retention.cycles,
+    ),
+    Counter(
+        "task_retention_files_deleted_total",
+        "Uploads and results deleted by retention.",
+        fn=lambda: retention.files_deleted,
+    ),
+    Counter(
+        "task_retention_bytes_reclaimed_total",
+        "Disk space freed by retention.",
+        fn=lambda: retention.bytes_reclaimed,
+    ),
+    Counter(
+        "task_retention_jobs_deleted_total",
+        "Job records deleted by retention.",
+        fn=lambda: retention.jobs_deleted,
+    ),
 ):
+    registry.register(metric)
+if worker_pool is not None:
+    for metric in (
+        Gauge(
+            "task_worker_pool_busy",
+            "asrtranslate workers running a translation.",
+            fn=lambda: worker_pool.stats()["busy"],
+        ),
+        Counter(
+            "task_worker_restarts_total",
+            "asrtranslate workers replaced after dying or being stopped.",
+            fn=lambda: worker_pool.restarted,
+        ),
+        Counter(
+            "task_worker_recycles_total",
+            "asrtranslate workers replaced after too many jobs or too much memory.",
+            fn=lambda: worker_pool.recycled,
+        ),
+    ):
+        registry.register(metric)
+if work_queue is not None:
+    for metric in (
+        Gauge(
+            "task_work_queue_depth",
+            "asrtranslate runs waiting for a remote worker.",
+            fn=work_queue.pending_count,
+        ),
+        Counter(
+            "task_work_redeliveries_total",
+            "asrtranslate runs delivered again after their worker was lost.",
+            fn=lambda: work_queue.redelivered,
+        ),
+    ):
+        registry.register(metric)
+
+
+# asrtranslate processes the running job may start at once, shared by all of
+# its languages and chunks; set by run_translation_task, None for no limit
+process_slots: contextvars.ContextVar[threading.Semaphore | None] = contextvars.ContextVar(
+    "process_slots", default=None
+)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def language_workers(language_count: int, process_memory_mb: float = ASRTRANSLATE_MEMORY_MB) -> int:
+    """
+    number of languages of one job to translate concurrently, bounded by
+    LANGUAGE_WORKERS and by how many asrtranslate processes of
+    process_memory_mb fit in free memory.
+    """
+    workers = min(language_count, LANGUAGE_WORKERS)
+    memory_mb = available_memory_mb()
+    # remote workers run asrtranslate elsewhere, this host only waits for them
+    if memory_mb is not None and work_queue is None:
+        workers = min(workers, int(memory_mb // max(1, process_memory_mb)))
+    return max(1, workers)
+
+
+def job_processes(languages: list[str], source: Path) -> int:
     """
-    execute a single command.
+    asrtranslate processes a job runs at once, over all of its languages
+    and their chunks (see process_slots).
     """
-    print(
-        f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running: {original_file_path} with language: {language}"
+    try:
+        chunks = chunk_count(source)
+    except OSError:
+        chunks = 1
+    return language_workers(
+        len(languages) * chunks,
+        max((resource_model.memory_mb(lang) for lang in languages), default=ASRTRANSLATE_MEMORY_MB),
     )
 
-    generated_files = []
 
-    for lang in language:
-        cmd = [
-            ASRTRANSLATE_DIR / ".venv/bin/python",
-            "-m",
-            "asrtranslate",
-            f"{original_file_path}",
-            "-o",
-            f"{RESULT_DIR}",
-            "-l",
-            f"{lang}",
-        ]
+def job_memory_mb(job: JobInfo) -> float:
+    """
+    estimated peak memory of a job's asrtranslate processes: the largest
+    learned peak of its languages, times the processes it runs at once.
+    Warm and remote workers hold their memory whatever they run, 0 then.
+    """
+    if worker_pool is not None or work_queue is not None or not job.languages:
+        return 0
+    processes = job_processes(list(job.languages), Path(job.file_path))
+    return processes * max(resource_model.memory_mb(lang) for lang in job.languages)
 
-        p = subprocess.Popen(cmd, cwd=ASRTRANSLATE_DIR)
-        print(f"pid: {p.pid}")
 
-        return_code = p.wait()
-        if return_code != 0:
-            raise Exception(f"Translation failed with return code: {return_code}")
+def job_estimate(job: JobInfo) -> float | None:
+    """
+    estimated seconds a job runs: the learned runtime of each language for
+    the size and type of its document (or of a chunk of it), spread over
+    the asrtranslate processes it runs at once. None while a language has
+    no history.
+    """
+    if not job.languages:
+        return None
+    source = Path(job.file_path)
+    try:
+        size = document_size(source) or source.stat().st_size
+        chunks = chunk_count(source)
+    except OSError:
+        return None
+    runs = []
+    for lang in job.languages:
+        seconds = runtime_model.seconds(lang, source.suffix.lower(), size // chunks)
+        if seconds is None:
+            return None
+        runs.append(seconds)
+    processes = min(LANGUAGE_WORKERS, len(job.languages) * chunks)
+    # no faster than its slowest run
+    return max(max(runs), sum(runs) * chunks / processes)
 
-        # check if the generated file exists
-        # TODO: not sync with the translation process
-        original_name = original_file_path.stem
-        generated_file = RESULT_DIR / f"{original_name}-{lang}.idml"
-        if generated_file.exists():
-            generated_files.append(generated_file)
 
-        ## TODO: add a way to stop the task
-        # while p.poll() is None:
-        #     if is_stop:
-        #         p.terminate()
-        #     sleep(0.5)
+def job_fraction_done(job_id: str) -> float | None:
+    """
+    the fraction of a running job's languages asrtranslate reported as
+    done, None before it reported any progress.
+    """
+    progress = job_logs.progress(job_id)
+    job = store.get(job_id) if progress else None
+    if job is None or not job.languages:
+        return None
+    percent = sum(
+        (progress[lang].percent or 0) if lang in progress else 0 for lang in job.languages
+    )
+    return min(1.0, percent / 100 / len(job.languages))
 
-    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Finished: {original_file_path}")
 
-    if email and generated_files:
-        send_completion_email(email, original_file_path.name, generated_files, language)
+scheduler.progress = job_fraction_done
 
 
-def send_completion_email(
-    email: str,
-    original_filename: str,
-    generated_files: list[Path],
-    languages: list[str],
-):
+def job_estimates(job_id: str, estimates: dict[str, tuple[float, float]]) -> dict:
     """
-    send email notification when the task is completed
+    estimated start and finish of a queued or running job (epoch), and the
+    seconds until then; None where unknown.
     """
-    try:
-        email_sender = EmailSender()
+    start, finish = estimates.get(job_id, (None, None))
+    now = time.time()
+    return {
+        "estimated_start": start,
+        "estimated_finish": finish,
+        "queue_wait_seconds": max(0.0, start - now) if start is not None else None,
+        "eta_seconds": max(0.0, finish - now) if finish is not None else None,
+    }
 
-        # create download links
-        download_links = []
-        for file_path in generated_files:
-            filename = file_path.name
-            download_url = f"http://{FASTAPI_SERVER}:{FASTAPI_PORT}/results/{urllib.parse.quote(filename)}"
-            download_links.append(download_url)
 
-        # create email content
-        subject = f"ASRtranslate 翻譯完成 - {original_filename}"
+def job_result_dir(job_id: str) -> Path:
+    """
+    every job writes its results to its own directory, so uploads with the
+    same name don't overwrite each other.
+    """
+    return RESULT_DIR / job_id
 
-        message = f"""
-您的檔案翻譯已完成！
 
-原始檔案: {original_filename}
-翻譯語言: {', '.join(languages)}
+def result_file(job_id: str, original_file_path: Path, lang: str) -> Path:
+    """
+    path of the file asrtranslate generates for one language.
+    """
+    return job_result_dir(job_id) / f"{original_file_path.stem}-{lang}.idml"
 
-下載連結:
-{"\n".join(download_links)}
 
-請點擊上方連結下載翻譯後的檔案。
+@cache
+def translator_version() -> str:
+    """
+    version of the installed asrtranslate, part of the result cache key.
+    Call translator_version.cache_clear() after upgrading asrtranslate.
+    """
+    if TRANSLATOR_VERSION:
+        return TRANSLATOR_VERSION
 
----
-ASRtranslate,
-ASRock AI Team
-        """.strip()
+    parts = []
+    for cmd in (
+        [
+            ASRTRANSLATE_DIR / ".venv/bin/python",
+            "-c",
+            "import importlib.metadata as m; print(m.version('asrtranslate'))",
+        ],
+        ["git", "-C", ASRTRANSLATE_DIR, "rev-parse", "HEAD"],
+    ):
+        try:
+            result = subprocess.run(
+                cmd, capture_output=True, text=True, timeout=30, check=True
+            )
+            parts.append(result.stdout.strip())
+        except (OSError, subprocess.SubprocessError):
+            pass
+    return "+".join(parts) or "unknown"
 
-        config_json = email_sender.load_config(
-            config_path=str(THIS_DIR / "mail_config.json")
-        )
-        success = email_sender.send_email(
-            recipients=[email], subject=subject, message=message, config=config_json
-        )
 
-        if success:
-            print(f"Email notification sent to {email}")
+def stop_process_group(p: subprocess.Popen):
+    """
+    terminate asrtranslate and everything it started, kill it if it doesn't stop.
+    """
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+        p.wait(timeout=KILL_GRACE_SECONDS)
+    except ProcessLookupError:
+        return
+    except subprocess.TimeoutExpired:
+        logger.warning(f"pid: {p.pid} did not stop, killing it")
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    p.wait()
+
+
+def record_rusage(
+    lang: str, cpu_seconds: float, max_rss_kb: int | None, span: Span | None = None
+) -> None:
+    """
+    max_rss_kb is None when the run's own peak is unknown, e.g. a warm
+    worker that can't reset its peak between runs.
+    """
+    TRANSLATE_CPU_SECONDS.observe(cpu_seconds, language=lang)
+    if span is not None:
+        span.attributes["cpu_seconds"] = cpu_seconds
+    if max_rss_kb is None:
+        return
+    # ru_maxrss is in KB on Linux
+    TRANSLATE_PEAK_RSS_BYTES.observe(max_rss_kb * 1024, language=lang)
+    if span is not None:
+        span.attributes["max_rss_kb"] = max_rss_kb
+
+
+def start_process(
+    lang: str,
+    args: list[str],
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
+    """
+    run asrtranslate in a new process, in its resource envelope (see
+    ProcessLimiter), and return its return code.
+    """
+    cmd = [ASRTRANSLATE_DIR / ".venv/bin/python", "-m", "asrtranslate", *args]
+    # a new session makes asrtranslate the leader of its own process group
+    p = subprocess.Popen(
+        cmd,
+        cwd=ASRTRANSLATE_DIR,
+        start_new_session=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        preexec_fn=limiter.preexec(),
+    )
+    envelope = limiter.apply(p.pid, f"asrtranslate-{p.pid}")
+    output.capture(p)
+    span.attributes["pid"] = p.pid
+    logger.info(f"pid: {p.pid} ({lang})")
+
+    try:
+        while True:
+            # wait4 reaps the process and reports its resource usage
+            pid, wait_status, rusage = os.wait4(p.pid, os.WNOHANG)
+            if pid:
+                p.returncode = os.waitstatus_to_exitcode(wait_status)
+                record_rusage(
+                    lang, rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss, span
+                )
+                break
+            if cancel_event.wait(0.5):
+                stop_process_group(p)
+                raise JobCancelled(f"Translation to {lang} cancelled")
+            if deadline is not None and time.time() > deadline:
+                stop_process_group(p)
+                raise JobTimeout(f"Translation to {lang} timed out")
+    finally:
+        limiter.release(envelope)
+
+    output.join(OUTPUT_DRAIN_SECONDS)
+    if limiter.out_of_memory(envelope, p.returncode, output.stderr_tail):
+        # shows in the language's error
+        if envelope.address_space_limited:
+            message = f"asrtranslate ran out of its address space limit of {ASRTRANSLATE_MAX_ADDRESS_SPACE_MB} MB"
         else:
-            print(f"Failed to send email notification to {email}")
+            message = f"asrtranslate went over its memory limit of {ASRTRANSLATE_MAX_MEMORY_MB} MB and was killed"
+        output.line("stderr", message)
+    return p.returncode
 
-    except Exception as e:
-        print(f"Error sending email notification: {e}")
+
+def run_process(
+    lang: str,
+    args: list[str],
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
+    """
+    run asrtranslate in a new process once the job has a free process slot
+    (see process_slots), and return its return code.
+    """
+    slots = process_slots.get()
+    if slots is not None:
+        while not slots.acquire(timeout=0.5):
+            if cancel_event.is_set():
+                raise JobCancelled(f"Translation to {lang} cancelled")
+            if deadline is not None and time.time() > deadline:
+                raise JobTimeout(f"Translation to {lang} timed out")
+    try:
+        return start_process(lang, args, output, cancel_event, deadline, span)
+    finally:
+        if slots is not None:
+            slots.release()
 
 
-def check_task_status(job_id: str) -> str:
+def run_on_worker(
+    lang: str,
+    args: list[str],
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
     """
-    check the status of a task. Status can be:
-    - "pending": the task is pending
-    - "running": the task is running
-    - "done": the task is done
-    - "failed": the task failed
+    run asrtranslate on a warm worker of the pool and return its return code.
     """
-    job_info = jobs.get(job_id)
-    if job_info is None:
-        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    result = worker_pool.run(args, output, cancel_event, deadline)
+    span.attributes["worker_pid"] = result.pid
+    if result.stopped == "cancelled":
+        raise JobCancelled(f"Translation to {lang} cancelled")
+    if result.stopped == "timeout":
+        raise JobTimeout(f"Translation to {lang} timed out")
+    if result.return_code is None:
+        raise Exception(f"Translation to {lang} failed: asrtranslate worker {result.pid} died")
+    if result.cpu_seconds is not None:
+        record_rusage(lang, result.cpu_seconds, result.max_rss_kb, span)
+    return result.return_code
+
+
+def run_remote(
+    job_id: str,
+    lang: str,
+    source: Path,
+    output_dir: Path,
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
+    """
+    hand asrtranslate of source to the remote workers and return its return
+    code. The worker's output arrives with its heartbeats and the translated
+    document is uploaded to output_dir before the item completes.
+    """
+    item = work_queue.put(job_id, lang, source, output_dir / f"{source.stem}-{lang}.idml")
+    remote_outputs[item.item_id] = output
+    remote_spans[item.item_id] = span
+    span.attributes["work_item"] = item.item_id
+    try:
+        while True:
+            if cancel_event.wait(WORK_POLL_INTERVAL):
+                raise JobCancelled(f"Translation to {lang} cancelled")
+            if deadline is not None and time.time() > deadline:
+                raise JobTimeout(f"Translation to {lang} timed out")
+            current = work_queue.get(item.item_id)
+            if current is None:
+                raise Exception(f"Translation to {lang} failed: its work item is gone")
+            if current.state == WorkState.LEASED and current.lease_until < time.time():
+                # the worker is gone, deliver the item again (or give up)
+                work_queue.expire()
+            elif current.state == WorkState.DONE:
+                with remote_completion_lock:
+                    pass  # its document is in place
+                span.attributes["worker"] = current.worker
+                span.attributes["attempts"] = current.attempts
+                return current.return_code
+            elif current.state == WorkState.FAILED:
+                raise Exception(f"Translation to {lang} failed: {current.error}")
+    finally:
+        remote_outputs.pop(item.item_id, None)
+        remote_spans.pop(item.item_id, None)
+        # a worker still running a cancelled item loses its lease and stops
+        work_queue.delete(item.item_id)
+
+
+def run_asrtranslate(
+    job_id: str,
+    lang: str,
+    source: Path,
+    output_dir: Path,
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
+    """
+    translate source into output_dir/{stem}-{lang}.idml on a remote worker,
+    a warm worker of the pool or a new process, return asrtranslate's
+    return code.
+    """
+    started = time.time()
+    if work_queue is not None:
+        return_code = run_remote(
+            job_id, lang, source, output_dir, output, cancel_event, deadline, span
+        )
+    else:
+        args = [f"{source}", "-o", f"{output_dir}", "-l", f"{lang}"]
+        if worker_pool is not None:
+            return_code = run_on_worker(lang, args, output, cancel_event, deadline, span)
+        else:
+            return_code = run_process(lang, args, output, cancel_event, deadline, span)
+    # the history resource (and runtime) estimates learn from
+    store.add_run(
+        lang,
+        document_size(source) or source.stat().st_size,
+        time.time() - started,
+        span.attributes.get("max_rss_kb"),
+        return_code,
+        source.suffix.lower(),
+    )
+    return return_code
+
+
+def chunk_count(original_file_path: Path) -> int:
+    """
+    number of chunks to split a document into, 1 if it's too small to split.
+    """
+    if not CHUNK_MIN_BYTES:
+        return 1
+    return max(1, min(CHUNK_MAX, document_size(original_file_path) // CHUNK_MIN_BYTES))
+
+
+def chunk_dir(job_id: str) -> Path:
+    return job_result_dir(job_id) / ".chunks"
 
-    if job_info.future.running():
-        return "running"
-    if job_info.future.done():
+
+def translate_chunk(
+    job_id: str,
+    lang: str,
+    number: int,
+    chunk: Path,
+    output_dir: Path,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    failed: threading.Event,
+) -> Path:
+    """
+    translate one chunk into output_dir, trying up to CHUNK_ATTEMPTS times.
+    Gives up early once another chunk of the language failed.
+    """
+    chunk_output = output_dir / f"{chunk.stem}-{lang}.idml"
+    error = None
+    for attempt in range(1, CHUNK_ATTEMPTS + 1):
+        if failed.is_set():
+            raise Exception(f"Translation to {lang} failed")
+        chunk_output.unlink(missing_ok=True)
+        output = job_logs.open(job_id, f"{lang}:{number}")
         try:
-            job_info.future.result()
-            return "done"
+            with tracer.span(
+                job_id, "chunk", lang, chunk=number, attempt=attempt
+            ) as span:
+                return_code = run_asrtranslate(
+                    job_id, lang, chunk, output_dir, output, cancel_event, deadline, span
+                )
+                span.attributes["return_code"] = return_code
+            if return_code == 0:
+                return chunk_output
+            error = f"return code: {return_code}"
+            if output.error_summary():
+                error += f" ({output.error_summary()})"
+        except (JobCancelled, JobTimeout):
+            raise
         except Exception as e:
-            return "failed"
-    return "pending"
+            error = str(e)
+        finally:
+            output.close()
+        logger.warning(
+            f"Chunk {number} of {chunk.stem} ({lang}) failed, attempt {attempt}/{CHUNK_ATTEMPTS}: {error}"
+        )
+    failed.set()
+    raise Exception(f"Translation to {lang} failed in chunk {number} with {error}")
 
 
-@app.post(
-    "/tasks/{lang_str}"
-)  # TODO: instead of lang_str of url, use a list of languages in the body
-def upload_and_run(
-    lang_str: str, file: UploadFile = File(...), email: str | None = Form(None)
-) -> dict:
+def translate_chunks(
+    job_id: str,
+    source: Path,
+    lang: str,
+    chunks: list[Path],
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    destination: Path,
+) -> None:
     """
-    upload a file to the server and run the task with specified language.
-    It will return message, filename, file_path, file_size, job_id, language, email.
+    translate the chunks of a split document concurrently (bounded by the
+    worker pool, the remote workers or the job's process slots) and merge
+    the results into destination, in document order.
     """
-    try:
-        assert file.filename
+    output_dir = chunks[0].parent / "translated"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    failed = threading.Event()
+    chunk_outputs: list[Path] = []
+    with ThreadPoolExecutor(max_workers=len(chunks)) as chunk_executor:
+        futures = [
+            chunk_executor.submit(
+                contextvars.copy_context().run,
+                translate_chunk,
+                job_id,
+                lang,
+                number,
+                chunk,
+                output_dir,
+                cancel_event,
+                deadline,
+                failed,
+            )
+            for number, chunk in enumerate(chunks)
+        ]
+        for number, future in enumerate(futures):
+            try:
+                chunk_outputs.append(future.result())
+            except BaseException:
+                failed.set()
+                raise
+            output.log.set_progress(
+                lang, Progress(100.0 * (number + 1) / len(chunks), updated_at=time.time())
+            )
 
-        original_file_path = UPLOAD_DIR / file.filename
-        with open(original_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    missing = [path.name for path in chunk_outputs if not path.exists()]
+    if missing:
+        raise ChunkError(f"asrtranslate generated no {', '.join(missing)}")
+    with tracer.span(job_id, "merge", lang, chunks=len(chunks)):
+        merge_document(source, chunk_outputs, destination)
 
-        file_size = os.path.getsize(original_file_path)
 
-        # Convert full language name to short code
-        language_code_list = []
-        for lang in lang_str.split("+"):
-            language_code_list.append(Language.from_fullname(lang))
+def translate_document(
+    job_id: str,
+    source: Path,
+    lang: str,
+    output_dir: Path,
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
+    """
+    translate source into output_dir/{stem}-{lang}.idml and return the
+    return code of asrtranslate. Large documents are split into chunks
+    translated concurrently (see split_document()).
+    """
+    try:
+        chunks = split_document(
+            source, chunk_dir(job_id) / lang / "chunks", chunk_count(source)
+        )
+    except (ChunkError, OSError) as e:
+        logger.warning(f"Can't split {source.name}: {e}")
+        chunks = []
+    if chunks:
+        span.attributes["chunks"] = len(chunks)
+        try:
+            translate_chunks(
+                job_id,
+                source,
+                lang,
+                chunks,
+                output,
+                cancel_event,
+                deadline,
+                output_dir / f"{source.stem}-{lang}.idml",
+            )
+            return 0
+        except ChunkError as e:
+            # the chunk outputs can't be put together, translate it in one go
+            logger.warning(f"Can't merge the chunks of {source.name} ({lang}): {e}")
+            span.attributes["chunks"] = 0
+    return run_asrtranslate(
+        job_id, lang, source, output_dir, output, cancel_event, deadline, span
+    )
 
-        # submit the task
-        job_id = str(uuid.uuid4())
-        jobs[job_id] = JobInfo(
-            future=executor.submit(
-                run_translation_task, original_file_path, language_code_list, email
-            ),
-            filename=file.filename,  # pyright: ignore[reportArgumentType]
-            file_size=file_size,
-            language=lang_str,
-            email=email,
+
+def translate_with_memory(
+    job_id: str,
+    original_file_path: Path,
+    lang: str,
+    output: LanguageOutput,
+    cancel_event: threading.Event,
+    deadline: float | None,
+    span: Span,
+) -> int:
+    """
+    translate only the segments of a document the translation memory
+    doesn't know, put the remembered ones in place and remember the new
+    ones. Raises ChunkError when the translated segments can't be matched
+    with the document's.
+    The other parts of an IDML are remembered as a segment of their own,
+    so they always come from a translation: a document made from the
+    memory alone needs them, or it is translated whole.
+    """
+    segments = read_segments(original_file_path)
+    parts = other_parts(original_file_path)
+    version = translator_version()
+    with tracer.span(job_id, "memory_lookup", lang, segments=len(segments)) as lookup:
+        remembered = translation_memory.get_many(
+            [generic(segment) for segment in segments]
+            + ([generic(parts)] if parts is not None else []),
+            lang,
+            version,
         )
+        remembered_parts = remembered.pop(len(segments), None)
+        if parts is not None and remembered_parts is None and len(remembered) == len(segments):
+            remembered = {}
+        lookup.attributes["hits"] = len(remembered)
+    span.attributes["memory_segments"] = len(remembered)
+    translated = {
+        segments[i].name: specific(segments[i], data) for i, data in remembered.items()
+    }
+    missing = [segment for i, segment in enumerate(segments) if i not in remembered]
+    generated_file = result_file(job_id, original_file_path, lang)
 
-        return {
-            "message": f"File '{file.filename}' uploaded and task started successfully with language: {lang_str}",
-            "job_id": job_id,
-            "filename": file.filename,
-            "file_size": file_size,
-            "language": lang_str,
-            "email": email,
-        }
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=f"File upload or task start failed: {str(e)}"
+    parts_from = None
+    if remembered_parts is not None:
+        parts_from = Segment(parts.name, specific(parts, remembered_parts))
+    if missing:
+        work_dir = chunk_dir(job_id) / lang
+        work_dir.mkdir(parents=True, exist_ok=True)
+        source = original_file_path
+        if remembered:
+            # a document of the segments left to translate
+            source = work_dir / original_file_path.name
+            write_document(original_file_path, missing, source)
+        return_code = translate_document(
+            job_id, source, lang, work_dir, output, cancel_event, deadline, span
         )
+        translated_file = work_dir / f"{source.stem}-{lang}.idml"
+        if return_code != 0 or not translated_file.exists():
+            return return_code
+        try:
+            new = translated_segments(missing, translated_file)
+        except ChunkError:
+            if remembered:
+                raise
+            # nothing to put in place, the translation is the result as it is
+            translated_file.replace(generated_file)
+            store.count_segments(job_id, len(segments), 0)
+            return 0
+        remember = [
+            (generic(segment), generic(segment, translation.data))
+            for segment, translation in zip(missing, new)
+        ]
+        if parts is not None:
+            remember.append((generic(parts), generic(parts, other_parts(translated_file).data)))
+        translation_memory.put_many(remember, lang, version)
+        if not remembered:
+            # nothing to splice in, asrtranslate's package is the result as it is
+            translated_file.replace(generated_file)
+            store.count_segments(job_id, len(segments), 0)
+            return 0
+        translated.update((translation.name, translation.data) for translation in new)
+        parts_from = translated_file
 
+    write_document(
+        original_file_path,
+        [Segment(segment.name, translated[segment.name]) for segment in segments],
+        generated_file,
+        parts_from,
+    )
+    store.count_segments(job_id, len(segments), len(remembered))
+    return 0
 
-@app.get("/tasks/status/{job_id}")
-def get_task_status(job_id: str) -> dict:
+
+def translate_language(
+    job_id: str,
+    original_file_path: Path,
+    lang: str,
+    cancel_event: threading.Event,
+    deadline: float | None = None,
+    file_hash: str | None = None,
+) -> Path | None:
     """
-    get the status of a task.
-    It will return job_id, status and file information.
+    run asrtranslate for one language and return the generated file if any.
+    The process (group) is stopped when cancel_event is set or the deadline passes.
+    With a file_hash, the result cache is used before and filled after the run.
+    Segments the translation memory knows are not translated again.
     """
-    if job_id not in jobs:
-        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if cancel_event.is_set():
+        store.set_language_status(job_id, lang, JobStatus.CANCELLED)
+        raise JobCancelled(f"Translation to {lang} cancelled")
 
-    job_info = jobs[job_id]
-    return {
-        "job_id": job_id,
-        "status": check_task_status(job_id),
-        "filename": job_info.filename,
-        "file_size": job_info.file_size,
-        "language": job_info.language,
-        "email": job_info.email,
-    }
+    generated_file = result_file(job_id, original_file_path, lang)
+    with tracer.span(job_id, "cache_lookup", lang) as span:
+        cache_hit = bool(file_hash) and result_cache.get(
+            file_hash, lang, translator_version(), generated_file
+        )
+        span.attributes["hit"] = cache_hit
+    if cache_hit:
+        logger.info(f"Cache hit: {original_file_path.name} ({lang})")
+        store.set_language_status(job_id, lang, JobStatus.DONE)
+        return generated_file
+
+    store.set_language_status(job_id, lang, JobStatus.RUNNING)
+    job_result_dir(job_id).mkdir(parents=True, exist_ok=True)
+
+    span = tracer.begin(job_id, "translate", lang)
+    outcome = "failed"
+    return_code = None
+    output = job_logs.open(job_id, lang)
+    try:
+        if (
+            translation_memory is not None
+            and original_file_path.suffix.lower() in SEGMENTED_SUFFIXES
+        ):
+            try:
+                return_code = translate_with_memory(
+                    job_id, original_file_path, lang, output, cancel_event, deadline, span
+                )
+            except ChunkError as e:
+                logger.warning(
+                    f"Can't use the translation memory for {original_file_path.name} ({lang}): {e}"
+                )
+        if return_code is None:
+            return_code = translate_document(
+                job_id,
+                original_file_path,
+                lang,
+                job_result_dir(job_id),
+                output,
+                cancel_event,
+                deadline,
+                span,
+            )
+        if return_code != 0:
+            message = f"Translation to {lang} failed with return code: {return_code}"
+            if output.error_summary():
+                message += f" ({output.error_summary()})"
+            raise Exception(message)
+        outcome = "done"
+    except JobCancelled:
+        outcome = "cancelled"
+        store.set_language_status(job_id, lang, JobStatus.CANCELLED)
+        raise
+    except JobTimeout:
+        outcome = "timeout"
+        store.set_language_status(job_id, lang, JobStatus.FAILED)
+        raise
+    except Exception:
+        store.set_language_status(job_id, lang, JobStatus.FAILED)
+        raise
+    finally:
+        output.close()
+        tracer.end(
+            job_id,
+            span,
+            error=None if outcome == "done" else outcome,
+            return_code=return_code,
+        )
+        TRANSLATE_SECONDS.observe(span.duration, language=lang, outcome=outcome)
+
+    store.set_language_status(job_id, lang, JobStatus.DONE)
 
+    # check if the generated file exists
+    # TODO: not sync with the translation process
+    with tracer.span(job_id, "verify", lang) as span:
+        span.attributes["exists"] = generated_file.exists()
+        if span.attributes["exists"] and file_hash:
+            result_cache.put(file_hash, lang, translator_version(), generated_file)
+    return generated_file if span.attributes["exists"] else None
 
-@app.get("/tasks/")
-def list_jobs() -> dict:
+
+def run_translation_task(
+    job_id: str,
+    original_file_path: Path,
+    language: list[str] = ["en"],
+    email: str | None = None,
+    timeout: float | None = None,
+):
     """
-    list all jobs.
+    execute the translation of one file into every requested language.
+    Languages run as separate asrtranslate processes; all languages and
+    chunks of the job share job_processes() process slots. The state of
+    the job and of each language is recorded in the job store. Languages already done (a job requeued
+    after a restart) are not translated again.
+    The job stops when cancel_job() is called or after timeout seconds,
+    partial outputs of unfinished languages are removed.
     """
-    return {
-        "jobs": [
-            {
-                "job_id": job_id,
-                "status": check_task_status(job_id),
-                "filename": job_info.filename,
-                "file_size": job_info.file_size,
-                "language": job_info.language,
-                "email": job_info.email,
+    cancel_event = cancel_events.setdefault(job_id, threading.Event())
+    tracer.end_open(job_id, "queued")
+    run_span = tracer.begin(job_id, "run")
+    token = current_job_id.set(job_id)
+    slots_token = None
+    try:
+        if cancel_event.is_set():
+            store.set_status(job_id, JobStatus.CANCELLED)
+            return
+        store.set_status(job_id, JobStatus.RUNNING)
+        for follower_id in flights.followers(job_id):
+            store.set_status(follower_id, JobStatus.RUNNING)
+        deadline = time.time() + timeout if timeout else None
+
+        job = store.get(job_id)
+        done_before = [
+            lang
+            for lang in language
+            if job is not None and job.language_status.get(lang) == JobStatus.DONE
+        ]
+        todo = [lang for lang in language if lang not in done_before]
+
+        workers = job_processes(todo, original_file_path)
+        # warm and remote workers bound their own runs
+        local = worker_pool is None and work_queue is None
+        slots_token = process_slots.set(threading.Semaphore(workers) if local else None)
+        logger.info(
+            f"Running: {original_file_path} with language: {todo} ({workers} workers)"
+        )
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(todo)))) as language_executor:
+            # each language thread runs in a copy of this context, with the job id
+            futures = {
+                lang: language_executor.submit(
+                    contextvars.copy_context().run,
+                    translate_language,
+                    job_id,
+                    original_file_path,
+                    lang,
+                    cancel_event,
+                    deadline,
+                    job.file_hash if job is not None else None,
+                )
+                for lang in todo
             }
-            for job_id, job_info in jobs.items()
+        shutil.rmtree(chunk_dir(job_id), ignore_errors=True)
+
+        generated_files = [
+            result_file(job_id, original_file_path, lang)
+            for lang in done_before
+            if result_file(job_id, original_file_path, lang).exists()
         ]
-    }
+        done_languages = list(done_before)
+        errors = []
+        for lang, future in futures.items():
+            try:
+                generated_file = future.result()
+            except Exception as e:
+                errors.append(str(e))
+                # remove what an interrupted asrtranslate left behind
+                partial_file = result_file(job_id, original_file_path, lang)
+                partial_file.unlink(missing_ok=True)
+                result_index.remove(partial_file)
+                continue
+            done_languages.append(lang)
+            if generated_file is not None:
+                generated_files.append(generated_file)
+                result_index.add(generated_file)
 
+        logger.info(f"Finished: {original_file_path}")
 
-@app.get("/list_files")
-def list_uploaded_files() -> dict:
+        if cancel_event.is_set():
+            store.set_status(job_id, JobStatus.CANCELLED)
+            return
+        if errors:
+            store.set_status(job_id, JobStatus.FAILED, "; ".join(errors))
+        else:
+            store.set_status(job_id, JobStatus.DONE)
+
+        if email and generated_files:
+            send_completion_email(
+                email, original_file_path.name, generated_files, done_languages, job_id
+            )
+
+        if errors:
+            raise Exception("; ".join(errors))
+    finally:
+        cancel_events.pop(job_id, None)
+        finish_followers(job_id)
+        job = store.get(job_id)
+        tracer.end(job_id, run_span, status=job.status if job is not None else None)
+        if slots_token is not None:
+            process_slots.reset(slots_token)
+        current_job_id.reset(token)
+
+
+def flight_key(job_info: JobInfo) -> str | None:
     """
-    list all uploaded files.
+    jobs with the same upload content and languages share one execution.
     """
-    if not UPLOAD_DIR.exists():
-        return {"files": []}
+    if not job_info.file_hash:
+        return None
+    return f"{job_info.file_hash}:{'+'.join(sorted(job_info.languages))}"
 
-    files = []
-    for entry in UPLOAD_DIR.iterdir():
-        if entry.is_file():
-            files.append(
-                {
-                    "filename": entry.name,
-                    "file_size": entry.stat().st_size,
-                    "modified_time": entry.stat().st_mtime,
-                }
+
+def enqueue_job(job_info: JobInfo):
+    """
+    attach a job to an identical queued or running job, submit it otherwise.
+    """
+    key = flight_key(job_info)
+    if key is not None:
+        leader_id = flights.attach(key, job_info.job_id)
+        if leader_id is not None:
+            logger.info(
+                f"Job {job_info.job_id} attached to job {leader_id}",
+                extra={"job_id": job_info.job_id},
+            )
+            leader = store.get(leader_id)
+            if leader is not None and leader.status == JobStatus.RUNNING:
+                store.set_status(job_info.job_id, JobStatus.RUNNING)
+            return
+    submit_job(job_info)
+
+
+def finish_followers(leader_id: str):
+    """
+    give the jobs attached to a finished job its results and final status.
+    If the leader was cancelled, its followers are queued on their own.
+    """
+    followers = flights.release(leader_id)
+    if not followers:
+        return
+    leader = store.get(leader_id)
+    for follower_id in followers:
+        follower = store.get(follower_id)
+        if follower is None:
+            continue
+        if leader is None or leader.status not in (JobStatus.DONE, JobStatus.FAILED):
+            store.set_status(follower_id, JobStatus.PENDING)
+            enqueue_job(follower)
+            continue
+
+        generated_files = []
+        for lang in follower.languages:
+            status = leader.language_status.get(lang, JobStatus.FAILED)
+            if status == JobStatus.DONE:
+                source = result_file(leader_id, Path(leader.file_path), lang)
+                if source.exists():
+                    target = result_file(follower_id, Path(follower.file_path), lang)
+                    link_or_copy(source, target)
+                    result_index.add(target)
+                    generated_files.append(target)
+            store.set_language_status(follower_id, lang, status)
+        store.set_status(follower_id, leader.status, leader.error)
+
+        if follower.email and follower.batch_id is None and generated_files:
+            send_completion_email(
+                follower.email,
+                follower.filename,
+                generated_files,
+                [
+                    lang
+                    for lang in follower.languages
+                    if leader.language_status.get(lang) == JobStatus.DONE
+                ],
+                follower_id,
+            )
+
+
+def complete_from_cache(job_info: JobInfo) -> bool:
+    """
+    finish a job without translating when every language is in the result
+    cache. Return False (with the hits already placed) if any language is missing.
+    """
+    if not job_info.file_hash:
+        return False
+    version = translator_version()
+    if not all(
+        result_cache.contains(job_info.file_hash, lang, version)
+        for lang in job_info.languages
+    ):
+        return False
+
+    original_file_path = Path(job_info.file_path)
+    generated_files = []
+    for lang in job_info.languages:
+        generated_file = result_file(job_info.job_id, original_file_path, lang)
+        if not result_cache.get(job_info.file_hash, lang, version, generated_file):
+            return False
+        store.set_language_status(job_info.job_id, lang, JobStatus.DONE)
+        result_index.add(generated_file)
+        generated_files.append(generated_file)
+
+    store.set_status(job_info.job_id, JobStatus.RUNNING)
+    store.set_status(job_info.job_id, JobStatus.DONE)
+    logger.info(
+        f"Completed job {job_info.job_id} from the result cache",
+        extra={"job_id": job_info.job_id},
+    )
+    if job_info.email and job_info.batch_id is None:
+        send_completion_email(
+            job_info.email,
+            original_file_path.name,
+            generated_files,
+            job_info.languages,
+            job_info.job_id,
+        )
+    return True
+
+
+def cancel_job(job_id: str) -> bool:
+    """
+    cancel a pending job or stop a running one, False if it already finished.
+    """
+    job = store.get(job_id)
+    if job is None or job.status in FINISHED_STATUSES:
+        return False
+    if flights.detach(job_id):
+        store.set_status(job_id, JobStatus.CANCELLED)
+        return True
+    if scheduler.cancel(job_id):
+        store.set_status(job_id, JobStatus.CANCELLED)
+        cancel_events.pop(job_id, None)
+        # jobs attached to this one are queued on their own
+        finish_followers(job_id)
+        return True
+    # running (or just picked by a worker): the task stops its processes itself
+    cancel_events.setdefault(job_id, threading.Event()).set()
+    return True
+
+
+def requeue_unfinished_jobs():
+    """
+    submit again the jobs that were pending or running when the server stopped.
+    """
+    for job in store.unfinished():
+        original_file_path = Path(job.file_path)
+        if not original_file_path.exists():
+            store.set_status(
+                job.job_id, JobStatus.FAILED, f"Uploaded file {job.file_path} is gone"
             )
+            continue
+        logger.info(f"Requeue job {job.job_id}: {job.filename}", extra={"job_id": job.job_id})
+        store.set_status(job.job_id, JobStatus.PENDING)
+        enqueue_job(job)
 
-    return {"files": files}
+
+def submit_job(job: JobInfo):
+    """
+    queue a job on the scheduler, the uploader's email is used for fairness.
+    """
+    tracer.begin(job.job_id, "queued")
+    scheduler.submit(
+        job.job_id,
+        run_translation_task,
+        job.job_id,
+        Path(job.file_path),
+        job.languages,
+        # a batch sends one email for all of its jobs
+        job.email if job.batch_id is None else None,
+        job.timeout,
+        owner=job.email,
+        size=job.file_size,
+        memory_mb=job_memory_mb(job),
+        estimate=job_estimate(job),
+    )
+
+
+def server_url(path: str) -> str:
+    return f"http://{FASTAPI_SERVER}:{FASTAPI_PORT}{path}"
+
+
+def download_url(file_path: Path) -> str:
+    relative_path = file_path.relative_to(RESULT_DIR).as_posix()
+    return server_url(f"/results/{urllib.parse.quote(relative_path)}")
+
+
+def send_completion_email(
+    email: str,
+    original_filename: str,
+    generated_files: list[Path],
+    languages: list[str],
+    job_id: str | None = None,
+):
+    """
+    queue the email notification of a completed task, it is delivered by
+    the notifier thread.
+    """
+    try:
+        # create download links
+        download_links = [download_url(file_path) for file_path in generated_files]
+        if job_id is not None and len(generated_files) > 1:
+            download_links.append(f"全部下載 (zip): {server_url(f'/tasks/{job_id}/download')}")
+
+        # create email content
+        subject = f"ASRtranslate 翻譯完成 - {original_filename}"
+
+        message = f"""
+您的檔案翻譯已完成！
+
+原始檔案: {original_filename}
+翻譯語言: {', '.join(languages)}
+
+下載連結:
+{"\n".join(download_links)}
+
+請點擊上方連結下載翻譯後的檔案。
+
+---
+ASRtranslate,
+ASRock AI Team
+        """.strip()
+
+        notifier.enqueue([email], subject, message, job_id=job_id)
+
+    except Exception as e:
+        logger.error(f"Error queueing email notification: {e}")
+
+
+def send_batch_email(batch: BatchInfo, jobs: list[JobInfo]):
+    """
+    queue the one email of a finished batch: the results of every file and
+    the files that failed.
+    """
+    try:
+        download_links = []
+        failures = []
+        for job in jobs:
+            for lang in job.languages:
+                generated_file = result_file(job.job_id, Path(job.file_path), lang)
+                if job.language_status.get(lang) == JobStatus.DONE and generated_file.exists():
+                    download_links.append(download_url(generated_file))
+            if job.status != JobStatus.DONE:
+                failures.append(f"{job.filename}: {job.error or job.status}")
+        if len(download_links) > 1:
+            download_links.append(
+                f"全部下載 (zip): {server_url(f'/batches/{batch.batch_id}/download')}"
+            )
+
+        subject = f"ASRtranslate 翻譯完成 - {len(jobs)} 個檔案"
+        message = f"""
+您的 {len(jobs)} 個檔案翻譯已完成！
+
+原始檔案: {', '.join(job.filename for job in jobs)}
+翻譯語言: {batch.language}
+
+下載連結:
+{"\n".join(download_links)}
+"""
+        if failures:
+            message += f"""
+翻譯失敗:
+{"\n".join(failures)}
+"""
+        message += """
+請點擊上方連結下載翻譯後的檔案。
+
+---
+ASRtranslate,
+ASRock AI Team
+"""
+        notifier.enqueue([batch.email], subject, message.strip())
+
+    except Exception as e:
+        logger.error(f"Error queueing batch email notification: {e}")
+
+
+def notify_finished_batch(event: dict) -> None:
+    """
+    send the combined email of a batch once its last job finished.
+    """
+    if event["language"] is not None or event["status"] not in FINISHED_STATUSES:
+        return
+    job = store.get(event["job_id"])
+    if job is None or job.batch_id is None:
+        return
+    batch = store.get_batch(job.batch_id)
+    if batch is None or not batch.email or batch.notified_at is not None:
+        return
+    jobs = store.batch_jobs(batch.batch_id)
+    if any(job.status not in FINISHED_STATUSES for job in jobs):
+        return
+    if store.mark_batch_notified(batch.batch_id):
+        send_batch_email(batch, jobs)
+
+
+store.subscribe(notify_finished_batch)
+
+
+def batch_status(jobs: list[JobInfo]) -> str:
+    """
+    done when every job is done, failed when any job failed or was
+    cancelled (cancelled when all were), pending until a job started.
+    """
+    statuses = {job.status for job in jobs}
+    if not statuses <= set(FINISHED_STATUSES):
+        return JobStatus.PENDING if statuses == {JobStatus.PENDING} else JobStatus.RUNNING
+    if statuses == {JobStatus.DONE}:
+        return JobStatus.DONE
+    if statuses == {JobStatus.CANCELLED}:
+        return JobStatus.CANCELLED
+    return JobStatus.FAILED
+
+
+def check_task_status(job_id: str) -> str:
+    """
+    check the status of a task. Status can be:
+    - "pending": the task is pending
+    - "running": the task is running
+    - "done": the task is done
+    - "failed": the task failed
+    """
+    job_info = store.get(job_id)
+    if job_info is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_info.status
+
+
+def job_to_dict(job_info: JobInfo) -> dict:
+    return {
+        "job_id": job_info.job_id,
+        "status": job_info.status,
+        "filename": job_info.filename,
+        "file_size": job_info.file_size,
+        "file_hash": job_info.file_hash,
+        "language": job_info.language,
+        "languages": job_info.language_status,
+        "email": job_info.email,
+        "error": job_info.error,
+        "submitted_at": job_info.submitted_at,
+        "started_at": job_info.started_at,
+        "finished_at": job_info.finished_at,
+        "segments": job_info.segments,
+        "memory_segments": job_info.memory_segments,
+        "batch_id": job_info.batch_id,
+    }
+
+
+async def run_io(fn, *args, **kwargs):
+    """
+    run a blocking call on the I/O executor without blocking the event loop.
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        io_executor, partial(fn, *args, **kwargs)
+    )
+
+
+def copy_chunk(source: IO[bytes], buffer: IO[bytes], sha256) -> int:
+    """
+    copy the next chunk of source to buffer, return its size (0 at the end).
+    """
+    chunk = source.read(UPLOAD_CHUNK_SIZE)
+    sha256.update(chunk)
+    buffer.write(chunk)
+    return len(chunk)
+
+
+def discard_upload(temp_path: str, destination: Path) -> None:
+    """
+    remove what a failed upload left behind: its temp file, and the
+    per-job directory it was going to if nothing else is in there.
+    """
+    with suppress(FileNotFoundError):
+        os.unlink(temp_path)
+    with suppress(OSError):
+        destination.parent.rmdir()
+
+
+def save_upload(source: IO[bytes], destination: Path) -> tuple[int, str]:
+    """
+    stream an upload (or a member of an uploaded zip) to destination in one
+    pass and return its size and
+    SHA-256. The data goes to a temp file next to destination first and is
+    renamed into place once complete; uploads above MAX_UPLOAD_BYTES are
+    rejected as soon as they pass the limit.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=destination.parent, prefix=".upload-")
+    started = time.time()
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while copied := copy_chunk(source, buffer, sha256):
+                size += copied
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes",
+                    )
+        os.replace(temp_path, destination)
+        upload_index.add(destination)
+    except BaseException:
+        discard_upload(temp_path, destination)
+        raise
+    UPLOAD_WRITE_SECONDS.observe(time.time() - started)
+    UPLOAD_BYTES.inc(size)
+    return size, sha256.hexdigest()
+
+
+async def save_upload_async(file: UploadFile, destination: Path) -> tuple[int, str]:
+    """
+    save_upload() for async endpoints: every chunk is read, hashed and
+    written on the I/O executor, so the event loop keeps serving other
+    requests and concurrent uploads share the executor chunk by chunk.
+    """
+    await run_io(destination.parent.mkdir, parents=True, exist_ok=True)
+    sha256 = hashlib.sha256()
+    size = 0
+    fd, temp_path = await run_io(
+        tempfile.mkstemp, dir=destination.parent, prefix=".upload-"
+    )
+    started = time.time()
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while copied := await run_io(copy_chunk, file.file, buffer, sha256):
+                size += copied
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes",
+                    )
+        await run_io(os.replace, temp_path, destination)
+        await run_io(upload_index.add, destination)
+    except BaseException:
+        await run_io(discard_upload, temp_path, destination)
+        raise
+    UPLOAD_WRITE_SECONDS.observe(time.time() - started)
+    UPLOAD_BYTES.inc(size)
+    return size, sha256.hexdigest()
+
+
+def start_job(job_info: JobInfo) -> None:
+    """
+    record a new job and finish it from the result cache or queue it.
+    """
+    store.add(job_info)
+    if not complete_from_cache(job_info):
+        enqueue_job(job_info)
+
+
+@app.post(
+    "/tasks/{lang_str}"
+)  # TODO: instead of lang_str of url, use a list of languages in the body
+async def upload_and_run(
+    request: Request,
+    lang_str: str,
+    file: UploadFile = File(...),
+    email: str | None = Form(None),
+    timeout: float | None = Form(None),
+) -> dict:
+    """
+    upload a file to the server and run the task with specified language.
+    timeout is the wall-clock limit of the job in seconds (TASK_JOB_TIMEOUT by default).
+    It will return message, filename, file_path, file_size, job_id, language, email.
+    """
+    try:
+        content_length = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > MAX_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=413, detail=f"File is larger than {MAX_UPLOAD_BYTES} bytes"
+        )
+
+    try:
+        assert file.filename
+        filename = Path(file.filename).name
+
+        job_id = str(uuid.uuid4())
+        original_file_path = UPLOAD_DIR / job_id / filename
+        file_size, file_hash = await save_upload_async(file, original_file_path)
+
+        # Convert full language name to short code
+        language_code_list = []
+        for lang in lang_str.split("+"):
+            language_code_list.append(Language.from_fullname(lang))
+
+        # submit the task
+        job_info = JobInfo(
+            job_id=job_id,
+            filename=filename,
+            file_path=str(original_file_path),
+            file_size=file_size,
+            file_hash=file_hash,
+            language=lang_str,
+            languages=language_code_list,
+            email=email,
+            timeout=timeout or JOB_TIMEOUT or None,
+        )
+        await run_io(start_job, job_info)
+
+        return {
+            "message": f"File '{filename}' uploaded and task started successfully with language: {lang_str}",
+            "job_id": job_id,
+            "filename": filename,
+            "file_size": file_size,
+            "file_hash": file_hash,
+            "language": lang_str,
+            "email": email,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"File upload or task start failed: {str(e)}"
+        )
+
+
+def parse_languages(languages: str) -> list[str]:
+    """
+    the short codes of a JSON list of language names (or codes).
+    """
+    try:
+        names = json.loads(languages)
+    except json.JSONDecodeError:
+        names = None
+    if not isinstance(names, list) or not names or not all(
+        isinstance(name, str) for name in names
+    ):
+        raise HTTPException(
+            status_code=400, detail='languages must be a JSON list, e.g. ["japanese", "english"]'
+        )
+    codes = []
+    for name in names:
+        code = Language.from_fullname(name)
+        if code not in list(Language):
+            raise HTTPException(status_code=400, detail=f"Unknown language: {name}")
+        codes.append(code)
+    return list(dict.fromkeys(codes))
+
+
+def batch_entries(files: list[UploadFile]) -> list[tuple[str, UploadFile, str | None]]:
+    """
+    the files of a batch as (filename, upload, zip member or None), in the
+    order they were sent, with the members of zip uploads in place of the
+    zip. Everything is checked before any file is saved.
+    """
+    entries = []
+    for file in files:
+        if not file.filename:
+            raise HTTPException(status_code=400, detail="Every file needs a filename")
+        filename = Path(file.filename).name
+        if not filename.lower().endswith(".zip"):
+            entries.append((filename, file, None))
+            continue
+        try:
+            with zipfile.ZipFile(file.file) as package:
+                members = [
+                    info
+                    for info in package.infolist()
+                    if not info.is_dir()
+                    and not Path(info.filename).name.startswith(".")
+                    and not info.filename.startswith("__MACOSX/")
+                ]
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail=f"{filename} is not a valid zip")
+        if not members:
+            raise HTTPException(status_code=400, detail=f"{filename} contains no files")
+        for info in members:
+            if info.file_size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"{info.filename} in {filename} is larger than {MAX_UPLOAD_BYTES} bytes",
+                )
+            entries.append((Path(info.filename).name, file, info.filename))
+    if not entries:
+        raise HTTPException(status_code=400, detail="No files")
+    if len(entries) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=413, detail=f"A batch holds at most {BATCH_MAX_FILES} files"
+        )
+    return entries
+
+
+@app.post("/batches")
+def submit_batch(
+    files: list[UploadFile] = File(...),
+    languages: str = Form(...),
+    email: str | None = Form(None),
+    timeout: float | None = Form(None),
+) -> dict:
+    """
+    upload many files (or zips of files) and translate each of them into
+    every language of languages, a JSON list such as ["japanese", "english"].
+    Every job of the batch is recorded and queued at once; with an email,
+    one email is sent when the whole batch finished instead of one per file.
+    It will return the batch_id and the job of each file.
+    """
+    language_codes = parse_languages(languages)
+    entries = batch_entries(files)
+    batch = BatchInfo(
+        batch_id=str(uuid.uuid4()),
+        language="+".join(Language(code).fullname() for code in language_codes),
+        email=email,
+    )
+
+    jobs = []
+    try:
+        for filename, file, member in entries:
+            job_id = str(uuid.uuid4())
+            original_file_path = UPLOAD_DIR / job_id / filename
+            if member is None:
+                file.file.seek(0)
+                file_size, file_hash = save_upload(file.file, original_file_path)
+            else:
+                with zipfile.ZipFile(file.file) as package, package.open(member) as data:
+                    file_size, file_hash = save_upload(data, original_file_path)
+            jobs.append(
+                JobInfo(
+                    job_id=job_id,
+                    filename=filename,
+                    file_path=str(original_file_path),
+                    file_size=file_size,
+                    file_hash=file_hash,
+                    language=batch.language,
+                    languages=language_codes,
+                    email=email,
+                    timeout=timeout or JOB_TIMEOUT or None,
+                    batch_id=batch.batch_id,
+                )
+            )
+    except BaseException as e:
+        # nothing of a rejected batch is kept
+        for job in jobs:
+            Path(job.file_path).unlink(missing_ok=True)
+            upload_index.remove(Path(job.file_path))
+            shutil.rmtree(Path(job.file_path).parent, ignore_errors=True)
+        if isinstance(e, HTTPException):
+            raise
+        if isinstance(e, Exception):
+            raise HTTPException(status_code=500, detail=f"Batch upload failed: {e}")
+        raise
+
+    store.add_batch(batch, jobs)
+    for job in jobs:
+        if not complete_from_cache(job):
+            enqueue_job(job)
+
+    return {
+        "message": f"{len(jobs)} files uploaded and tasks started successfully with language: {batch.language}",
+        "batch_id": batch.batch_id,
+        "language": batch.language,
+        "email": email,
+        "jobs": [
+            {
+                "job_id": job.job_id,
+                "filename": job.filename,
+                "file_size": job.file_size,
+                "file_hash": job.file_hash,
+            }
+            for job in jobs
+        ],
+    }
+
+
+@app.get("/batches/{batch_id}")
+def get_batch_status(batch_id: str) -> dict:
+    """
+    get the status of a batch: its aggregated status, the number of jobs
+    in each status and the status of every job.
+    """
+    batch = store.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    jobs = store.batch_jobs(batch_id)
+    counts = {status.value: 0 for status in JobStatus}
+    for job in jobs:
+        counts[job.status] += 1
+    return {
+        "batch_id": batch.batch_id,
+        "status": batch_status(jobs),
+        "language": batch.language,
+        "email": batch.email,
+        "submitted_at": batch.submitted_at,
+        "notified_at": batch.notified_at,
+        "counts": counts,
+        "jobs": [job_to_dict(job) for job in jobs],
+    }
+
+
+@app.get("/tasks/status/{job_id}")
+async def get_task_status(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=60),
+    since: int | None = None,
+) -> dict:
+    """
+    get the status of a task.
+    It will return job_id, status, file information and event_id, the id of
+    the job's latest event. With wait, the request is held for up to wait
+    seconds until the job has an event newer than since (or, without since,
+    until its next event); finished jobs return at once.
+    The job is read through the store's read-only connections, which never
+    wait for writers, on the I/O executor, so the status stays fast while
+    uploads are running.
+    """
+    subscription = events.subscribe(job_id) if wait else None
+    try:
+        job_info, event_id = await run_io(read_job, job_id)
+        if job_info is None:
+            raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+        if (
+            subscription is not None
+            and job_info.status not in FINISHED_STATUSES
+            and (since is None or event_id <= since)
+        ):
+            if await subscription.get(timeout=wait) is not None:
+                changed, event_id = await run_io(read_job, job_id)
+                job_info = changed or job_info
+    finally:
+        if subscription is not None:
+            events.unsubscribe(subscription)
+
+    return {
+        **job_to_dict(job_info),
+        "event_id": event_id,
+        "attached_to": flights.leader_of(job_id),
+        **await run_io(job_queue_state, job_id),
+    }
+
+
+def read_job(job_id: str) -> tuple[JobInfo | None, int]:
+    """
+    a job and the id of its latest event.
+    """
+    return store.get(job_id), store.last_event_id(job_id)
+
+
+def job_queue_state(job_id: str) -> dict:
+    """
+    queue position, estimates and progress of a job.
+    """
+    return {
+        "queue_position": scheduler.position(job_id),
+        **job_estimates(job_id, scheduler.estimates()),
+        "progress": {
+            lang: asdict(progress) for lang, progress in job_logs.progress(job_id).items()
+        },
+    }
+
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: job\ndata: {json.dumps(event)}\n\n"
+
+
+@app.get("/tasks/estimates")
+def get_job_estimates() -> dict:
+    """
+    estimated start and finish of every queued and running job, polled by
+    the web UI's task table.
+    """
+    estimates = scheduler.estimates()
+    return {job_id: job_estimates(job_id, estimates) for job_id in estimates}
+
+
+@app.get("/tasks/events")
+async def stream_task_events(
+    request: Request, job_id: str | None = None, since: int | None = None
+) -> StreamingResponse:
+    """
+    Server-Sent Events stream of job state transitions (job and per-language),
+    of every job or only of job_id. A reconnecting client resumes after the
+    Last-Event-ID header (or since) from the job store.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    after_id = since
+    if last_event_id:
+        try:
+            after_id = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be an event id")
+    if after_id is None:
+        after_id = await run_io(store.last_event_id)
+
+    async def event_stream():
+        nonlocal after_id
+        subscription = events.subscribe(job_id)
+        try:
+            # events written before the subscription started
+            while backlog := await run_io(store.events_since, after_id, job_id):
+                for event in backlog:
+                    yield format_event(event)
+                after_id = backlog[-1]["id"]
+            while not await request.is_disconnected():
+                if subscription.overflowed:
+                    # the client is too slow, it reconnects with Last-Event-ID
+                    return
+                event = await subscription.get(timeout=15)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                elif event["id"] > after_id:
+                    after_id = event["id"]
+                    yield format_event(event)
+        finally:
+            events.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.delete("/tasks/{job_id}")
+def delete_task(job_id: str) -> dict:
+    """
+    cancel a pending task or stop a running one.
+    """
+    job_info = store.get(job_id)
+    if job_info is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if not cancel_job(job_id):
+        raise HTTPException(
+            status_code=409, detail=f"Job {job_id} is already {job_info.status}"
+        )
+    return {"message": f"Job {job_id} cancelled", "job_id": job_id}
+
+
+def read_chunks(f) -> list[bytes]:
+    """
+    what can be read from f now, in chunks of at most LOG_CHUNK_SIZE.
+    """
+    chunks = []
+    while chunk := f.read(LOG_CHUNK_SIZE):
+        chunks.append(chunk)
+        if len(chunks) >= 16:
+            break
+    return chunks
+
+
+def tail_lines(job_id: str, tail: int) -> list[str]:
+    """
+    the last tail lines of a job's output, from memory while it runs.
+    """
+    lines = job_logs.tail(job_id, tail)
+    if lines is not None:
+        return lines
+    path = job_logs.log_path(job_id)
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return list(deque(f, maxlen=tail))
+
+
+def log_replaced(path: Path, f) -> bool:
+    """
+    whether path is no longer the file f reads, i.e. the log was rotated.
+    """
+    try:
+        return os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+@app.get("/tasks/{job_id}/log", response_model=None)
+async def get_task_log(
+    job_id: str,
+    follow: bool = False,
+    tail: int | None = Query(None, ge=1, le=10000),
+) -> StreamingResponse | PlainTextResponse:
+    """
+    the asrtranslate output of a job, streamed from its log files (rotated
+    ones first). With follow=1 the stream stays open and sends new output
+    until the job finished. With tail, only the last tail lines are sent.
+    Files are read on the io executor, not on the event loop.
+    """
+    job_info = await run_io(store.get, job_id)
+    if job_info is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    if tail is not None and not follow:
+        lines = await run_io(tail_lines, job_id, tail)
+        return PlainTextResponse("".join(lines))
+
+    def finished() -> bool:
+        job = store.get(job_id)
+        return (
+            job is None or job.status in FINISHED_STATUSES
+        ) and not job_logs.is_active(job_id)
+
+    async def log_stream():
+        files = await run_io(job_logs.files, job_id)
+        for path in files[:-1]:
+            with await run_io(open, path, "rb") as f:
+                while chunks := await run_io(read_chunks, f):
+                    for chunk in chunks:
+                        yield chunk
+        path = job_logs.log_path(job_id)
+        while not await run_io(path.exists):
+            if not follow or await run_io(finished):
+                return
+            await asyncio.sleep(LOG_FOLLOW_INTERVAL)
+        f = await run_io(open, path, "rb")
+        try:
+            while True:
+                chunks = await run_io(read_chunks, f)
+                for chunk in chunks:
+                    yield chunk
+                if chunks:
+                    continue
+                if not follow:
+                    return
+                if await run_io(log_replaced, path, f):
+                    # the rest of the old file was read above
+                    f.close()
+                    f = await run_io(open, path, "rb")
+                    continue
+                if await run_io(finished):
+                    # output written between the last read and the job's end
+                    for chunk in await run_io(read_chunks, f):
+                        yield chunk
+                    return
+                await asyncio.sleep(LOG_FOLLOW_INTERVAL)
+        finally:
+            f.close()
+
+    return StreamingResponse(log_stream(), media_type="text/plain; charset=utf-8")
+
+
+def job_results(job: JobInfo) -> list[Path]:
+    """
+    the generated files of a job that are still there, in language order.
+    """
+    results = []
+    for lang in job.languages:
+        generated_file = result_file(job.job_id, Path(job.file_path), lang)
+        if job.language_status.get(lang) == JobStatus.DONE and generated_file.exists():
+            results.append(generated_file)
+    return results
+
+
+def content_disposition(filename: str) -> str:
+    quoted = urllib.parse.quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def zip_response(files: list[tuple[str, Path]], filename: str) -> StreamingResponse:
+    """
+    stream files as a zip built on the fly, no copy is written to disk.
+    """
+    return StreamingResponse(
+        stream_zip(files, DOWNLOAD_CHUNK_SIZE),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(filename)},
+    )
+
+
+@app.get("/tasks/{job_id}/download")
+def download_task(job_id: str) -> StreamingResponse:
+    """
+    download every generated file of a task as one zip.
+    """
+    job = store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    results = job_results(job)
+    if not results:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} has no results")
+    return zip_response(
+        [(path.name, path) for path in results], f"{Path(job.filename).stem}.zip"
+    )
+
+
+@app.get("/tasks/{job_id}/download/{lang}")
+def download_task_language(job_id: str, lang: str) -> FileResponse:
+    """
+    download the generated file of one language of a task (its code or full
+    name). Supports Range requests to resume, ETag and If-None-Match.
+    """
+    job = store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    code = Language.from_fullname(lang)
+    generated_file = result_file(job_id, Path(job.file_path), code)
+    if code not in job.languages or generated_file not in job_results(job):
+        raise HTTPException(
+            status_code=404, detail=f"Job {job_id} has no result for {lang}"
+        )
+    # FileResponse hands the file to the server (pathsend) where it can
+    return FileResponse(
+        generated_file, media_type=IDML_MEDIA_TYPE, filename=generated_file.name
+    )
+
+
+@app.get("/batches/{batch_id}/download")
+def download_batch(batch_id: str) -> StreamingResponse:
+    """
+    download every generated file of a batch as one zip. Files of two jobs
+    with the same name go into a folder named after their job.
+    """
+    if store.get_batch(batch_id) is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    files = []
+    names = set()
+    for job in store.batch_jobs(batch_id):
+        for path in job_results(job):
+            name = path.name if path.name not in names else f"{job.job_id}/{path.name}"
+            names.add(name)
+            files.append((name, path))
+    if not files:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} has no results")
+    return zip_response(files, f"batch-{batch_id}.zip")
+
+
+@app.get("/tasks/{job_id}/trace")
+def get_task_trace(job_id: str) -> dict:
+    """
+    the timing spans of a job (queued, run, cache_lookup, translate and
+    verify per language, email) and the total time per span name. Spans
+    are kept in memory for recent jobs only.
+    """
+    job_info = store.get(job_id)
+    if job_info is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    spans = tracer.spans(job_id)
+    totals: dict[str, float] = {}
+    for span in spans:
+        if span.duration is not None:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+    return {
+        "job_id": job_id,
+        "status": job_info.status,
+        "spans": [span.to_dict() for span in spans],
+        "totals": totals,
+    }
+
+
+def encode_cursor(job_info: JobInfo, sort: str) -> str:
+    value = json.dumps([getattr(job_info, sort), job_info.job_id])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        decoded = None
+    # [sort value, job id], as encode_cursor() writes it
+    if (
+        not isinstance(decoded, list)
+        or len(decoded) != 2
+        or isinstance(decoded[0], bool)
+        or not isinstance(decoded[0], (int, float, str))
+        or not isinstance(decoded[1], str)
+    ):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+    value, job_id = decoded
+    return value, job_id
+
+
+@app.get("/tasks/", response_model=None)
+async def list_jobs(
+    request: Request,
+    response: Response,
+    status: JobStatus | None = None,
+    email: str | None = None,
+    language: str | None = None,
+    submitted_after: float | None = None,
+    submitted_before: float | None = None,
+    sort: Literal["submitted_at", "file_size", "filename"] = "submitted_at",
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    since: int | None = None,
+) -> dict | Response:
+    """
+    list jobs, newest first by default, filtered by status, email, language
+    and submit time. Pass next_cursor back as cursor for the next page.
+    With since (an event_id of a previous response), only the jobs that
+    changed after it are returned, in the order they changed; pass event_id
+    back as since for the next poll. The ETag changes with every job event,
+    so a client sending If-None-Match gets 304 when nothing changed.
+    """
+    event_id = await run_io(store.last_event_id)
+    etag = f'W/"{event_id}-{hashlib.sha1(str(request.query_params).encode()).hexdigest()[:16]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    job_filter = JobFilter(
+        status=status,
+        email=email,
+        language=Language.from_fullname(language) if language else None,
+        submitted_after=submitted_after,
+        submitted_before=submitted_before,
+    )
+    next_cursor = None
+    if since is not None:
+        jobs, event_id = await run_io(store.changed_since, since, job_filter, limit)
+    else:
+        jobs = await run_io(
+            store.list_jobs,
+            job_filter,
+            sort=sort,
+            descending=order == "desc",
+            limit=limit,
+            after=decode_cursor(cursor) if cursor else None,
+        )
+        if len(jobs) == limit:
+            next_cursor = encode_cursor(jobs[-1], sort)
+
+    response.headers["ETag"] = etag
+    return {
+        "jobs": [job_to_dict(job_info) for job_info in jobs],
+        "next_cursor": next_cursor,
+        "event_id": event_id,
+    }
+
+
+@app.get("/cache")
+def get_cache_stats() -> dict:
+    """
+    size and hit/miss counters of the result cache.
+    """
+    return {"translator_version": translator_version(), **result_cache.stats()}
+
+
+@app.delete("/cache")
+def invalidate_cache(all: bool = False) -> dict:
+    """
+    detect the asrtranslate version again (call this after upgrading it) and
+    remove the cached results of other versions, or every result with all=true.
+    """
+    translator_version.cache_clear()
+    version = translator_version()
+    removed = result_cache.clear(keep_version=None if all else version)
+    return {"translator_version": version, "removed": removed}
+
+
+@app.get("/memory")
+def get_memory_stats() -> dict:
+    """
+    size and hit/miss counters of the translation memory.
+    """
+    if translation_memory is None:
+        raise HTTPException(status_code=404, detail="The translation memory is disabled")
+    return {"translator_version": translator_version(), **translation_memory.stats()}
+
+
+@app.delete("/memory")
+def clear_memory(all: bool = False) -> dict:
+    """
+    detect the asrtranslate version again and remove the segments translated
+    by other versions, or every segment with all=true.
+    """
+    if translation_memory is None:
+        raise HTTPException(status_code=404, detail="The translation memory is disabled")
+    translator_version.cache_clear()
+    version = translator_version()
+    removed = translation_memory.clear(keep_version=None if all else version)
+    return {"translator_version": version, "removed": removed}
+
+
+@app.get("/notifications")
+def get_notification_stats() -> dict:
+    """
+    email delivery counters of the notifier.
+    """
+    return notifier.stats()
+
+
+@app.get("/retention")
+def get_retention_stats() -> dict:
+    """
+    what the retention engine removed so far.
+    """
+    return retention.stats()
+
+
+@app.post("/retention")
+def run_retention() -> dict:
+    """
+    apply the retention policy now instead of waiting for the next cycle.
+    """
+    return retention.run_cycle()
+
+
+@app.get("/workers")
+def get_worker_pool_stats() -> dict:
+    """
+    state of the warm asrtranslate worker pool.
+    """
+    if worker_pool is None:
+        return {"size": 0}
+    return worker_pool.stats()
+
+
+@app.get("/resources")
+def get_resource_stats() -> dict:
+    """
+    the limits asrtranslate runs in, the scheduler's memory budget and the
+    learned peak memory per language.
+    """
+    return {
+        "limits": asdict(limiter.limits),
+        "cgroups": str(cgroups.directory) if cgroups.enabled else None,
+        "oom_kills": limiter.oom_kills,
+        "memory_budget_mb": scheduler.memory_budget_mb,
+        "reserved_memory_mb": round(scheduler.reserved_memory_mb(), 1),
+        "backfilled": scheduler.backfilled,
+        "languages": resource_model.stats(list(Language)),
+        "runtimes": runtime_model.stats(list(Language)),
+    }
+
+
+def leased_item(item_id: str, worker: str) -> WorkItem:
+    """
+    the work item worker holds the lease of, 409 if it doesn't (any more).
+    """
+    if work_queue is None:
+        raise HTTPException(status_code=404, detail="Remote workers are disabled")
+    item = work_queue.get(item_id)
+    if item is None or not work_queue.holds(item_id, worker):
+        raise HTTPException(status_code=409, detail=f"{worker} doesn't hold {item_id}")
+    return item
+
+
+def write_remote_output(item_id: str, lines: str) -> None:
+    """
+    lines of a worker's asrtranslate output ([stream, line] pairs as JSON)
+    into the log of the run.
+    """
+    try:
+        pairs = json.loads(lines)
+    except json.JSONDecodeError:
+        pairs = None
+    if not isinstance(pairs, list) or not all(
+        isinstance(pair, list) and len(pair) == 2 and all(isinstance(part, str) for part in pair)
+        for pair in pairs
+    ):
+        raise HTTPException(
+            status_code=400, detail="lines must be a JSON list of [stream, line] pairs"
+        )
+    output = remote_outputs.get(item_id)
+    if output is None:
+        return
+    for stream, line in pairs:
+        output.line(stream, line)
+
+
+@app.get("/work")
+def get_work_queue_stats() -> dict:
+    """
+    items of the work queue per state, and the remote workers that asked
+    for work recently.
+    """
+    if work_queue is None:
+        return {"enabled": False}
+    return {"enabled": True, **work_queue.stats(active_within=2 * WORK_LEASE_SECONDS)}
+
+
+@app.post("/work/lease", response_model=None)
+def lease_work(worker: str = Form(...)) -> dict | Response:
+    """
+    lease the next asrtranslate run to a remote worker, 204 if there is none.
+    The worker has to renew the lease with a heartbeat before lease_seconds
+    pass, or the run is delivered to another worker.
+    """
+    if work_queue is None:
+        raise HTTPException(status_code=404, detail="Remote workers are disabled")
+    item = work_queue.lease(worker)
+    if item is None:
+        return Response(status_code=204)
+    logger.info(
+        f"Work item {item.item_id} ({item.lang}) leased to {worker}, delivery {item.attempts}",
+        extra={"job_id": item.job_id},
+    )
+    return {
+        "item_id": item.item_id,
+        "job_id": item.job_id,
+        "lang": item.lang,
+        "filename": Path(item.source).name,
+        "attempt": item.attempts,
+        "lease_seconds": WORK_LEASE_SECONDS,
+    }
+
+
+@app.get("/work/{item_id}/input")
+def get_work_input(item_id: str, worker: str) -> FileResponse:
+    """
+    the document of a leased item.
+    """
+    item = leased_item(item_id, worker)
+    if not Path(item.source).is_file():
+        raise HTTPException(status_code=404, detail=f"{Path(item.source).name} is gone")
+    return FileResponse(item.source, filename=Path(item.source).name)
+
+
+@app.post("/work/{item_id}/heartbeat")
+def renew_work_lease(item_id: str, worker: str = Form(...), lines: str = Form("[]")) -> dict:
+    """
+    renew the lease of an item and pass on the output asrtranslate wrote
+    since the last heartbeat. 409 tells the worker to stop: the item was
+    cancelled or delivered to another worker.
+    """
+    leased_item(item_id, worker)
+    if not work_queue.heartbeat(item_id, worker):
+        raise HTTPException(status_code=409, detail=f"{worker} doesn't hold {item_id}")
+    write_remote_output(item_id, lines)
+    return {"lease_seconds": WORK_LEASE_SECONDS}
+
+
+@app.post("/work/{item_id}/complete")
+def complete_work(
+    item_id: str,
+    worker: str = Form(...),
+    return_code: int = Form(...),
+    lines: str = Form("[]"),
+    cpu_seconds: float | None = Form(None),
+    max_rss_kb: int | None = Form(None),
+    file: UploadFile | None = File(None),
+) -> dict:
+    """
+    the outcome of a leased item: asrtranslate's return code, the rest of
+    its output and the translated document, if it generated one.
+    """
+    item = leased_item(item_id, worker)
+    write_remote_output(item_id, lines)
+    destination = Path(item.output)
+    temp_path = None
+    try:
+        if file is not None:
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=destination.parent, prefix=".work-")
+            with os.fdopen(fd, "wb") as buffer:
+                shutil.copyfileobj(file.file, buffer, UPLOAD_CHUNK_SIZE)
+        # the lease is checked again by complete(): a worker that lost the item
+        # meanwhile must not replace the document of the one holding it now.
+        # The waiting job sees the item done only once the document is in place.
+        with remote_completion_lock:
+            if not work_queue.complete(item_id, worker, return_code):
+                raise HTTPException(status_code=409, detail=f"{worker} doesn't hold {item_id}")
+            if temp_path is not None:
+                os.replace(temp_path, destination)
+                temp_path = None
+            if cpu_seconds is not None:
+                # on the run's span, for the run history like a local run
+                record_rusage(item.lang, cpu_seconds, max_rss_kb, remote_spans.get(item_id))
+    finally:
+        if temp_path is not None:
+            with suppress(FileNotFoundError):
+                os.unlink(temp_path)
+    logger.info(
+        f"Work item {item_id} ({item.lang}) completed by {worker} with return code {return_code}",
+        extra={"job_id": item.job_id},
+    )
+    return {"item_id": item_id, "state": WorkState.DONE}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics() -> str:
+    """
+    queue, latency, resource and cache metrics in the Prometheus text format.
+    """
+    return registry.render()
+
+
+@app.get("/list_files")
+async def list_uploaded_files(
+    kind: Literal["uploads", "results"] = "uploads",
+    sort: Literal["mtime", "size", "name"] = "mtime",
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+) -> dict:
+    """
+    list uploaded (or, with kind=results, generated) files from the file
+    index, newest first by default. Each job keeps its files in <dir>/<job_id>/.
+    The listing runs on the I/O executor: after a change the index sorts
+    all of its files again.
+    """
+    index = upload_index if kind == "uploads" else result_index
+    total, files = await run_io(
+        index.list_files, sort=sort, descending=order == "desc", limit=limit, offset=offset
+    )
+    return {
+        "total": total,
+        "files": [
+            {
+                "filename": file.name,
+                "job_id": file.job_id,
+                "file_size": file.size,
+                "modified_time": file.mtime,
+            }
+            for file in files
+        ],
+    }
@@ -0,0 +1,229 @@
+import math
+import threading
+from typing import Callable
+
+# seconds, for short operations (writing an upload, sending an email)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# seconds, for queue waits and asrtranslate runs
+RUNTIME_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 21600)
+# bytes, for the peak memory of asrtranslate
+MEMORY_BUCKETS = tuple(2**20 * mb for mb in (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+
+
+def format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    a named metric in the Prometheus text format, optionally split by labels.
+    """
+
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} needs the labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """
+        (name, labels, value) of every sample.
+        """
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """
+    a value that only goes up. With fn, the value is read from fn when
+    the metrics are collected instead of being counted with inc().
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        fn: Callable[[], float] | None = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        if self.fn is not None:
+            return [(self.name, {}, self.fn())]
+        with self._lock:
+            values = dict(self._values)
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value)
+            for key, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    """
+    a value that goes up and down.
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """
+    observations counted in cumulative buckets, with their sum and count.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (count per bucket, sum)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative)
+                )
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+# metrics recorded by the modules of the task pipeline
+QUEUE_WAIT_SECONDS = registry.register(
+    Histogram(
+        "task_queue_wait_seconds",
+        "Time jobs spent in the scheduler queue before a worker started them.",
+        buckets=RUNTIME_BUCKETS,
+    )
+)
+UPLOAD_WRITE_SECONDS = registry.register(
+    Histogram("task_upload_write_seconds", "Time spent writing an upload to disk.")
+)
+UPLOAD_BYTES = registry.register(
+    Counter("task_upload_bytes_total", "Bytes of uploads written to disk.")
+)
+TRANSLATE_SECONDS = registry.register(
+    Histogram(
+        "task_translate_seconds",
+        "Wall-clock runtime of asrtranslate per language.",
+        ("language", "outcome"),
+        buckets=RUNTIME_BUCKETS,
+    )
+)
+TRANSLATE_CPU_SECONDS = registry.register(
+    Histogram(
+        "task_translate_cpu_seconds",
+        "User plus system CPU time of asrtranslate per language.",
+        ("language",),
+        buckets=RUNTIME_BUCKETS,
+    )
+)
+TRANSLATE_PEAK_RSS_BYTES = registry.register(
+    Histogram(
+        "task_translate_peak_rss_bytes",
+        "Peak resident memory of asrtranslate per language.",
+        ("language",),
+        buckets=MEMORY_BUCKETS,
+    )
+)
+EMAIL_SEND_SECONDS = registry.register(
+    Histogram(
+        "task_email_send_seconds",
+        "Time spent sending one email, connecting included.",
+        ("outcome",),
+    )
+)
+JOBS_FINISHED = registry.register(
+    Counter("task_jobs_finished_total", "Jobs finished, by final status.", ("status",))
+)
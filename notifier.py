@@ -0,0 +1,285 @@
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from metrics import EMAIL_SEND_SECONDS
+from smtp_email import EmailSender
+from tracing import Tracer, job_context
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Notification:
+    recipients: list[str]
+    subject: str
+    message: str
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    error: str | None = None
+    job_id: str | None = None  # the job the email is about
+
+
+class EmailNotifier:
+    """
+    deliver emails from a background thread so the caller never waits on SMTP.
+
+    One authenticated SMTP connection is kept open and reused for every
+    batch; it is checked with NOOP before reuse, reopened when it dropped
+    and closed after idle_timeout seconds without mail. A failed email is
+    retried with exponential backoff and appended to dead_letter_path
+    (one JSON object per line) after max_attempts. Emails still waiting
+    for a retry, or queued too late, when the notifier stops are appended
+    there too, so they can be sent again by hand.
+    """
+
+    def __init__(
+        self,
+        config_path: Path,
+        dead_letter_path: Path,
+        max_attempts: int = 5,
+        backoff: float = 30.0,
+        batch_size: int = 20,
+        idle_timeout: float = 60.0,
+        tracer: Tracer | None = None,
+    ) -> None:
+        self.config_path = config_path
+        self.dead_letter_path = dead_letter_path
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.tracer = tracer
+
+        self.sent = 0
+        self.failed = 0
+        self.dead_lettered = 0
+
+        self._queue: queue.Queue[Notification | None] = queue.Queue()
+        self._retries: list[tuple[float, int, Notification]] = []  # heap
+        self._seq = itertools.count()
+        self._sender = EmailSender()
+        self._config: dict | None = None
+        self._config_mtime: float | None = None
+        self._last_used = 0.0
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="email-notifier", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        send what is queued (without waiting for retries) and stop; the
+        emails not sent are dead lettered by the notifier's thread.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Email notifier did not stop in time, queued emails may be lost")
+        self._thread = None
+
+    def enqueue(
+        self,
+        recipients: list[str],
+        subject: str,
+        message: str,
+        job_id: str | None = None,
+    ) -> None:
+        self._queue.put(Notification(recipients, subject, message, job_id=job_id))
+
+    def queue_length(self) -> int:
+        return self._queue.qsize() + len(self._retries)
+
+    def _load_config(self) -> dict | None:
+        """
+        the mail config, read again only when the file changed.
+        """
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            mtime = None
+        if self._config is None or mtime != self._config_mtime:
+            self._config = self._sender.load_config(config_path=str(self.config_path))
+            self._config_mtime = mtime
+            self._sender.close()
+            if self._config:
+                self._sender.smtp_server = self._config.get(
+                    "smtp_server", self._sender.smtp_server
+                )
+                self._sender.smtp_port = self._config.get(
+                    "smtp_port", self._sender.smtp_port
+                )
+        return self._config
+
+    def _next_batch(self) -> tuple[list[Notification], bool]:
+        """
+        wait for mail and return up to batch_size due notifications, and
+        whether stop() was called.
+        """
+        batch: list[Notification] = []
+        stopping = False
+        while self._retries and self._retries[0][0] <= time.time():
+            batch.append(heapq.heappop(self._retries)[2])
+
+        timeout = self.idle_timeout
+        if self._retries:
+            timeout = min(timeout, max(0.0, self._retries[0][0] - time.time()))
+        try:
+            if batch:
+                item = self._queue.get_nowait()
+            else:
+                item = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return batch, stopping
+        while True:
+            if item is None:
+                stopping = True
+            else:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return batch, stopping
+
+    def _run(self) -> None:
+        while True:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._send_batch(batch)
+            elif time.time() - self._last_used > self.idle_timeout:
+                self._sender.close()
+            if stopping:
+                self._sender.close()
+                self._dead_letter_pending()
+                return
+
+    def _send_batch(self, batch: list[Notification]) -> None:
+        config = self._load_config()
+        checked = False  # the connection is checked once per batch
+        for notification in batch:
+            with job_context(notification.job_id):
+                checked = self._send(notification, config, checked)
+
+    def _send(self, notification: Notification, config: dict | None, checked: bool) -> bool:
+        """
+        send one email, return whether the connection is known to work.
+        """
+        span = None
+        if self.tracer is not None and notification.job_id is not None:
+            span = self.tracer.begin(
+                notification.job_id, "email", attempt=notification.attempts + 1
+            )
+        started = time.time()
+        try:
+            if not config:
+                raise Exception(f"No mail configuration in {self.config_path}")
+            if not checked and not self._sender.is_connected():
+                self._sender.connect(
+                    config.get("sender", ""),
+                    config.get("password"),
+                    config.get("domain"),
+                    config.get("use_ntlm", False),
+                )
+            message = notification.message
+            if config.get("include_timestamp", False):
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                message += f"\n\nTime: {timestamp}"
+            msg = self._sender.build_message(
+                config.get("sender", ""),
+                notification.recipients,
+                notification.subject,
+                message,
+            )
+            self._sender.send_message(msg)
+        except Exception as e:
+            EMAIL_SEND_SECONDS.observe(time.time() - started, outcome="failed")
+            if span is not None:
+                self.tracer.end(notification.job_id, span, error=str(e))
+            # the connection may be broken, open a new one next time
+            self._sender.close()
+            self._retry(notification, str(e))
+            return False
+        self._last_used = time.time()
+        EMAIL_SEND_SECONDS.observe(self._last_used - started, outcome="sent")
+        if span is not None:
+            self.tracer.end(notification.job_id, span)
+        self.sent += 1
+        logger.info(f"Email notification sent to {', '.join(notification.recipients)}")
+        return True
+
+    def _retry(self, notification: Notification, error: str) -> None:
+        self.failed += 1
+        notification.attempts += 1
+        notification.error = error
+        if notification.attempts >= self.max_attempts:
+            self._dead_letter(notification)
+            return
+        delay = self.backoff * 2 ** (notification.attempts - 1)
+        logger.warning(
+            f"Failed to send email notification to {', '.join(notification.recipients)}: {error}, retry in {delay:.0f}s"
+        )
+        heapq.heappush(
+            self._retries, (time.time() + delay, next(self._seq), notification)
+        )
+
+    def _dead_letter(self, notification: Notification) -> None:
+        logger.error(
+            f"Giving up on email notification to {', '.join(notification.recipients)}: {notification.error}"
+        )
+        self._write_dead_letters([notification])
+
+    def _dead_letter_pending(self) -> None:
+        """
+        dead letter the emails waiting for a retry and those queued after
+        stop(), which would be lost with the process.
+        """
+        pending = [notification for _, _, notification in self._retries]
+        self._retries.clear()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                pending.append(item)
+        if not pending:
+            return
+        for notification in pending:
+            notification.error = notification.error or "not sent before the notifier stopped"
+        logger.warning(f"Notifier stopped, {len(pending)} unsent emails dead lettered")
+        self._write_dead_letters(pending)
+
+    def _write_dead_letters(self, notifications: list[Notification]) -> None:
+        self.dead_lettered += len(notifications)
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for notification in notifications:
+                    f.write(json.dumps(asdict(notification), ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write dead letter: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue_length(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+        }
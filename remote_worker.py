@@ -0,0 +1,410 @@
+"""
+translation worker for another machine (or another process on the task
+manager's host), started from a checkout of the task manager:
+
+    python remote_worker.py --server http://10.194.47.212:3030 --slots 2
+
+It leases asrtranslate runs from the task manager's work queue
+(TASK_REMOTE_WORKERS=1 on the server), downloads their document, runs
+asrtranslate of the local ASRtranslate checkout and uploads the result.
+The lease is renewed with a heartbeat every third of it, carrying the
+output of asrtranslate; when the server refuses a renewal the run was
+cancelled or delivered to another worker and asrtranslate is stopped. A
+worker that dies stops renewing, the server delivers its runs again.
+
+SIGINT or SIGTERM stops taking new runs and exits once the running ones
+are done, a second one exits at once.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+import requests
+
+from job_logs import OutputReader
+from resources import Cgroups, ProcessLimiter, ResourceLimits
+from tracing import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# seconds between lease requests while there is no work
+IDLE_INTERVAL = 2.0
+# seconds between SIGTERM and SIGKILL when stopping asrtranslate
+KILL_GRACE_SECONDS = 10
+# seconds to wait for the rest of asrtranslate's output after it exited
+OUTPUT_DRAIN_SECONDS = 5
+REQUEST_TIMEOUT = 30
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def stop_process_group(p: subprocess.Popen) -> None:
+    """
+    terminate asrtranslate and everything it started, kill it if it doesn't stop.
+    """
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+        p.wait(timeout=KILL_GRACE_SECONDS)
+        return
+    except ProcessLookupError:
+        return
+    except subprocess.TimeoutExpired:
+        logger.warning(f"pid: {p.pid} did not stop, killing it")
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    p.wait()
+
+
+class RemoteWorker:
+    """
+    slots threads, each running one leased item at a time.
+    """
+
+    def __init__(
+        self,
+        server: str,
+        name: str,
+        asrtranslate_dir: Path,
+        work_dir: Path,
+        slots: int,
+        limiter: ProcessLimiter | None = None,
+    ) -> None:
+        self.server = server.rstrip("/")
+        self.name = name
+        self.asrtranslate_dir = asrtranslate_dir
+        self.work_dir = work_dir
+        self.slots = max(1, slots)
+        self.limiter = limiter
+        self.stopped = threading.Event()
+        self._processes: set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
+
+    def _url(self, path: str) -> str:
+        return f"{self.server}{path}"
+
+    def lease(self) -> dict | None:
+        response = requests.post(
+            self._url("/work/lease"), data={"worker": self.name}, timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        if response.status_code == 204:
+            return None
+        return response.json()
+
+    def download(self, item: dict, destination: Path) -> None:
+        with requests.get(
+            self._url(f"/work/{item['item_id']}/input"),
+            params={"worker": self.name},
+            stream=True,
+            timeout=REQUEST_TIMEOUT,
+        ) as response:
+            if response.status_code == 409:
+                raise LeaseLost(response.json()["detail"])
+            response.raise_for_status()
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            with open(destination, "wb") as f:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+
+    def heartbeat(self, item: dict, lines: list[tuple[str, str]]) -> bool | None:
+        """
+        renew the lease of item and send the output lines, False if the
+        lease is lost, None if the server can't be reached.
+        """
+        try:
+            response = requests.post(
+                self._url(f"/work/{item['item_id']}/heartbeat"),
+                data={"worker": self.name, "lines": json.dumps(lines)},
+                timeout=REQUEST_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            logger.warning(f"Heartbeat of {item['item_id']} failed: {e}")
+            return None
+        if response.status_code == 409:
+            return False
+        response.raise_for_status()
+        return True
+
+    def complete(
+        self,
+        item: dict,
+        return_code: int,
+        lines: list[tuple[str, str]],
+        rusage,
+        result: Path,
+    ) -> None:
+        data = {
+            "worker": self.name,
+            "return_code": return_code,
+            "lines": json.dumps(lines),
+            "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+            "max_rss_kb": rusage.ru_maxrss,
+        }
+        # the server may be restarting, the lease outlives a short outage
+        deadline = time.time() + item["lease_seconds"]
+        while True:
+            try:
+                if result.exists():
+                    with open(result, "rb") as f:
+                        response = requests.post(
+                            self._url(f"/work/{item['item_id']}/complete"),
+                            data=data,
+                            files={"file": (result.name, f)},
+                            timeout=REQUEST_TIMEOUT,
+                        )
+                else:
+                    response = requests.post(
+                        self._url(f"/work/{item['item_id']}/complete"),
+                        data=data,
+                        timeout=REQUEST_TIMEOUT,
+                    )
+            except requests.RequestException as e:
+                if time.time() > deadline:
+                    raise
+                logger.warning(f"Can't complete {item['item_id']}, retrying: {e}")
+                time.sleep(IDLE_INTERVAL)
+                continue
+            if response.status_code == 409:
+                raise LeaseLost(response.json()["detail"])
+            response.raise_for_status()
+            return
+
+    def wait(
+        self,
+        p: subprocess.Popen,
+        item: dict,
+        lines: list[tuple[str, str]],
+        lines_lock: threading.Lock,
+    ):
+        """
+        wait for asrtranslate to exit, renewing the lease (and sending its
+        output) every third of the lease, and return its resource usage.
+        Stops asrtranslate and raises LeaseLost when the lease is lost.
+        """
+        heartbeat_interval = item["lease_seconds"] / 3
+        next_heartbeat = time.time() + heartbeat_interval
+        while True:
+            # wait4 reaps the process and reports its resource usage
+            pid, wait_status, rusage = os.wait4(p.pid, os.WNOHANG)
+            if pid:
+                p.returncode = os.waitstatus_to_exitcode(wait_status)
+                return rusage
+            if time.time() >= next_heartbeat:
+                with lines_lock:
+                    pending = list(lines)
+                renewed = self.heartbeat(item, pending)
+                if renewed is False:
+                    stop_process_group(p)
+                    raise LeaseLost(f"Lost the lease of {item['item_id']}, stopped pid {p.pid}")
+                if renewed:
+                    # lines that couldn't be sent go with the next heartbeat
+                    with lines_lock:
+                        del lines[: len(pending)]
+                next_heartbeat = time.time() + heartbeat_interval
+            time.sleep(0.5)
+
+    def kill(self) -> None:
+        """
+        stop every running asrtranslate, their leases run out.
+        """
+        with self._lock:
+            processes = list(self._processes)
+        for p in processes:
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def run_item(self, item: dict, item_dir: Path) -> None:
+        """
+        download, translate and upload one leased item.
+        """
+        source = item_dir / "input" / item["filename"]
+        output_dir = item_dir / "output"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self.download(item, source)
+
+        cmd = [
+            self.asrtranslate_dir / ".venv/bin/python",
+            "-m",
+            "asrtranslate",
+            f"{source}",
+            "-o",
+            f"{output_dir}",
+            "-l",
+            item["lang"],
+        ]
+        lines: list[tuple[str, str]] = []
+        lines_lock = threading.Lock()
+        # heartbeats take the lines they sent, the last errors stay here
+        stderr_tail: deque[str] = deque(maxlen=5)
+
+        def on_line(stream: str, line: str) -> None:
+            if line.strip():
+                with lines_lock:
+                    lines.append((stream, line))
+                    if stream == "stderr":
+                        stderr_tail.append(line)
+
+        # a new session makes asrtranslate the leader of its own process group
+        p = subprocess.Popen(
+            cmd,
+            cwd=self.asrtranslate_dir,
+            start_new_session=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            preexec_fn=self.limiter.preexec() if self.limiter else None,
+        )
+        envelope = self.limiter.apply(p.pid, f"asrtranslate-{p.pid}") if self.limiter else None
+        with self._lock:
+            self._processes.add(p)
+        reader = OutputReader(
+            [("stdout", p.stdout), ("stderr", p.stderr)],
+            on_line,
+            lambda: None,
+            f"output-{p.pid}",
+        )
+        logger.info(f"pid: {p.pid} runs {item['item_id']} ({item['lang']})")
+
+        try:
+            rusage = self.wait(p, item, lines, lines_lock)
+        finally:
+            with self._lock:
+                self._processes.discard(p)
+            if envelope is not None:
+                self.limiter.release(envelope)
+
+        reader.join(OUTPUT_DRAIN_SECONDS)
+        with lines_lock:
+            if envelope is not None and self.limiter.out_of_memory(
+                envelope, p.returncode, stderr_tail
+            ):
+                lines.append(("stderr", "asrtranslate went over its memory limit and was killed"))
+            pending = list(lines)
+        result = output_dir / f"{source.stem}-{item['lang']}.idml"
+        self.complete(item, p.returncode, pending, rusage, result)
+        logger.info(
+            f"Completed {item['item_id']} ({item['lang']}) with return code {p.returncode}"
+        )
+
+    def slot(self, number: int) -> None:
+        while not self.stopped.is_set():
+            try:
+                item = self.lease()
+            except requests.RequestException as e:
+                logger.warning(f"Can't lease work from {self.server}: {e}")
+                item = None
+            if item is None:
+                self.stopped.wait(IDLE_INTERVAL)
+                continue
+            logger.info(
+                f"Leased {item['item_id']}: {item['filename']} ({item['lang']}), delivery {item['attempt']}"
+            )
+            item_dir = self.work_dir / item["item_id"]
+            try:
+                self.run_item(item, item_dir)
+            except LeaseLost as e:
+                logger.warning(str(e))
+            except Exception as e:
+                # the lease runs out and the item is delivered again
+                logger.error(f"Failed to run {item['item_id']}: {e}")
+            finally:
+                shutil.rmtree(item_dir, ignore_errors=True)
+
+    def run(self) -> None:
+        threads = [
+            threading.Thread(
+                target=self.slot, args=(number,), name=f"slot-{number}", daemon=True
+            )
+            for number in range(self.slots)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", required=True, help="URL of the task manager")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--slots", type=int, default=1, help="runs at the same time")
+    parser.add_argument(
+        "--asrtranslate-dir", type=Path, default=Path("/home/sw/GitHub/ASRtranslate")
+    )
+    parser.add_argument("--work-dir", type=Path, help="for downloads and results")
+    parser.add_argument(
+        "--max-memory-mb", type=int, default=0, help="memory limit of one asrtranslate with --cgroups, 0 for none"
+    )
+    parser.add_argument(
+        "--cgroups",
+        action="store_true",
+        help="limit asrtranslate in cgroups under this process's own (moves it into <cgroup>/server)",
+    )
+    parser.add_argument(
+        "--max-address-space-mb",
+        type=int,
+        default=0,
+        help="address space limit of one asrtranslate without cgroup v2, 0 for none",
+    )
+    parser.add_argument("--nice", type=int, default=10, help="nice value of asrtranslate")
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    log_listener = setup_logging(args.log_level)
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="remote-worker-"))
+    cgroups = Cgroups()
+    if args.cgroups:
+        cgroups.setup()
+    limiter = ProcessLimiter(
+        ResourceLimits(
+            memory_mb=args.max_memory_mb,
+            address_space_mb=args.max_address_space_mb,
+            nice=args.nice,
+            io_class="best-effort",
+            io_level=7,
+            oom_score_adj=1000,
+        ),
+        cgroups,
+    )
+    worker = RemoteWorker(
+        args.server, args.name, args.asrtranslate_dir, work_dir, args.slots, limiter
+    )
+
+    def stop(signum, frame) -> None:
+        if worker.stopped.is_set():
+            raise KeyboardInterrupt
+        logger.info("Stopping once the running items are done")
+        worker.stopped.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f"Worker {args.name}: {args.slots} slots, asking {args.server} for work")
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.kill()
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    main()
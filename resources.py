@@ -0,0 +1,342 @@
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CGROUP_MOUNT = Path("/sys/fs/cgroup")
+# cpu.max period in microseconds
+CPU_PERIOD = 100_000
+IO_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+# stderr of a process whose allocation failed under the address space rlimit
+OUT_OF_MEMORY_MARKERS = ("MemoryError", "Cannot allocate memory", "std::bad_alloc")
+
+
+@dataclass
+class ResourceLimits:
+    memory_mb: int = 0  # memory.max of the process's cgroup, 0 for none
+    # address space rlimit, only where there are no cgroups; 0 for none
+    address_space_mb: int = 0
+    cpus: float = 0  # cpu.max quota in CPUs, 0 for none
+    pinned_cpus: int = 0  # CPUs a process is pinned to, 0 doesn't pin
+    nice: int = 0
+    io_class: str | None = None  # "realtime", "best-effort" or "idle"
+    io_level: int = 4  # 0 (highest) to 7, for realtime and best-effort
+    oom_score_adj: int = 0  # 1000: the first process the OOM killer picks
+
+
+def own_cgroup() -> Path | None:
+    """
+    the cgroup v2 directory this process is in, None without cgroup v2.
+    """
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    path = CGROUP_MOUNT / line[3:].strip().lstrip("/")
+                    if (path / "cgroup.controllers").exists():
+                        return path
+    except OSError:
+        pass
+    return None
+
+
+class Cgroups:
+    """
+    a cgroup v2 per process under directory (by default the cgroup this
+    server runs in, which has to be delegated to it, e.g. systemd's
+    Delegate=yes). The server moves itself into directory/server first:
+    a cgroup with processes can't hand controllers to its children.
+    """
+
+    def __init__(self, directory: Path | None = None) -> None:
+        self.directory = directory
+        self.enabled = False
+
+    def setup(self) -> bool:
+        directory = self.directory or own_cgroup()
+        if directory is None:
+            logger.info("No cgroup v2, asrtranslate is limited with rlimits")
+            return False
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            server = directory / "server"
+            server.mkdir(exist_ok=True)
+            if os.getpid() in self._pids(directory):
+                (server / "cgroup.procs").write_text(str(os.getpid()))
+            controllers = (directory / "cgroup.controllers").read_text().split()
+            wanted = [c for c in ("memory", "cpu") if c in controllers]
+            (directory / "cgroup.subtree_control").write_text(
+                " ".join(f"+{c}" for c in wanted)
+            )
+        except OSError as e:
+            logger.info(f"Can't use the cgroup {directory} ({e}), asrtranslate is limited with rlimits")
+            return False
+        self.directory = directory
+        self.enabled = True
+        logger.info(f"asrtranslate processes run in cgroups under {directory}")
+        return True
+
+    @staticmethod
+    def _pids(cgroup: Path) -> list[int]:
+        return [int(pid) for pid in (cgroup / "cgroup.procs").read_text().split()]
+
+    def add(self, pid: int, name: str, limits: ResourceLimits) -> Path | None:
+        """
+        a new cgroup with limits holding pid, None if it couldn't be made.
+        """
+        cgroup = self.directory / name
+        try:
+            cgroup.mkdir()
+            if limits.memory_mb:
+                (cgroup / "memory.max").write_text(str(limits.memory_mb * 2**20))
+                # swapping instead of being stopped would only slow the machine down
+                if (cgroup / "memory.swap.max").exists():
+                    (cgroup / "memory.swap.max").write_text("0")
+            if limits.cpus:
+                (cgroup / "cpu.max").write_text(f"{int(limits.cpus * CPU_PERIOD)} {CPU_PERIOD}")
+            (cgroup / "cgroup.procs").write_text(str(pid))
+        except OSError as e:
+            logger.warning(f"Can't put pid {pid} in the cgroup {cgroup}: {e}")
+            self.remove(cgroup)
+            return None
+        return cgroup
+
+    @staticmethod
+    def oom_kills(cgroup: Path) -> int:
+        try:
+            for line in (cgroup / "memory.events").read_text().splitlines():
+                key, value = line.split()
+                if key == "oom_kill":
+                    return int(value)
+        except (OSError, ValueError):
+            pass
+        return 0
+
+    @staticmethod
+    def peak_kb(cgroup: Path) -> int | None:
+        """
+        peak memory of the cgroup (kernel 5.19+), None if unknown.
+        """
+        try:
+            return int((cgroup / "memory.peak").read_text()) // 1024
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def remove(cgroup: Path) -> None:
+        # processes left behind are gone a moment after they were killed
+        for _ in range(10):
+            try:
+                cgroup.rmdir()
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.1)
+        logger.warning(f"Can't remove the cgroup {cgroup}")
+
+
+class CpuSets:
+    """
+    hand out disjoint sets of CPUs, so processes running at the same time
+    don't share (and thrash) the same cores and caches.
+    """
+
+    def __init__(self, cpus: set[int] | None = None) -> None:
+        self._lock = threading.Lock()
+        self._free = sorted(cpus if cpus is not None else os.sched_getaffinity(0))
+
+    def take(self, count: int) -> list[int] | None:
+        """
+        count free CPUs, next to each other if possible; None if there
+        aren't that many free.
+        """
+        with self._lock:
+            if count <= 0 or len(self._free) < count:
+                return None
+            taken = self._free[:count]
+            del self._free[:count]
+            return taken
+
+    def give_back(self, cpus: list[int]) -> None:
+        with self._lock:
+            self._free = sorted(self._free + cpus)
+
+    def free_count(self) -> int:
+        with self._lock:
+            return len(self._free)
+
+
+def set_io_priority(pid: int, io_class: str, level: int) -> None:
+    """
+    the I/O scheduling class of a process, with util-linux's ionice.
+    """
+    ionice = shutil.which("ionice")
+    if ionice is None:
+        return
+    cmd = [ionice, "-c", str(IO_CLASSES[io_class]), "-p", str(pid)]
+    if io_class != "idle":
+        cmd[3:3] = ["-n", str(level)]
+    try:
+        subprocess.run(cmd, capture_output=True, timeout=5, check=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Can't set the I/O priority of pid {pid}: {e}")
+
+
+@dataclass
+class Envelope:
+    """
+    the limits one process runs in, hand it to ProcessLimiter.release()
+    once the process exited.
+    """
+
+    pid: int
+    cgroup: Path | None = None
+    cpus: list[int] | None = None
+    oom_killed: bool = False  # the process went over its memory limit
+    address_space_limited: bool = False  # started under the address space rlimit
+    peak_rss_kb: int | None = None  # peak memory of the cgroup
+
+
+class ProcessLimiter:
+    """
+    put processes in a resource envelope right after they started:
+    a memory and CPU limit in a cgroup v2, pinned CPUs, nice value, I/O
+    class and OOM score. Processes and threads they start later inherit
+    all of it.
+
+    Without cgroups, address_space_mb (opt-in) caps the address space
+    instead: set by preexec() in the child before it execs, since a limit
+    lowered later doesn't apply to what is already mapped. That limit
+    doesn't kill: an allocation fails and the process exits, which
+    out_of_memory() recognizes from its stderr.
+    """
+
+    def __init__(self, limits: ResourceLimits, cgroups: Cgroups | None = None) -> None:
+        self.limits = limits
+        self.cgroups = cgroups
+        self.cpu_sets = CpuSets()
+        self.oom_kills = 0
+
+    def _limits_address_space(self) -> bool:
+        cgroups = self.cgroups is not None and self.cgroups.enabled
+        return bool(self.limits.address_space_mb) and not cgroups
+
+    def preexec(self) -> Callable[[], None] | None:
+        """
+        the preexec_fn of subprocess.Popen setting the address space rlimit
+        in the child, None when there is none to set.
+        """
+        if not self._limits_address_space():
+            return None
+        limit = self.limits.address_space_mb * 2**20
+
+        def limit_address_space() -> None:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        return limit_address_space
+
+    def apply(self, pid: int, name: str) -> Envelope:
+        limits = self.limits
+        envelope = Envelope(pid, address_space_limited=self._limits_address_space())
+        try:
+            if self.cgroups is not None and self.cgroups.enabled:
+                envelope.cgroup = self.cgroups.add(pid, name, limits)
+            if limits.pinned_cpus:
+                envelope.cpus = self.cpu_sets.take(limits.pinned_cpus)
+                if envelope.cpus is not None:
+                    os.sched_setaffinity(pid, envelope.cpus)
+            if limits.nice:
+                os.setpriority(os.PRIO_PROCESS, pid, limits.nice)
+            if limits.oom_score_adj:
+                with open(f"/proc/{pid}/oom_score_adj", "w") as f:
+                    f.write(str(limits.oom_score_adj))
+        except ProcessLookupError:
+            # it's gone already, nothing left to limit
+            pass
+        except OSError as e:
+            logger.warning(f"Can't limit the resources of pid {pid}: {e}")
+        if limits.io_class:
+            set_io_priority(pid, limits.io_class, limits.io_level)
+        return envelope
+
+    def release(self, envelope: Envelope) -> None:
+        if envelope.cpus is not None:
+            self.cpu_sets.give_back(envelope.cpus)
+            envelope.cpus = None
+        if envelope.cgroup is not None:
+            envelope.oom_killed = Cgroups.oom_kills(envelope.cgroup) > 0
+            envelope.peak_rss_kb = Cgroups.peak_kb(envelope.cgroup)
+            if envelope.oom_killed:
+                self.oom_kills += 1
+            Cgroups.remove(envelope.cgroup)
+            envelope.cgroup = None
+
+    def out_of_memory(self, envelope: Envelope, return_code: int, stderr: Iterable[str]) -> bool:
+        """
+        whether a process under the address space rlimit failed because an
+        allocation did, going by its last stderr lines. It then counts as
+        killed for its memory, like a process over its cgroup's memory.max.
+        """
+        if not envelope.address_space_limited or return_code == 0 or envelope.oom_killed:
+            return envelope.oom_killed
+        if any(marker in line for line in stderr for marker in OUT_OF_MEMORY_MARKERS):
+            envelope.oom_killed = True
+            self.oom_kills += 1
+        return envelope.oom_killed
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ResourceModel:
+    """
+    per-language peak memory of asrtranslate, learned from the last window
+    runs in the job store (their 90th percentile). default_memory_mb
+    stands in until a language has min_runs runs. Estimates are computed
+    again at most every refresh seconds.
+    """
+
+    def __init__(
+        self,
+        store,
+        default_memory_mb: float,
+        window: int = 50,
+        min_runs: int = 3,
+        refresh: float = 60,
+    ) -> None:
+        self.store = store
+        self.default_memory_mb = default_memory_mb
+        self.window = window
+        self.min_runs = min_runs
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._memory_mb: dict[str, tuple[float, float]] = {}  # lang -> (estimate, computed at)
+
+    def memory_mb(self, lang: str) -> float:
+        with self._lock:
+            cached = self._memory_mb.get(lang)
+        if cached is not None and time.time() - cached[1] < self.refresh:
+            return cached[0]
+        peaks = [
+            run["max_rss_kb"] / 1024
+            for run in self.store.runs(lang, self.window)
+            if run["max_rss_kb"]
+        ]
+        estimate = percentile(peaks, 0.9) if len(peaks) >= self.min_runs else self.default_memory_mb
+        with self._lock:
+            self._memory_mb[lang] = (estimate, time.time())
+        return estimate
+
+    def stats(self, languages: list[str]) -> dict:
+        return {lang: {"memory_mb": round(self.memory_mb(lang), 1)} for lang in languages}
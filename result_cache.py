@@ -0,0 +1,161 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    file_hash TEXT NOT NULL,
+    language TEXT NOT NULL,
+    version TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """
+    hard link source to destination, copy it when linking is not possible.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    destination.unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+class ResultCache:
+    """
+    translated files keyed on (upload SHA-256, target language, translator
+    version), stored under directory with an SQLite index. The least
+    recently used entries are evicted once the cache is above max_bytes.
+    Entries of another translator version never match, so upgrading
+    asrtranslate invalidates the cache; they age out through eviction or
+    clear().
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.directory / "index.db", check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def key(file_hash: str, language: str, version: str) -> str:
+        return hashlib.sha256(f"{file_hash}\0{language}\0{version}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def get(
+        self, file_hash: str, language: str, version: str, destination: Path
+    ) -> bool:
+        """
+        place the cached result at destination, False on a miss.
+        """
+        key = self.key(file_hash, language, version)
+        path = self._path(key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or not path.exists():
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return False
+            self._conn.execute(
+                "UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+        link_or_copy(path, destination)
+        return True
+
+    def contains(self, file_hash: str, language: str, version: str) -> bool:
+        key = self.key(file_hash, language, version)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and self._path(key).exists()
+
+    def put(self, file_hash: str, language: str, version: str, source: Path) -> None:
+        key = self.key(file_hash, language, version)
+        path = self._path(key)
+        link_or_copy(source, path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, file_hash, language, version, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, file_hash, language, version, path.stat().st_size, now, now),
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        drop least recently used entries until the cache fits, must hold the lock.
+        """
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._path(key).unlink(missing_ok=True)
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self, keep_version: str | None = None) -> int:
+        """
+        remove every entry, or only those not made by keep_version.
+        Return the number of removed entries.
+        """
+        with self._lock:
+            if keep_version is None:
+                rows = self._conn.execute("SELECT key FROM entries").fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT key FROM entries WHERE version != ?", (keep_version,)
+                ).fetchall()
+            for (key,) in rows:
+                self._path(key).unlink(missing_ok=True)
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,225 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+
+from file_index import FileIndex, IndexedFile
+from job_store import JobStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RetentionPolicy:
+    max_age: float = 0  # seconds a finished job keeps its files, 0 for no limit
+    max_bytes: int = 0  # indexed size of uploads and results together, 0 for no limit
+    keep_last: int = 0  # newest jobs per user (email) that keep their files, 0 for all
+    job_max_age: float = 0  # seconds a finished job record is kept, 0 for no limit
+    max_files_per_cycle: int = 500  # bound on the deletions of one cycle
+    grace: float = 3600  # files younger than this are never deleted
+
+
+@dataclass
+class FileGroup:
+    """
+    the files of one job (uploads and results), or a single file outside
+    any job directory.
+    """
+
+    key: str
+    time: float  # when the job finished, or the file's mtime
+    email: str | None = None
+    files: list[tuple[FileIndex, IndexedFile]] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return sum(file.size for _, file in self.files)
+
+
+class RetentionEngine:
+    """
+    delete old uploads and results, and old job records, in the background.
+
+    Every cycle works from the file indexes and the job store without
+    scanning the disk, removes at most max_files_per_cycle files and never
+    touches the files of jobs that are pending or running, nor those of
+    the newest keep_last jobs of a user, whatever the other limits say.
+
+    The result cache keeps its own hard links, so its entries are not
+    affected. max_bytes is checked against the logical size of the indexed
+    files, links included; bytes_reclaimed only counts files that had no
+    other link, the space a deletion actually freed.
+    """
+
+    def __init__(
+        self,
+        policy: RetentionPolicy,
+        store: JobStore,
+        indexes: list[FileIndex],
+    ) -> None:
+        self.policy = policy
+        self.store = store
+        self.indexes = indexes
+
+        self.cycles = 0
+        self.files_deleted = 0
+        self.bytes_reclaimed = 0
+        self.jobs_deleted = 0
+        self.last_cycle_at: float | None = None
+        self.last_cycle_seconds: float | None = None
+
+        self._lock = threading.Lock()  # one cycle at a time
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _groups(self) -> list[FileGroup]:
+        """
+        indexed files grouped by job, active jobs left out.
+        """
+        protected = {job.job_id for job in self.store.unfinished()}
+        groups: dict[str, FileGroup] = {}
+        for index in self.indexes:
+            for file in index.files():
+                key = file.job_id or f"{index.root}/{file.path}"
+                if key in protected:
+                    continue
+                if file.mtime > time.time() - self.policy.grace:
+                    # e.g. the upload of a job that is not in the store yet
+                    protected.add(key)
+                    groups.pop(key, None)
+                    continue
+                group = groups.setdefault(key, FileGroup(key, file.mtime))
+                group.time = max(group.time, file.mtime)
+                group.files.append((index, file))
+
+        jobs = self.store.get_many(list(groups))
+        for key, job in jobs.items():
+            group = groups[key]
+            group.email = job.email
+            group.time = job.finished_at or job.submitted_at
+        return sorted(groups.values(), key=lambda group: group.time)
+
+    def _expired(self, groups: list[FileGroup], now: float) -> list[FileGroup]:
+        """
+        groups (oldest first) whose files one of the policies wants gone.
+        """
+        expired: set[str] = set()
+        kept: set[str] = set()
+        if self.policy.keep_last:
+            per_user: dict[str, list[FileGroup]] = {}
+            for group in groups:
+                if group.email:
+                    per_user.setdefault(group.email, []).append(group)
+            for user_groups in per_user.values():
+                # groups are oldest first, keep the last keep_last of them
+                kept.update(group.key for group in user_groups[-self.policy.keep_last :])
+                expired.update(
+                    group.key for group in user_groups[: -self.policy.keep_last]
+                )
+
+        if self.policy.max_age:
+            expired.update(
+                group.key
+                for group in groups
+                if group.time < now - self.policy.max_age and group.key not in kept
+            )
+
+        if self.policy.max_bytes:
+            total = sum(index.stats()["bytes"] for index in self.indexes)
+            total -= sum(group.size for group in groups if group.key in expired)
+            for group in groups:
+                if total <= self.policy.max_bytes:
+                    break
+                if group.key not in expired and group.key not in kept:
+                    expired.add(group.key)
+                    total -= group.size
+
+        return [group for group in groups if group.key in expired]
+
+    def run_cycle(self) -> dict:
+        """
+        apply the policy once and return what was reclaimed.
+        """
+        with self._lock:
+            return self._run_cycle()
+
+    def _run_cycle(self) -> dict:
+        started = time.time()
+        files_deleted = 0
+        bytes_reclaimed = 0
+        for group in self._expired(self._groups(), started):
+            for index, file in group.files:
+                if files_deleted >= self.policy.max_files_per_cycle:
+                    break
+                path = index.root / file.path
+                freed = 0
+                try:
+                    stat = path.stat()
+                    # a result still linked from the result cache frees nothing
+                    freed = stat.st_size if stat.st_nlink == 1 else 0
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error(f"Retention: failed to delete {path}: {e}")
+                    continue
+                index.remove(path)
+                files_deleted += 1
+                bytes_reclaimed += freed
+                if file.job_id:
+                    try:
+                        path.parent.rmdir()
+                    except OSError:
+                        pass  # not empty yet
+
+        jobs_deleted = 0
+        if self.policy.job_max_age:
+            jobs_deleted = self.store.delete_finished_before(
+                started - self.policy.job_max_age, self.policy.max_files_per_cycle
+            )
+
+        self.cycles += 1
+        self.files_deleted += files_deleted
+        self.bytes_reclaimed += bytes_reclaimed
+        self.jobs_deleted += jobs_deleted
+        self.last_cycle_at = started
+        self.last_cycle_seconds = time.time() - started
+        if files_deleted or jobs_deleted:
+            logger.info(
+                f"Retention: deleted {files_deleted} files ({bytes_reclaimed} bytes) and {jobs_deleted} job records"
+            )
+        return {
+            "files_deleted": files_deleted,
+            "bytes_reclaimed": bytes_reclaimed,
+            "jobs_deleted": jobs_deleted,
+        }
+
+    def start(self, interval: float) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="retention", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.error(f"Retention cycle failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "cycles": self.cycles,
+            "files_deleted": self.files_deleted,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "jobs_deleted": self.jobs_deleted,
+            "last_cycle_at": self.last_cycle_at,
+            "last_cycle_seconds": self.last_cycle_seconds,
+        }
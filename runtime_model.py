@@ -0,0 +1,104 @@
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class Fit:
+    """
+    seconds = startup_seconds + size / bytes_per_second, fitted on runs runs.
+    """
+
+    runs: int
+    startup_seconds: float
+    bytes_per_second: float | None  # None: the runs didn't depend on size
+
+    def seconds(self, size: int) -> float:
+        if not self.bytes_per_second:
+            return self.startup_seconds
+        return self.startup_seconds + size / self.bytes_per_second
+
+
+def fit_runs(runs: list[dict]) -> Fit:
+    """
+    least squares line through the (size, seconds) of runs. A negative
+    startup time is fitted again through the origin, a line that doesn't
+    grow with size becomes the average.
+    """
+    n = len(runs)
+    mean_size = sum(run["size"] for run in runs) / n
+    mean_seconds = sum(run["seconds"] for run in runs) / n
+    variance = sum((run["size"] - mean_size) ** 2 for run in runs)
+    covariance = sum(
+        (run["size"] - mean_size) * (run["seconds"] - mean_seconds) for run in runs
+    )
+    if variance == 0 or covariance <= 0:
+        return Fit(n, mean_seconds, None)
+    slope = covariance / variance
+    startup = mean_seconds - slope * mean_size
+    if startup < 0:
+        slope = sum(run["size"] * run["seconds"] for run in runs) / sum(
+            run["size"] ** 2 for run in runs
+        )
+        startup = 0.0
+    return Fit(n, startup, 1 / slope)
+
+
+class RuntimeModel:
+    """
+    seconds one asrtranslate run takes for a document, learned from the
+    last window successful runs in the job store: a line through their
+    size and runtime per language and file type, or per language while a
+    file type has fewer than min_runs runs. Fits are computed again at
+    most every refresh seconds.
+    """
+
+    def __init__(self, store, window: int = 200, min_runs: int = 3, refresh: float = 60) -> None:
+        self.store = store
+        self.window = window
+        self.min_runs = min_runs
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        # lang -> (fits per file type, None for all types; computed at)
+        self._fits: dict[str, tuple[dict[str | None, Fit], float]] = {}
+
+    def fits(self, lang: str) -> dict[str | None, Fit]:
+        with self._lock:
+            cached = self._fits.get(lang)
+        if cached is not None and time.time() - cached[1] < self.refresh:
+            return cached[0]
+        runs = [run for run in self.store.runs(lang, self.window) if run["return_code"] == 0]
+        per_type: dict[str | None, list[dict]] = {None: runs}
+        for run in runs:
+            per_type.setdefault(run["file_type"], []).append(run)
+        fits = {
+            file_type: fit_runs(typed)
+            for file_type, typed in per_type.items()
+            if len(typed) >= self.min_runs
+        }
+        with self._lock:
+            self._fits[lang] = (fits, time.time())
+        return fits
+
+    def seconds(self, lang: str, file_type: str | None, size: int) -> float | None:
+        """
+        estimated seconds of a run, None without enough history.
+        """
+        fits = self.fits(lang)
+        fit = fits.get(file_type) or fits.get(None)
+        return fit.seconds(size) if fit is not None else None
+
+    def stats(self, languages: list[str]) -> dict:
+        return {
+            lang: {
+                file_type or "all": {
+                    "runs": fit.runs,
+                    "startup_seconds": round(fit.startup_seconds, 2),
+                    "bytes_per_second": (
+                        round(fit.bytes_per_second, 1) if fit.bytes_per_second else None
+                    ),
+                }
+                for file_type, fit in self.fits(lang).items()
+            }
+            for lang in languages
+        }
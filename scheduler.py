@@ -0,0 +1,426 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Any, Callable
+
+from metrics import QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerPolicy(StrEnum):
+    FIFO = "fifo"  # oldest job first
+    SMALLEST_FIRST = "smallest_first"  # smallest file first
+    SHORTEST_FIRST = "shortest_first"  # shortest estimated runtime first
+
+
+def available_memory_mb() -> int | None:
+    """
+    return the memory available for new processes in MB, None if unknown.
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2**20
+    except (ValueError, OSError):
+        return None
+
+
+def total_memory_mb() -> int | None:
+    """
+    return the physical memory of the machine in MB, None if unknown.
+    """
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2**20
+    except (ValueError, OSError):
+        return None
+
+
+def cpu_load() -> float | None:
+    """
+    1 minute load average per CPU, None if unknown.
+    """
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return None
+
+
+@dataclass
+class QueuedJob:
+    job_id: str
+    owner: str
+    size: int
+    priority: int
+    seq: int
+    fn: Callable[..., Any]
+    args: tuple
+    submitted_at: float = field(default_factory=time.time)
+    memory_mb: float = 0  # estimated peak memory of the job's processes
+    estimate: float | None = None  # estimated seconds the job runs
+    started_at: float | None = None
+
+
+class Scheduler:
+    """
+    run submitted jobs on a fixed number of worker threads.
+
+    - fairness: the next job is taken from the owner (uploader) with the
+      fewest running jobs, then the one served longest ago, so one owner
+      can't starve the others.
+    - priority: within an owner, lower priority first, then the policy
+      (smallest file, shortest estimated runtime or oldest job first).
+    - admission control: a worker only starts a job while free memory is
+      above min_free_memory_mb and the CPU load is below max_load, except
+      when nothing is running at all.
+    - packing: with a memory_budget_mb, a job only starts while its
+      estimated memory fits next to that of the running jobs. If the next
+      job doesn't fit, a later one that does starts instead (backfill),
+      unless the next job has been waiting for max_backfill_wait seconds.
+    - estimates: start and finish times of the queued and running jobs,
+      from their estimated runtime (the average runtime without one) and
+      progress(job_id), the fraction of a running job that is done.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        policy: SchedulerPolicy = SchedulerPolicy.FIFO,
+        min_free_memory_mb: int = 0,
+        max_load: float | None = None,
+        admission_interval: float = 5.0,
+        memory_budget_mb: float = 0,
+        max_backfill_wait: float = 600,
+        progress: Callable[[str], float | None] | None = None,
+    ) -> None:
+        self.workers = max(1, workers)
+        self.policy = policy
+        self.min_free_memory_mb = min_free_memory_mb
+        self.max_load = max_load
+        self.admission_interval = admission_interval
+        self.memory_budget_mb = memory_budget_mb
+        self.max_backfill_wait = max_backfill_wait
+        self.progress = progress
+        self.backfilled = 0
+
+        self._cond = threading.Condition()
+        self._pending: dict[str, QueuedJob] = {}  # job_id -> QueuedJob
+        self._running: dict[str, QueuedJob] = {}  # job_id -> QueuedJob
+        self._running_per_owner: dict[str, int] = {}
+        self._last_served: dict[str, float] = {}  # owner -> last start time
+        self._seq = itertools.count()
+        self._threads: list[threading.Thread] = []
+        self._stopped = False
+        # dispatch order of the pending jobs and their positions in it, built
+        # again after the queue, the running jobs or the runtime changed
+        self._order: list[QueuedJob] | None = None
+        self._positions: dict[str, int] = {}
+        # moving average of the job runtime, used for the start time estimate
+        self.average_runtime: float | None = None
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stopped = False
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"scheduler-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def shutdown(self) -> None:
+        """
+        stop the workers once their current job is done, pending jobs stay queued.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._threads.clear()
+
+    def submit(
+        self,
+        job_id: str,
+        fn: Callable[..., Any],
+        *args: Any,
+        owner: str | None = None,
+        size: int = 0,
+        priority: int = 0,
+        memory_mb: float = 0,
+        estimate: float | None = None,
+    ) -> None:
+        with self._cond:
+            self._pending[job_id] = QueuedJob(
+                job_id=job_id,
+                owner=owner or "",
+                size=size,
+                priority=priority,
+                seq=next(self._seq),
+                fn=fn,
+                args=args,
+                memory_mb=memory_mb,
+                estimate=estimate,
+            )
+            self._order = None
+            self._cond.notify()
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        remove a pending job from the queue, False if it is not pending.
+        """
+        with self._cond:
+            if self._pending.pop(job_id, None) is None:
+                return False
+            self._order = None
+            return True
+
+    def queue_length(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def running_count(self) -> int:
+        with self._cond:
+            return len(self._running)
+
+    def reserved_memory_mb(self) -> float:
+        """
+        estimated memory of the running jobs.
+        """
+        with self._cond:
+            return sum(job.memory_mb for job in self._running.values())
+
+    def oldest_wait(self) -> float:
+        """
+        seconds the longest waiting pending job has been queued, 0 if none.
+        """
+        with self._cond:
+            if not self._pending:
+                return 0.0
+            return time.time() - min(job.submitted_at for job in self._pending.values())
+
+    def position(self, job_id: str) -> int | None:
+        """
+        0-based position of a pending job in dispatch order, None if not pending.
+        """
+        with self._cond:
+            if job_id not in self._pending:
+                return None
+            self._dispatch_order()
+            return self._positions.get(job_id)
+
+    def _expected(self, job: QueuedJob) -> float | None:
+        return job.estimate if job.estimate is not None else self.average_runtime
+
+    def _remaining(self, job: QueuedJob, now: float) -> float | None:
+        """
+        estimated seconds until a running job is done, None if unknown.
+        """
+        elapsed = now - job.started_at
+        expected = self._expected(job)
+        done = self.progress(job.job_id) if self.progress is not None else None
+        if done:
+            by_progress = elapsed * (1 - done) / done
+            if expected is None:
+                return by_progress
+            # the further along, the more the progress is trusted
+            return done * by_progress + (1 - done) * max(0.0, expected - elapsed)
+        if expected is None:
+            return None
+        return max(0.0, expected - elapsed)
+
+    def estimates(self) -> dict[str, tuple[float, float]]:
+        """
+        rough epoch times (start, finish) of the running and pending jobs:
+        the pending jobs start in dispatch order on the first worker that
+        becomes free. Jobs without an estimate are left out, and so are the
+        pending jobs behind them. The memory budget isn't simulated.
+        """
+        now = time.time()
+        with self._cond:
+            running = list(self._running.values())
+            order = list(self._dispatch_order())
+        estimates = {}
+        free = []  # when each worker becomes free, in seconds from now
+        for job in running:
+            remaining = self._remaining(job, now)
+            if remaining is None:
+                free.append(float("inf"))
+                continue
+            free.append(remaining)
+            estimates[job.job_id] = (job.started_at, now + remaining)
+        free += [0.0] * (self.workers - len(free))
+        heapq.heapify(free)
+        for job in order:
+            expected = self._expected(job)
+            if expected is None or free[0] == float("inf"):
+                break
+            start = heapq.heappop(free)
+            estimates[job.job_id] = (now + start, now + start + expected)
+            heapq.heappush(free, start + expected)
+        return estimates
+
+    def estimated_start(self, job_id: str) -> float | None:
+        """
+        rough epoch time at which a pending job will start.
+        """
+        with self._cond:
+            if job_id not in self._pending:
+                return None
+        estimate = self.estimates().get(job_id)
+        return estimate[0] if estimate is not None else None
+
+    def _sort_key(self, job: QueuedJob) -> tuple:
+        if self.policy == SchedulerPolicy.SMALLEST_FIRST:
+            return (job.priority, job.size, job.seq)
+        if self.policy == SchedulerPolicy.SHORTEST_FIRST:
+            # jobs without an estimate take the average runtime, 0 before the first one
+            return (job.priority, self._expected(job) or 0, job.seq)
+        return (job.priority, 0, job.seq)
+
+    def _pick(
+        self,
+        pending: list[QueuedJob],
+        running_per_owner: dict[str, int],
+        last_served: dict[str, float],
+    ) -> QueuedJob:
+        best_per_owner: dict[str, QueuedJob] = {}
+        for job in pending:
+            best = best_per_owner.get(job.owner)
+            if best is None or self._sort_key(job) < self._sort_key(best):
+                best_per_owner[job.owner] = job
+        return min(
+            best_per_owner.values(),
+            key=lambda job: (
+                running_per_owner.get(job.owner, 0),
+                last_served.get(job.owner, 0.0),
+                self._sort_key(job),
+            ),
+        )
+
+    def _dispatch_order(self) -> list[QueuedJob]:
+        """
+        pending jobs in the order they would be started, must hold the lock.
+        The same order as calling _pick() again and again, from a heap of
+        every owner's next job, and cached until the queue changes.
+        """
+        if self._order is not None:
+            return self._order
+        per_owner: dict[str, list[tuple[tuple, QueuedJob]]] = {}
+        for job in self._pending.values():
+            per_owner.setdefault(job.owner, []).append((self._sort_key(job), job))
+        owners = []
+        for owner, jobs in per_owner.items():
+            heapq.heapify(jobs)
+            owners.append(
+                (
+                    self._running_per_owner.get(owner, 0),
+                    self._last_served.get(owner, 0.0),
+                    jobs[0][0],
+                    owner,
+                )
+            )
+        heapq.heapify(owners)
+        order = []
+        clock = time.time()
+        while owners:
+            running, _, _, owner = heapq.heappop(owners)
+            jobs = per_owner[owner]
+            order.append(heapq.heappop(jobs)[1])
+            if jobs:
+                clock += 1
+                heapq.heappush(owners, (running + 1, clock, jobs[0][0], owner))
+        self._order = order
+        self._positions = {job.job_id: position for position, job in enumerate(order)}
+        return order
+
+    def _admit(self) -> bool:
+        """
+        whether the machine has room for one more job, must hold the lock.
+        """
+        if not self._running:
+            return True
+        if self.min_free_memory_mb:
+            memory_mb = available_memory_mb()
+            if memory_mb is not None and memory_mb < self.min_free_memory_mb:
+                return False
+        if self.max_load is not None:
+            load = cpu_load()
+            if load is not None and load > self.max_load:
+                return False
+        return True
+
+    def _fits(self, job: QueuedJob) -> bool:
+        """
+        whether job fits in the memory budget next to the running jobs,
+        must hold the lock.
+        """
+        if not self.memory_budget_mb or not self._running:
+            return True
+        reserved = sum(running.memory_mb for running in self._running.values())
+        return reserved + job.memory_mb <= self.memory_budget_mb
+
+    def _next(self) -> QueuedJob | None:
+        """
+        the job to start now, None if none can; must hold the lock.
+        """
+        if not self._pending or not self._admit():
+            return None
+        job = self._dispatch_order()[0]
+        if self._fits(job):
+            return job
+        if time.time() - job.submitted_at > self.max_backfill_wait:
+            # it waited long enough, keep the room it needs free
+            return None
+        fitting = [other for other in self._pending.values() if self._fits(other)]
+        if not fitting:
+            return None
+        self.backfilled += 1
+        return self._pick(fitting, self._running_per_owner, self._last_served)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and (job := self._next()) is None:
+                    # re-check admission periodically, resources free up on their own
+                    self._cond.wait(self.admission_interval if self._pending else None)
+                if self._stopped:
+                    return
+                del self._pending[job.job_id]
+                self._order = None
+                self._running[job.job_id] = job
+                self._running_per_owner[job.owner] = (
+                    self._running_per_owner.get(job.owner, 0) + 1
+                )
+                self._last_served[job.owner] = time.time()
+                job.started_at = time.time()
+
+            started = job.started_at
+            QUEUE_WAIT_SECONDS.observe(started - job.submitted_at)
+            try:
+                job.fn(*job.args)
+            except Exception as e:
+                logger.error(f"Job {job.job_id} failed: {e}", extra={"job_id": job.job_id})
+            finally:
+                runtime = time.time() - started
+                with self._cond:
+                    del self._running[job.job_id]
+                    self._running_per_owner[job.owner] -= 1
+                    if not self._running_per_owner[job.owner]:
+                        del self._running_per_owner[job.owner]
+                    if self.average_runtime is None:
+                        self.average_runtime = runtime
+                    else:
+                        self.average_runtime = 0.8 * self.average_runtime + 0.2 * runtime
+                    self._order = None
+                    self._cond.notify_all()
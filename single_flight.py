@@ -0,0 +1,63 @@
+import threading
+
+
+class SingleFlight:
+    """
+    coalesce identical jobs while one of them is queued or running.
+    The first job submitted for a key becomes the leader and is executed,
+    later jobs with the same key attach to it as followers and receive its
+    results when it finishes.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._leaders: dict[str, str] = {}  # key -> leader job_id
+        self._keys: dict[str, str] = {}  # leader job_id -> key
+        self._followers: dict[str, list[str]] = {}  # leader job_id -> job_ids
+
+    def attach(self, key: str, job_id: str) -> str | None:
+        """
+        register job_id for key. Return the leader job_id the job is attached
+        to, or None if job_id became the leader and has to be executed.
+        """
+        with self._lock:
+            leader = self._leaders.get(key)
+            if leader is not None and leader != job_id:
+                self._followers[leader].append(job_id)
+                return leader
+            self._leaders[key] = job_id
+            self._keys[job_id] = key
+            self._followers.setdefault(job_id, [])
+            return None
+
+    def release(self, leader: str) -> list[str]:
+        """
+        end the flight of a leader and return its followers.
+        """
+        with self._lock:
+            key = self._keys.pop(leader, None)
+            if key is not None and self._leaders.get(key) == leader:
+                del self._leaders[key]
+            return self._followers.pop(leader, [])
+
+    def detach(self, job_id: str) -> bool:
+        """
+        remove a follower from its flight, False if it is not a follower.
+        """
+        with self._lock:
+            for followers in self._followers.values():
+                if job_id in followers:
+                    followers.remove(job_id)
+                    return True
+            return False
+
+    def leader_of(self, job_id: str) -> str | None:
+        with self._lock:
+            for leader, followers in self._followers.items():
+                if job_id in followers:
+                    return leader
+            return None
+
+    def followers(self, leader: str) -> list[str]:
+        with self._lock:
+            return list(self._followers.get(leader, []))
@@ -1,5 +1,6 @@
 import base64
 import json
+import logging
 import os
 import smtplib
 import sys
@@ -14,11 +15,14 @@ import spnego
 
 dotenv.load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 class EmailSender:
     def __init__(self) -> None:
         self.smtp_server = "smtp.gmail.com"
         self.smtp_port = 587
+        self._smtp: smtplib.SMTP | None = None
 
     def _ntlm_auth_with_pyspnego(
         self, smtp: smtplib.SMTP, username: str, password: str, domain: str
@@ -53,7 +57,7 @@ class EmailSender:
 
             return True
         except Exception as e:
-            print(f"NTLM authentication error: {e}")
+            logger.error(f"NTLM authentication error: {e}")
             return False
 
     def send_email(
@@ -108,18 +112,42 @@ class EmailSender:
 
         # Validate required fields
         if not sender:
-            print("Error: sender is required")
+            logger.error("Sender is required")
             return False
         if not recipients:
-            print("Error: recipients list is required")
+            logger.error("Recipients list is required")
             return False
         if not subject:
-            print("Error: subject is required")
+            logger.error("Subject is required")
             return False
         if not message:
-            print("Error: message is required")
+            logger.error("Message is required")
+            return False
+
+        msg = self.build_message(sender, recipients, subject, message, attachments)
+
+        # Send the email
+        try:
+            self.connect(sender, password, domain, use_ntlm)
+            self.send_message(msg)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to send email: {e}")
             return False
+        finally:
+            self.close()
 
+    def build_message(
+        self,
+        sender: str,
+        recipients: list[str],
+        subject: str,
+        message: str,
+        attachments: list[str] | None = None,
+    ) -> MIMEMultipart:
+        """
+        Build the MIME message of an email.
+        """
         # Create a multipart message object
         msg = MIMEMultipart()
 
@@ -153,35 +181,74 @@ class EmailSender:
 
                         # Attach the part to message
                         msg.attach(part)
-                        print(f"Attached file: {filename}")
+                        logger.info(f"Attached file: {filename}")
                     except Exception as e:
-                        print(f"Failed to attach file {file_path}: {e}")
+                        logger.error(f"Failed to attach file {file_path}: {e}")
                 else:
-                    print(f"File not found: {file_path}")
+                    logger.error(f"File not found: {file_path}")
 
-        # Send the email
-        with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=10) as smtp:
-            try:
-                smtp.ehlo()
-                smtp.starttls()
-                smtp.ehlo()
-                if use_ntlm:
-                    # Use NTLM authentication
-                    if not self._ntlm_auth_with_pyspnego(
-                        smtp,
-                        sender,
-                        password or "",
-                        domain or "",
-                    ):
-                        return False
-                else:
-                    smtp.login(sender, password or "")
+        return msg
+
+    def connect(
+        self,
+        sender: str,
+        password: str | None = None,
+        domain: str | None = None,
+        use_ntlm: bool = False,
+    ) -> None:
+        """
+        Open an authenticated SMTP connection that is kept for send_message().
+        Raises an exception if the connection or the authentication fails.
+        """
+        self.close()
+        smtp = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=10)
+        try:
+            smtp.ehlo()
+            smtp.starttls()
+            smtp.ehlo()
+            if use_ntlm:
+                # Use NTLM authentication
+                if not self._ntlm_auth_with_pyspnego(
+                    smtp,
+                    sender,
+                    password or "",
+                    domain or "",
+                ):
+                    raise Exception("NTLM authentication failed")
+            else:
+                smtp.login(sender, password or "")
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+
+    def is_connected(self) -> bool:
+        """
+        Check that the kept SMTP connection is still alive.
+        """
+        if self._smtp is None:
+            return False
+        try:
+            return self._smtp.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
 
-                smtp.send_message(msg)
-                return True
-            except Exception as e:
-                print(f"Failed to send email: {e}")
-                return False
+    def send_message(self, msg: MIMEMultipart) -> None:
+        """
+        Send a message over the connection opened by connect().
+        """
+        if self._smtp is None:
+            raise smtplib.SMTPServerDisconnected("not connected")
+        self._smtp.send_message(msg)
+
+    def close(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
 
     def load_config(self, config_path: str | None = None) -> dict | None:
         """
@@ -208,12 +275,12 @@ class EmailSender:
             return config
 
         except FileNotFoundError:
-            print(f"Configuration file not found: {config_path}")
-            print("Please create email_config.json file with the required settings.")
+            logger.error(f"Configuration file not found: {config_path}")
+            logger.error("Please create email_config.json file with the required settings.")
             return None
         except json.JSONDecodeError as e:
-            print(f"Invalid JSON in configuration file: {e}")
+            logger.error(f"Invalid JSON in configuration file: {e}")
             return None
         except Exception as e:
-            print(f"Error loading configuration: {e}")
+            logger.error(f"Failed to load configuration: {e}")
             return None
@@ -0,0 +1,16 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+# main.py reads its configuration on import: keep its directories and
+# databases out of the real ASRtranslate checkout
+_data_dir = Path(tempfile.mkdtemp(prefix="task-manager-tests-"))
+atexit.register(shutil.rmtree, _data_dir, ignore_errors=True)
+os.environ.setdefault("TASK_ASRTRANSLATE_DIR", str(_data_dir / "asrtranslate"))
+os.environ.setdefault("TASK_JOB_DB", str(_data_dir / "jobs.db"))
+os.environ.setdefault("TASK_WORKER_POOL_SIZE", "0")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,21 @@
+from chunking import partition
+
+
+def test_partition_keeps_document_order():
+    assert partition([10, 10, 10, 10], 2) == [[0, 1], [2, 3]]
+
+
+def test_partition_puts_empty_segments_in_the_current_group():
+    assert partition([10, 0, 0, 0], 2) == [[0, 1, 2, 3]]
+    assert partition([0, 0, 10, 0, 10, 0], 2) == [[0, 1, 2, 3], [4, 5]]
+
+
+def test_partition_never_returns_more_than_count_groups():
+    groups = partition([100, 1, 1, 1, 1, 1], 3)
+    assert len(groups) <= 3
+    assert [i for group in groups for i in group] == list(range(6))
+
+
+def test_partition_of_nothing_to_split():
+    assert partition([0, 0, 0], 4) == [[0, 1, 2]]
+    assert partition([5], 4) == [[0]]
@@ -0,0 +1,82 @@
+import threading
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from chunking import write_package
+
+DESIGNMAP = (
+    b'<Document><idPkg:Story src="Stories/Story_u1.xml"/>'
+    b'<idPkg:Story src="Stories/Story_u2.xml"/></Document>'
+)
+
+
+def idml(path: Path, stories: tuple[bytes, bytes], *extra: tuple[str, bytes]) -> Path:
+    write_package(
+        path,
+        [
+            ("mimetype", b"application/vnd.adobe.indesign-idml-package"),
+            ("designmap.xml", DESIGNMAP),
+            ("Stories/Story_u1.xml", b'<Story Self="u1">' + stories[0] + b"</Story>"),
+            ("Stories/Story_u2.xml", b'<Story Self="u2">' + stories[1] + b"</Story>"),
+            *extra,
+        ],
+    )
+    return path
+
+
+@pytest.fixture
+def main(monkeypatch):
+    import main
+
+    def translate_document(job_id, source, lang, output_dir, *args):
+        # marks the stories translated, translates the master spread and adds an entry
+        with zipfile.ZipFile(source) as package:
+            entries = [(info.filename, package.read(info)) for info in package.infolist()]
+        translated = [
+            (name, data.replace(b"</Story>", b" (en)</Story>") if name.startswith("Stories/") else data)
+            for name, data in entries
+            if name != "MasterSpreads/m.xml"
+        ]
+        translated += [("MasterSpreads/m.xml", b"MASTER"), ("META-INF/added.xml", b"added")]
+        write_package(output_dir / f"{source.stem}-{lang}.idml", translated)
+        return 0
+
+    monkeypatch.setattr(main, "translate_document", translate_document)
+    return main
+
+
+def translate(main, job_id: str, source: Path) -> Path:
+    main.job_result_dir(job_id).mkdir(parents=True, exist_ok=True)
+    span = main.tracer.begin(job_id, "translate", "en")
+    return_code = main.translate_with_memory(
+        job_id, source, "en", None, threading.Event(), None, span
+    )
+    assert return_code == 0
+    return main.result_file(job_id, source, "en")
+
+
+def test_nothing_remembered_returns_the_translation_as_it_is(main, tmp_path):
+    source = idml(tmp_path / "new.idml", (b"first", b"second"), ("MasterSpreads/m.xml", b"m"))
+    work_dir = main.chunk_dir("job-new") / "en"
+
+    result = translate(main, "job-new", source)
+
+    with zipfile.ZipFile(result) as package:
+        assert package.read("META-INF/added.xml") == b"added"
+        assert package.read("MasterSpreads/m.xml") == b"MASTER"
+    assert not (work_dir / "new-en.idml").exists()
+
+
+def test_remembered_segments_are_spliced_in(main, tmp_path):
+    idml(tmp_path / "a.idml", (b"kept", b"old"), ("MasterSpreads/m.xml", b"m"))
+    translate(main, "job-a", tmp_path / "a.idml")
+    source = idml(tmp_path / "b.idml", (b"kept", b"changed"), ("MasterSpreads/m.xml", b"m"))
+
+    result = translate(main, "job-b", source)
+
+    with zipfile.ZipFile(result) as package:
+        assert package.read("Stories/Story_u1.xml") == b'<Story Self="u1">kept (en)</Story>'
+        assert package.read("Stories/Story_u2.xml") == b'<Story Self="u2">changed (en)</Story>'
+        assert package.read("MasterSpreads/m.xml") == b"MASTER"
@@ -0,0 +1,188 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# the job the current thread works on, added to every log record
+current_job_id: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "current_job_id", default=None
+)
+
+
+@contextmanager
+def job_context(job_id: str | None) -> Iterator[None]:
+    """
+    attribute the log records emitted inside the block to job_id.
+    """
+    token = current_job_id.set(job_id)
+    try:
+        yield
+    finally:
+        current_job_id.reset(token)
+
+
+class JobContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "job_id", None) is None:
+            record.job_id = current_job_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    one JSON object per line with the time, level, logger, message, job_id
+    and the span of span records.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        job_id = getattr(record, "job_id", None)
+        if job_id is not None:
+            entry["job_id"] = job_id
+        span = getattr(record, "span", None)
+        if span is not None:
+            entry["span"] = span
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def setup_logging(
+    level: str = "INFO", path: Path | None = None
+) -> logging.handlers.QueueListener:
+    """
+    log JSON lines to stdout (and path) from a background thread. Callers
+    only put records on a queue, so they never wait on log I/O. Stop the
+    returned listener to flush the queue.
+    """
+    handlers: list[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+    if path is not None:
+        handlers.append(
+            logging.handlers.RotatingFileHandler(
+                path, maxBytes=50 * 2**20, backupCount=5, encoding="utf-8"
+            )
+        )
+    formatter = JsonFormatter()
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # the job id has to be read in the thread that logs, not in the listener
+    queue_handler.addFilter(JobContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    return listener
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    end: float | None = None
+    language: str | None = None
+    error: str | None = None
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float | None:
+        return None if self.end is None else self.end - self.start
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "duration": self.duration}
+
+
+class Tracer:
+    """
+    timing spans per job (queued, run, translate per language, verify,
+    email...), kept in memory for the max_jobs most recently traced jobs.
+    Every finished span is also logged.
+    """
+
+    def __init__(self, max_jobs: int = 1000) -> None:
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._spans: OrderedDict[str, list[Span]] = OrderedDict()  # job_id -> spans
+
+    def begin(
+        self, job_id: str, name: str, language: str | None = None, **attributes
+    ) -> Span:
+        span = Span(name, time.time(), language=language, attributes=attributes)
+        with self._lock:
+            spans = self._spans.setdefault(job_id, [])
+            self._spans.move_to_end(job_id)
+            spans.append(span)
+            while len(self._spans) > self.max_jobs:
+                self._spans.popitem(last=False)
+        return span
+
+    def end(
+        self, job_id: str, span: Span, error: str | None = None, **attributes
+    ) -> None:
+        span.end = time.time()
+        span.error = error
+        span.attributes.update(attributes)
+        logger.info(
+            f"{span.name} {'failed' if error else 'finished'} in {span.duration:.3f}s",
+            extra={"job_id": job_id, "span": span.to_dict()},
+        )
+
+    def end_open(self, job_id: str, name: str, **attributes) -> None:
+        """
+        end the open spans called name of a job, e.g. "queued" when a
+        worker picks the job.
+        """
+        with self._lock:
+            spans = [
+                span
+                for span in self._spans.get(job_id, [])
+                if span.name == name and span.end is None
+            ]
+        for span in spans:
+            self.end(job_id, span, **attributes)
+
+    @contextmanager
+    def span(
+        self, job_id: str, name: str, language: str | None = None, **attributes
+    ) -> Iterator[Span]:
+        """
+        time the block as a span, an exception ends it with its error.
+        """
+        span = self.begin(job_id, name, language, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(job_id, span, error=str(e) or type(e).__name__)
+            raise
+        self.end(job_id, span)
+
+    def spans(self, job_id: str) -> list[Span]:
+        with self._lock:
+            return list(self._spans.get(job_id, []))
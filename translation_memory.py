@@ -0,0 +1,157 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    key TEXT PRIMARY KEY,
+    language TEXT NOT NULL,
+    version TEXT NOT NULL,
+    translation BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used);
+"""
+
+
+def normalize(source: bytes) -> bytes:
+    """
+    segments that only differ in whitespace share their translation.
+    """
+    return b" ".join(source.split())
+
+
+class TranslationMemory:
+    """
+    translations of single segments (IDML stories, paragraphs of a text)
+    keyed on the SHA-256 of (normalized source, target language, translator
+    version), in SQLite. The least recently used segments are evicted once
+    the memory is above max_bytes, segments unused for max_age seconds
+    (0 for no limit) are dropped too.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, max_age: float = 0) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    @staticmethod
+    def key(source: bytes, language: str, version: str) -> str:
+        digest = hashlib.sha256(normalize(source))
+        digest.update(f"\0{language}\0{version}".encode())
+        return digest.hexdigest()
+
+    def get_many(
+        self, sources: list[bytes], language: str, version: str
+    ) -> dict[int, bytes]:
+        """
+        the remembered translations of sources, by their index in sources.
+        """
+        keys = [self.key(source, language, version) for source in sources]
+        found: dict[str, bytes] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i : i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, translation FROM segments WHERE key IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE segments SET last_used = ? WHERE key = ?",
+                [(now, key) for key in found],
+            )
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return {i: found[key] for i, key in enumerate(keys) if key in found}
+
+    def put_many(
+        self, pairs: list[tuple[bytes, bytes]], language: str, version: str
+    ) -> None:
+        """
+        remember the translation of each (source, translation) pair.
+        """
+        now = time.time()
+        rows = [
+            (self.key(source, language, version), language, version, translation, len(translation), now, now)
+            for source, translation in pairs
+        ]
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO segments (key, language, version, translation, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        drop expired and least recently used segments until the memory
+        fits, must hold the lock.
+        """
+        if self.max_age:
+            cursor = self._conn.execute(
+                "DELETE FROM segments WHERE last_used < ?", (time.time() - self.max_age,)
+            )
+            self.evictions += cursor.rowcount
+        (total,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM segments"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM segments ORDER BY last_used"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM segments WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self, keep_version: str | None = None) -> int:
+        """
+        remove every segment, or only those not translated by keep_version.
+        Return the number of removed segments.
+        """
+        with self._lock:
+            if keep_version is None:
+                cursor = self._conn.execute("DELETE FROM segments")
+            else:
+                cursor = self._conn.execute(
+                    "DELETE FROM segments WHERE version != ?", (keep_version,)
+                )
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            segments, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "segments": segments,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -1,8 +1,33 @@
+import threading
+import time
+
 import gradio as gr
 import requests
 import pandas as pd
 from pathlib import Path
 
+# counts the job events the task manager reported; every open page waits
+# on it and fetches the task table again only when something changed
+task_events = threading.Condition()
+task_event_count = 0
+# events often come in bursts (a job and its languages), one fetch serves them
+TASK_EVENT_DEBOUNCE_SECONDS = 0.5
+# a page that saw no event for this long is sent a no-op, so a closed one is noticed
+TASK_EVENT_KEEPALIVE_SECONDS = 15
+# the estimates of queued and running jobs are refreshed this often, which
+# also catches up the table while the event stream is down
+ESTIMATE_REFRESH_SECONDS = 30
+
+# newest jobs shown in the task table (job_id -> job), kept up to date with
+# the task manager's change feed from task_table_event_id on
+TASK_TABLE_SIZE = 200
+task_table: dict[str, dict] = {}
+task_table_event_id = None
+task_table_lock = threading.Lock()
+
+# statuses of jobs with a start and finish estimate, polled while any is shown
+UNFINISHED_STATUSES = ("pending", "running")
+
 
 def handle_language_selection(selected):
     all_option = [
@@ -77,15 +102,73 @@ def handle_start(file_path, language, email):
         return [f"Error occurred: {str(e)}", gr.Tabs(selected=0)]
 
 
+def update_task_table():
+    """Fetch the newest jobs once, then only the jobs changed since the last fetch"""
+    global task_table_event_id
+    with task_table_lock:
+        if task_table_event_id is None:
+            response = requests.get(
+                "http://localhost:3030/tasks/", params={"limit": TASK_TABLE_SIZE}
+            )
+            response.raise_for_status()
+            tasks = response.json()
+            task_table.clear()
+            for job in tasks["jobs"]:
+                task_table[job["job_id"]] = job
+            task_table_event_id = tasks["event_id"]
+        else:
+            while True:
+                response = requests.get(
+                    "http://localhost:3030/tasks/",
+                    params={"since": task_table_event_id, "limit": 1000},
+                )
+                response.raise_for_status()
+                tasks = response.json()
+                for job in tasks["jobs"]:
+                    task_table[job["job_id"]] = job
+                task_table_event_id = tasks["event_id"]
+                if len(tasks["jobs"]) < 1000:
+                    break
+
+        newest = sorted(
+            task_table.values(), key=lambda job: job["submitted_at"], reverse=True
+        )[:TASK_TABLE_SIZE]
+        task_table.clear()
+        for job in newest:
+            task_table[job["job_id"]] = job
+        return newest
+
+
+def fetch_task_estimates(jobs):
+    """Fetch the start and finish estimates if any of the jobs is queued or running"""
+    if not any(job["status"] in UNFINISHED_STATUSES for job in jobs):
+        return {}
+    response = requests.get("http://localhost:3030/tasks/estimates", timeout=5)
+    response.raise_for_status()
+    return response.json()
+
+
+def format_duration(seconds):
+    """Round an estimate to what a user needs to know"""
+    if seconds is None:
+        return ""
+    if seconds < 60:
+        return "< 1 min"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"~{minutes} min"
+    return f"~{minutes // 60} h {minutes % 60} min"
+
+
 def fetch_tasks_as_dataframe():
     """Fetch tasks and return as structured data for dataframe display"""
     try:
-        response = requests.get("http://localhost:3030/tasks/")
-        response.raise_for_status()
-        tasks = response.json()
-        if tasks and "jobs" in tasks and tasks["jobs"]:
+        jobs = update_task_table()
+        if jobs:
+            estimates = fetch_task_estimates(jobs)
             pending_jobs = []
-            for job in tasks["jobs"]:
+            for job in jobs:
+                estimate = estimates.get(job["job_id"], {})
                 pending_jobs.append(
                     {
                         "Job ID": job["job_id"],
@@ -93,6 +176,12 @@ def fetch_tasks_as_dataframe():
                         "File": job["filename"],
                         "Language": job["language"],
                         "Email": job.get("email", ""),
+                        "Starts in": (
+                            format_duration(estimate.get("queue_wait_seconds"))
+                            if job["status"] == "pending"
+                            else ""
+                        ),
+                        "ETA": format_duration(estimate.get("eta_seconds")),
                     }
                 )
 
@@ -108,6 +197,8 @@ def fetch_tasks_as_dataframe():
                         "File": "",
                         "Language": "",
                         "Email": "",
+                        "Starts in": "",
+                        "ETA": "",
                     }
                 ]
             )
@@ -120,11 +211,67 @@ def fetch_tasks_as_dataframe():
                     "File": "",
                     "Language": "",
                     "Email": "",
+                    "Starts in": "",
+                    "ETA": "",
                 }
             ]
         )
 
 
+def notify_task_event():
+    global task_event_count
+    with task_events:
+        task_event_count += 1
+        task_events.notify_all()
+
+
+def watch_task_events():
+    """Follow the task manager's event stream and wake the pages showing the task table"""
+    last_event_id = None
+    while True:
+        try:
+            headers = {"Last-Event-ID": last_event_id} if last_event_id else {}
+            with requests.get(
+                "http://localhost:3030/tasks/events",
+                headers=headers,
+                stream=True,
+                timeout=(5, 60),
+            ) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith("id:"):
+                        last_event_id = line[3:].strip()
+                        notify_task_event()
+        except requests.exceptions.RequestException:
+            time.sleep(5)
+
+
+def follow_task_table():
+    """Stream the task table to one page, fetched again after every job event"""
+    seen = task_event_count
+    while True:
+        with task_events:
+            task_events.wait_for(
+                lambda: task_event_count != seen, timeout=TASK_EVENT_KEEPALIVE_SECONDS
+            )
+            changed = task_event_count != seen
+        if not changed:
+            yield gr.skip()
+            continue
+        time.sleep(TASK_EVENT_DEBOUNCE_SECONDS)
+        seen = task_event_count
+        yield fetch_tasks_as_dataframe()
+
+
+def refresh_estimates():
+    """Refresh the task table to count down the estimates of queued and running jobs"""
+    with task_table_lock:
+        unfinished = any(job["status"] in UNFINISHED_STATUSES for job in task_table.values())
+    if not unfinished:
+        return gr.skip()
+    return fetch_tasks_as_dataframe()
+
+
 ############################### GUI ##################################
 with gr.Blocks(
     theme=gr.themes.Default(  # type: ignore
@@ -211,6 +358,7 @@ with gr.Blocks(
             )
 
             refresh_button = gr.Button("Refresh Tasks")
+            estimate_timer = gr.Timer(ESTIMATE_REFRESH_SECONDS)
 
     # Logic to update preview and handle events
     language_dropdown.change(
@@ -242,4 +390,19 @@ with gr.Blocks(
         outputs=[dataframe],
     )
 
+    # pushed to the page by the event stream; runs as long as the page is open
+    demo.load(
+        fn=follow_task_table,
+        inputs=[],
+        outputs=[dataframe],
+        concurrency_limit=None,
+    )
+
+    estimate_timer.tick(
+        fn=refresh_estimates,
+        inputs=[],
+        outputs=[dataframe],
+    )
+
+threading.Thread(target=watch_task_events, daemon=True).start()
 demo.launch(server_name="0.0.0.0")
@@ -0,0 +1,313 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from enum import StrEnum
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class WorkState(StrEnum):
+    PENDING = "pending"  # waiting for a worker
+    LEASED = "leased"  # a worker runs it, as long as it renews its lease
+    DONE = "done"  # the worker reported a return code
+    FAILED = "failed"  # delivered max_attempts times without an answer
+
+
+@dataclass
+class WorkItem:
+    item_id: str
+    job_id: str
+    lang: str
+    source: str  # document to translate, on the server
+    output: str  # where the server puts the translated document
+    state: str = WorkState.PENDING
+    worker: str | None = None
+    lease_until: float | None = None
+    attempts: int = 0  # deliveries so far
+    return_code: int | None = None
+    error: str | None = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS work (
+    item_id TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    source TEXT NOT NULL,
+    output TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    return_code INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS work_state ON work (state, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    last_seen REAL NOT NULL,
+    leased INTEGER NOT NULL DEFAULT 0,
+    completed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+COLUMNS = [
+    "item_id",
+    "job_id",
+    "lang",
+    "source",
+    "output",
+    "state",
+    "worker",
+    "lease_until",
+    "attempts",
+    "return_code",
+    "error",
+    "created_at",
+    "updated_at",
+]
+
+
+class WorkQueue:
+    """
+    translations handed to remote workers, in SQLite so every process on
+    the host (and the server across restarts) sees the same queue.
+
+    A worker leases the oldest pending item for lease_seconds and keeps it
+    by calling heartbeat() before the lease runs out. An item whose lease
+    ran out (the worker died or lost the network) is delivered again to
+    the next worker, up to max_attempts deliveries, then it fails. Only
+    the worker holding the lease can complete an item.
+
+    put(), get(), delete() are used by the server, lease(), heartbeat()
+    and complete() on behalf of workers; another backend only has to
+    provide the same methods.
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = 60, max_attempts: int = 3) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.redelivered = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _item(row: tuple) -> WorkItem:
+        return WorkItem(**dict(zip(COLUMNS, row)))
+
+    def put(self, job_id: str, lang: str, source: Path, output: Path) -> WorkItem:
+        now = time.time()
+        item = WorkItem(
+            item_id=str(uuid.uuid4()),
+            job_id=job_id,
+            lang=lang,
+            source=str(source),
+            output=str(output),
+            created_at=now,
+            updated_at=now,
+        )
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO work ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [getattr(item, column) for column in COLUMNS],
+            )
+        return item
+
+    def get(self, item_id: str) -> WorkItem | None:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM work WHERE item_id = ?", (item_id,)
+            ).fetchone()
+        return self._item(row) if row is not None else None
+
+    def delete(self, item_id: str) -> None:
+        """
+        forget an item; a worker still running it loses its lease.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM work WHERE item_id = ?", (item_id,))
+
+    def clear(self) -> int:
+        """
+        forget every item, for a server that starts with none in flight.
+        """
+        with self._lock:
+            return self._conn.execute("DELETE FROM work").rowcount
+
+    def _expire(self, now: float) -> None:
+        """
+        put the items whose lease ran out back in the queue, or fail them
+        after max_attempts deliveries; must hold the lock, in a transaction.
+        """
+        expired = self._conn.execute(
+            "SELECT item_id, worker, attempts FROM work WHERE state = ? AND lease_until < ?",
+            (WorkState.LEASED, now),
+        ).fetchall()
+        for item_id, worker, attempts in expired:
+            if attempts >= self.max_attempts:
+                logger.warning(f"Work item {item_id} lost by {worker}, giving up after {attempts} deliveries")
+                self._conn.execute(
+                    "UPDATE work SET state = ?, error = ?, updated_at = ? WHERE item_id = ?",
+                    (
+                        WorkState.FAILED,
+                        f"Its worker was lost {attempts} times, the last one {worker}",
+                        now,
+                        item_id,
+                    ),
+                )
+            else:
+                logger.warning(f"Work item {item_id} lost by {worker}, delivering it again")
+                self.redelivered += 1
+                self._conn.execute(
+                    "UPDATE work SET state = ?, worker = NULL, lease_until = NULL, updated_at = ? WHERE item_id = ?",
+                    (WorkState.PENDING, now, item_id),
+                )
+
+    def expire(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._expire(time.time())
+
+    def _seen(self, worker: str, now: float, leased: int = 0, completed: int = 0) -> None:
+        self._conn.execute(
+            """
+            INSERT INTO workers (worker, last_seen, leased, completed) VALUES (?, ?, ?, ?)
+            ON CONFLICT (worker) DO UPDATE SET
+                last_seen = excluded.last_seen,
+                leased = leased + excluded.leased,
+                completed = completed + excluded.completed
+            """,
+            (worker, now, leased, completed),
+        )
+
+    def lease(self, worker: str) -> WorkItem | None:
+        """
+        the oldest pending item, leased to worker; None if there is none.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            # IMMEDIATE takes the write lock up front: two workers can't lease the same item
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._expire(now)
+            row = self._conn.execute(
+                "SELECT item_id FROM work WHERE state = ? ORDER BY created_at LIMIT 1",
+                (WorkState.PENDING,),
+            ).fetchone()
+            self._seen(worker, now, leased=row is not None)
+            if row is None:
+                return None
+            self._conn.execute(
+                """
+                UPDATE work SET state = ?, worker = ?, lease_until = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE item_id = ?
+                """,
+                (WorkState.LEASED, worker, now + self.lease_seconds, now, row[0]),
+            )
+            item = self._item(
+                self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM work WHERE item_id = ?", row
+                ).fetchone()
+            )
+        return item
+
+    def holds(self, item_id: str, worker: str) -> bool:
+        """
+        whether worker holds a live lease on the item.
+        """
+        item = self.get(item_id)
+        return (
+            item is not None
+            and item.state == WorkState.LEASED
+            and item.worker == worker
+            and item.lease_until >= time.time()
+        )
+
+    def heartbeat(self, item_id: str, worker: str) -> bool:
+        """
+        renew worker's lease on an item, False if it lost it (the item was
+        delivered again, cancelled or forgotten): the worker has to stop.
+        """
+        now = time.time()
+        with self._lock:
+            renewed = self._conn.execute(
+                "UPDATE work SET lease_until = ?, updated_at = ? WHERE item_id = ? AND worker = ? AND state = ?",
+                (now + self.lease_seconds, now, item_id, worker, WorkState.LEASED),
+            ).rowcount
+            self._seen(worker, now)
+        return renewed == 1
+
+    def complete(
+        self, item_id: str, worker: str, return_code: int, error: str | None = None
+    ) -> bool:
+        """
+        record the outcome of an item, False if worker doesn't hold it.
+        """
+        now = time.time()
+        with self._lock:
+            completed = self._conn.execute(
+                "UPDATE work SET state = ?, return_code = ?, error = ?, lease_until = NULL, updated_at = ? WHERE item_id = ? AND worker = ? AND state = ?",
+                (WorkState.DONE, return_code, error, now, item_id, worker, WorkState.LEASED),
+            ).rowcount
+            self._seen(worker, now, completed=completed)
+        return completed == 1
+
+    def pending_count(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM work WHERE state = ?", (WorkState.PENDING,)
+            ).fetchone()
+        return count
+
+    def stats(self, active_within: float) -> dict:
+        """
+        items per state and the workers seen in the last active_within seconds.
+        """
+        since = time.time() - active_within
+        with self._lock:
+            states = dict(
+                self._conn.execute("SELECT state, COUNT(*) FROM work GROUP BY state").fetchall()
+            )
+            workers = self._conn.execute(
+                "SELECT worker, last_seen, leased, completed FROM workers WHERE last_seen >= ? ORDER BY worker",
+                (since,),
+            ).fetchall()
+            running = dict(
+                self._conn.execute(
+                    "SELECT worker, COUNT(*) FROM work WHERE state = ? GROUP BY worker",
+                    (WorkState.LEASED,),
+                ).fetchall()
+            )
+        return {
+            "items": {state: states.get(state, 0) for state in WorkState},
+            "redelivered": self.redelivered,
+            "workers": [
+                {
+                    "worker": worker,
+                    "last_seen": last_seen,
+                    "running": running.get(worker, 0),
+                    "leased": leased,
+                    "completed": completed,
+                }
+                for worker, last_seen, leased, completed in workers
+            ],
+        }
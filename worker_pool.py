@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from asr_worker import END_MARKER
+from job_logs import LanguageOutput, OutputReader
+from resources import Envelope, ProcessLimiter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WorkerResult:
+    pid: int
+    return_code: int | None  # None if the worker died or was stopped
+    cpu_seconds: float | None = None
+    max_rss_kb: int | None = None  # peak of the worker process during the run
+    stopped: str | None = None  # "cancelled" or "timeout"
+
+
+def process_rss_mb(pid: int) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+
+class Worker:
+    """
+    one asr_worker.py process; the output of the request it runs goes to
+    the request's LanguageOutput.
+    """
+
+    def __init__(
+        self,
+        command: list[str],
+        cwd: Path,
+        kill_grace: float,
+        preexec_fn: Callable[[], None] | None = None,
+    ) -> None:
+        self.kill_grace = kill_grace
+        self.jobs = 0
+        self.envelope: Envelope | None = None  # its resource limits, see WorkerPool
+        self.sink: LanguageOutput | None = None
+        self._ended: set[str] = set()
+        self._request_done = threading.Event()
+
+        reply_read, reply_write = os.pipe()
+        try:
+            # a new session lets stop() reach everything asrtranslate started
+            self.process = subprocess.Popen(
+                [*command, "--reply-fd", str(reply_write)],
+                cwd=cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                pass_fds=(reply_write,),
+                start_new_session=True,
+                preexec_fn=preexec_fn,
+            )
+        except BaseException:
+            os.close(reply_read)
+            raise
+        finally:
+            os.close(reply_write)
+        self._replies = reply_read
+        self._reply_buffer = b""
+        self.reader = OutputReader(
+            [("stdout", self.process.stdout), ("stderr", self.process.stderr)],
+            self._line,
+            self._request_done.set,
+            f"worker-{self.process.pid}",
+        )
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _reply(self, timeout: float) -> dict | None:
+        """
+        the next reply of the worker, None if none came within timeout.
+        Raises EOFError when the worker closed its reply pipe (it died).
+        """
+        while b"\n" not in self._reply_buffer:
+            readable, _, _ = select.select([self._replies], [], [], timeout)
+            if not readable:
+                return None
+            chunk = os.read(self._replies, 65536)
+            if not chunk:
+                raise EOFError
+            self._reply_buffer += chunk
+        line, self._reply_buffer = self._reply_buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def _line(self, stream: str, line: str) -> None:
+        if line == END_MARKER:
+            self._ended.add(stream)
+            if len(self._ended) == 2:
+                self._request_done.set()
+            return
+        sink = self.sink
+        if sink is not None:
+            sink.line(stream, line)
+        elif line.strip():
+            logger.info(f"worker {self.pid} [{stream}] {line.rstrip()}")
+
+    def run(
+        self,
+        argv: list[str],
+        output: LanguageOutput | None,
+        cancel_event: threading.Event,
+        deadline: float | None,
+        drain_timeout: float,
+    ) -> WorkerResult:
+        self.sink = output
+        self._ended.clear()
+        self._request_done.clear()
+        try:
+            self.process.stdin.write((json.dumps({"argv": argv}) + "\n").encode())
+            self.process.stdin.flush()
+            while True:
+                try:
+                    reply = self._reply(0.5)
+                except EOFError:
+                    # the worker died, e.g. asrtranslate crashed the interpreter
+                    self.process.wait()
+                    return WorkerResult(self.pid, None)
+                if reply is not None:
+                    if reply.get("ready"):
+                        continue
+                    self.jobs += 1
+                    # the last lines of output may still be in the pipes
+                    self._request_done.wait(drain_timeout)
+                    return WorkerResult(
+                        self.pid,
+                        reply["return_code"],
+                        reply.get("cpu_seconds"),
+                        reply.get("max_rss_kb"),
+                    )
+                if cancel_event.is_set():
+                    self.stop()
+                    return WorkerResult(self.pid, None, stopped="cancelled")
+                if deadline is not None and time.time() > deadline:
+                    self.stop()
+                    return WorkerResult(self.pid, None, stopped="timeout")
+        except (BrokenPipeError, ValueError):
+            self.stop()
+            return WorkerResult(self.pid, None)
+        finally:
+            self.sink = None
+
+    def close(self) -> None:
+        """
+        let the worker exit after its current request, kill it if it doesn't.
+        """
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=self.kill_grace)
+        except (OSError, subprocess.TimeoutExpired):
+            self.stop()
+        os.close(self._replies)
+
+    def stop(self) -> None:
+        """
+        terminate the worker and everything it started, kill it if it doesn't stop.
+        """
+        try:
+            os.killpg(self.pid, signal.SIGTERM)
+            self.process.wait(timeout=self.kill_grace)
+        except ProcessLookupError:
+            return
+        except subprocess.TimeoutExpired:
+            logger.warning(f"worker {self.pid} did not stop, killing it")
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+
+
+class WorkerPool:
+    """
+    long-lived asrtranslate workers, so a translation doesn't pay for
+    starting the interpreter and importing asrtranslate (and its models).
+
+    size workers are started up front. A worker is replaced when it died,
+    was stopped (cancel or timeout), ran max_jobs requests or grew above
+    max_rss_mb.
+    """
+
+    def __init__(
+        self,
+        command: list[str],
+        cwd: Path,
+        size: int,
+        max_jobs: int = 100,
+        max_rss_mb: int = 0,
+        kill_grace: float = 10.0,
+        drain_timeout: float = 5.0,
+        limiter: ProcessLimiter | None = None,
+    ) -> None:
+        self.command = command
+        self.cwd = cwd
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self.kill_grace = kill_grace
+        self.drain_timeout = drain_timeout
+        self.limiter = limiter
+
+        self.spawned = 0
+        self.restarted = 0  # replaced after dying or being stopped
+        self.recycled = 0  # replaced after max_jobs or max_rss_mb
+        self.jobs = 0
+
+        self._cond = threading.Condition()
+        self._idle: list[Worker] = []
+        self._busy: set[Worker] = set()
+        self._stopped = True
+
+    def _spawn(self) -> Worker:
+        preexec_fn = self.limiter.preexec() if self.limiter is not None else None
+        worker = Worker(self.command, self.cwd, self.kill_grace, preexec_fn)
+        if self.limiter is not None:
+            worker.envelope = self.limiter.apply(worker.pid, f"worker-{worker.pid}")
+        self.spawned += 1
+        logger.info(f"Started asrtranslate worker {worker.pid}")
+        return worker
+
+    def _close(self, worker: Worker) -> None:
+        worker.close()
+        if worker.envelope is not None:
+            self.limiter.release(worker.envelope)
+            if worker.envelope.oom_killed:
+                logger.warning(f"asrtranslate worker {worker.pid} went over its memory limit")
+
+    def start(self) -> None:
+        with self._cond:
+            self._stopped = False
+            while len(self._idle) + len(self._busy) < self.size:
+                self._idle.append(self._spawn())
+
+    def stop(self) -> None:
+        """
+        close the idle workers; busy ones are closed when their request is done.
+        """
+        with self._cond:
+            self._stopped = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for worker in idle:
+            self._close(worker)
+
+    def _checkout(
+        self, cancel_event: threading.Event, deadline: float | None
+    ) -> Worker | str:
+        """
+        an idle worker, or why none was taken ("cancelled" or "timeout").
+        """
+        with self._cond:
+            while not self._idle:
+                if self._stopped or cancel_event.is_set():
+                    return "cancelled"
+                if deadline is not None and time.time() > deadline:
+                    return "timeout"
+                self._cond.wait(0.5)
+            worker = self._idle.pop()
+            if not worker.alive():
+                logger.warning(f"asrtranslate worker {worker.pid} died, restarting it")
+                self.restarted += 1
+                self._close(worker)
+                worker = self._spawn()
+            self._busy.add(worker)
+            return worker
+
+    def _checkin(self, worker: Worker, result: WorkerResult) -> None:
+        replace = None
+        if result.return_code is None:
+            replace = "restart"
+        elif worker.jobs >= self.max_jobs:
+            replace = "recycle"
+        elif self.max_rss_mb:
+            rss_mb = process_rss_mb(worker.pid)
+            if rss_mb is not None and rss_mb > self.max_rss_mb:
+                replace = "recycle"
+
+        if replace is not None:
+            if replace == "restart":
+                self.restarted += 1
+            else:
+                self.recycled += 1
+            self._close(worker)
+        with self._cond:
+            self._busy.discard(worker)
+            if self._stopped:
+                if replace is None:
+                    self._close(worker)
+                return
+            if replace is not None:
+                worker = self._spawn()
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def run(
+        self,
+        argv: list[str],
+        output: LanguageOutput | None,
+        cancel_event: threading.Event,
+        deadline: float | None = None,
+    ) -> WorkerResult:
+        """
+        run asrtranslate with argv on an idle worker, waiting for one if
+        every worker is busy. The run is stopped when cancel_event is set
+        or the deadline passes.
+        """
+        worker = self._checkout(cancel_event, deadline)
+        if isinstance(worker, str):
+            return WorkerResult(0, None, stopped=worker)
+        result = WorkerResult(worker.pid, None)
+        try:
+            result = worker.run(
+                argv, output, cancel_event, deadline, self.drain_timeout
+            )
+            self.jobs += 1
+            return result
+        finally:
+            self._checkin(worker, result)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "busy": len(self._busy),
+                "spawned": self.spawned,
+                "restarted": self.restarted,
+                "recycled": self.recycled,
+                "jobs": self.jobs,
+            }
@@ -0,0 +1,58 @@
+import logging
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class _Sink:
+    """
+    the unseekable file a streamed zip is written to, it only keeps what
+    was written since the last take().
+    """
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files: list[tuple[str, Path]], chunk_size: int = 2**16) -> Iterator[bytes]:
+    """
+    a zip of files, (name in the zip, path) pairs, built while it is sent:
+    nothing is written to disk and only chunk_size bytes of a file are in
+    memory at a time. Entries are stored, not compressed (the results are
+    IDML packages, compressed already). Files that are gone are left out.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, path in files:
+            try:
+                info = zipfile.ZipInfo.from_file(path, name)
+                source = open(path, "rb")
+            except FileNotFoundError:
+                logger.warning(f"{path} is gone, left out of the zip")
+                continue
+            info.compress_type = zipfile.ZIP_STORED
+            with source, archive.open(
+                info, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT
+            ) as entry:
+                while chunk := source.read(chunk_size):
+                    entry.write(chunk)
+                    if data := sink.take():
+                        yield data
+            if data := sink.take():
+                yield data
+    if data := sink.take():
+        yield data